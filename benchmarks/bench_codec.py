@@ -0,0 +1,58 @@
+"""Measure the JSON throughput of each available codec.
+
+Times decoding member pages (as api.decode_response does) and encoding the
+vars of members for a bulk upload (as MailingList.bulk_add_members does),
+with the json module and, if it is installed, orjson.
+
+Usage: python benchmarks/bench_codec.py [members-per-page]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyholster import codec  # noqa: E402
+
+
+def page(count):
+    return {'items': [{'address': 'member{}@example.com'.format(i),
+                       'name': 'Member {}'.format(i),
+                       'vars': {'id': i, 'group': i % 10, 'locale': 'en',
+                                'tags': ['a', 'b', 'c']},
+                       'subscribed': True}
+                      for i in range(count)],
+            'paging': {'next': 'https://api.mailgun.net/v3/lists/pages'}}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    body = json.dumps(page(count)).encode('utf-8')
+    members = page(count)['items']
+    names = ['json'] + (['orjson'] if codec.orjson is not None else [])
+
+    print("{} members per page:".format(count))
+
+    for name in names:
+        current = codec.set_codec(name)
+
+        number, total = timeit.Timer(
+            lambda: current.loads(body)).autorange()
+        decode = count * number / total
+
+        number, total = timeit.Timer(
+            lambda: [current.dumps(member['vars']) for member in members] +
+            [current.dumps(members)]).autorange()
+        encode = count * number / total
+
+        print("  {:8} decode {:10.0f} members/s   encode {:10.0f} "
+              "members/s".format(name, decode, encode))
+
+    codec.set_codec()
+
+
+if __name__ == '__main__':
+    main()
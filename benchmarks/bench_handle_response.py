@@ -0,0 +1,87 @@
+"""Measure the per-response overhead of api.decode_response.
+
+Compares the current response handler with the handler as it was before it
+decoded the body only once (which decoded up to four times, always formatted
+an error message and always formatted the debug log line).
+
+Usage: python benchmarks/bench_handle_response.py [members-per-page]
+"""
+
+import json
+import logging
+import os
+import sys
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyholster import api  # noqa: E402
+
+logger = logging.getLogger('pyholster.api')
+
+
+def legacy_handle_response(r, *args, **kwargs):
+    """The response handler before the rework."""
+
+    message = "[{request[method]}] {request[url]} :: {reason}".format(
+        request=r.request.__dict__, reason=r.reason)
+
+    logger.debug("PH handle: {} || {} || {}".format(r, dir(r), r.text))
+
+    try:
+        r.json()
+    except ValueError as E:
+        raise api.ServerError(r.text) from E
+
+    if 'token' in r.json():
+        pass
+
+    if r.status_code in api.html_status_codes:
+        raise api.html_status_codes[r.status_code](message)
+
+    return r.json()
+
+
+def make_response(members):
+    """Build a response holding a page of `members` members."""
+
+    body = json.dumps({'items': [
+        {'address': 'member{}@example.com'.format(i),
+         'name': 'Member {}'.format(i),
+         'subscribed': True,
+         'vars': {'id': i, 'age': 21}} for i in range(members)]})
+
+    request = requests.Request(
+        'GET', api.baseurl + '/lists/list@example.com/members').prepare()
+
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.encoding = 'utf-8'
+    response.request = request
+    response._content = body.encode('utf-8')
+    return response
+
+
+def bench(func, response, number):
+    return min(timeit.repeat(lambda: func(response), number=number,
+                             repeat=5)) / number
+
+
+def main(members=100):
+    logging.basicConfig(level=logging.WARNING)
+    response = make_response(members)
+    number = max(10, 20000 // members)
+
+    print("Per-response overhead, {} members per page:".format(members))
+    before = bench(legacy_handle_response, response, number)
+    after = bench(api.decode_response, response, number)
+    print("  before: {:10.1f} us".format(before * 1e6))
+    print("  after:  {:10.1f} us".format(after * 1e6))
+    print("  speedup: {:.2f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
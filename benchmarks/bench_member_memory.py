@@ -0,0 +1,83 @@
+"""Measure the memory used by the members of a large MailingList.
+
+Compares the current Member with the Member as it was before it was made
+compact (an instance dict per Member, and a deep copy of the name, vars and
+subscription to find changes with).
+
+Usage: python benchmarks/bench_member_memory.py [members]
+"""
+
+import copy
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyholster import MailingList, Member  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+class LegacyMember(object):
+
+    """The Member before the rework: only what affects its size."""
+
+    tracked_fields = ('name', 'vars', 'subscribed')
+
+    def __init__(self, **kwargs):
+        self.address = kwargs['address']
+        self.name = kwargs.get('name')
+        self.vars = kwargs.get('vars', {})
+        self.subscribed = kwargs.get('subscribed', True)
+        self.mailing_list = kwargs.get('mailing_list')
+        self._client = kwargs.get('client')
+        self._implemented = kwargs.get('implemented')
+        self._clean = dict((field, copy.deepcopy(getattr(self, field)))
+                           for field in self.tracked_fields)
+
+
+def pages(count):
+    """Generate the member pages as Mailgun sends them, decoded."""
+
+    for start in range(0, count, PAGE_SIZE):
+        yield json.loads(json.dumps([
+            {'address': 'member{}@example.com'.format(i),
+             'name': 'Member {}'.format(i),
+             'vars': {'id': i, 'group': i % 10, 'locale': 'en'},
+             'subscribed': True}
+            for i in range(start, min(count, start + PAGE_SIZE))]))
+
+
+def measure(cls, count):
+    lst = MailingList(address='list@example.com')
+
+    gc.collect()
+    tracemalloc.start()
+    members = [cls(mailing_list=lst, implemented=True, **data)
+               for page in pages(count) for data in page]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(members) == count
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    legacy = measure(LegacyMember, count)
+    current = measure(Member, count)
+
+    print("{} members:".format(count))
+    print("  legacy:  {:8.1f} MB ({:.0f} bytes per member)".format(
+        legacy / 2 ** 20, legacy / count))
+    print("  current: {:8.1f} MB ({:.0f} bytes per member)".format(
+        current / 2 ** 20, current / count))
+    print("  saved:   {:8.1f}%".format(100 * (1 - current / legacy)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Measure the messages per second of PreparedMail against Mail.
+
+Both paths build, check and encode the request as they would when sending,
+but the request is answered by a local Transport instead of Mailgun, so
+only the client-side cost per message is measured.
+
+Usage: python benchmarks/bench_prepared_mail.py [html-size-in-kb]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pyholster as ph  # noqa: E402
+
+
+class LocalTransport(ph.Transport):
+
+    """Prepare requests like `requests` does, and answer them locally."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.pop('timeout', None)
+        request = requests.Request(method, url, **kwargs).prepare()
+
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response._content = json.dumps(
+            {'message': "Queued. Thank you.", 'id': "<1@example.com>"}
+        ).encode('utf-8')
+        return response
+
+
+def main(html_kb=20):
+    client = ph.Client('key-test', transport=LocalTransport())
+
+    template = dict(domain='example.com',
+                    sender='shop@example.com',
+                    html='<p>{}</p>'.format('x' * html_kb * 1024),
+                    text='x' * html_kb * 1024,
+                    options={'tracking': 'yes', 'tag': 'order'},
+                    headers={'X-Mailer': 'pyholster'},
+                    client=client)
+
+    def plain():
+        ph.Mail(to='customer@example.com', subject='Your order',
+                variables={'order': 123}, **template).send()
+
+    prepared_mail = ph.PreparedMail(**template)
+
+    def prepared():
+        prepared_mail.send(to='customer@example.com', subject='Your order',
+                           variables={'order': 123})
+
+    number = 2000
+    print("Messages per second, {} KB html and text:".format(html_kb))
+    before = min(timeit.repeat(plain, number=number, repeat=5)) / number
+    after = min(timeit.repeat(prepared, number=number, repeat=5)) / number
+    print("  Mail:         {:10.0f}".format(1 / before))
+    print("  PreparedMail: {:10.0f}".format(1 / after))
+    print("  speedup: {:.2f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
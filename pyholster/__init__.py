@@ -1,6 +1,9 @@
 from . import errors
 from . import api
+from . import retry
+from .api import Client
+from .transport import Transport
 from .list import MailingList
 from .member import Member
 from .route import Route
-from .mail import Mail
+from .mail import Mail, PreparedMail
@@ -0,0 +1,741 @@
+"""asyncio variants of the api module and the model classes.
+
+The coroutines in this module mirror :mod:`pyholster.api`, and the classes
+mirror :class:`pyholster.MailingList`, :class:`pyholster.Member`,
+:class:`pyholster.Route` and :class:`pyholster.Mail`, with the methods that
+talk to Mailgun being coroutines. All AsyncClients share one aiohttp
+connection pool per event loop, unless they are given their own session.
+
+This module requires aiohttp.
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import weakref
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from . import api
+from . import cache
+from . import codec
+from . import errors
+from . import multipart
+from . import ratelimit
+from .concurrency import Result, Results
+from . import list as _list
+from . import mail as _mail
+from .list import MailingList as _MailingList
+from .mail import Mail as _Mail
+from .member import Member as _Member
+from .route import Route as _Route
+
+logger = logging.getLogger(__name__)
+
+pool_limit = 100
+pool_limit_per_host = 0
+pool_timeout = 60
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+def configure_pool(limit=100, limit_per_host=0, timeout=60):
+    """Configure the shared connection pool: the total number of
+    connections, the number of connections per host (0 is unlimited) and the
+    total timeout per request in seconds. Applies to pools created after
+    this call; see :func:`close`."""
+
+    global pool_limit, pool_limit_per_host, pool_timeout
+    pool_limit, pool_limit_per_host, pool_timeout = (
+        limit, limit_per_host, timeout)
+
+
+def get_session():
+    """Return the shared session of the running event loop."""
+
+    if aiohttp is None:
+        raise ImportError("pyholster.aio requires aiohttp.")
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_limit,
+                                           limit_per_host=pool_limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=pool_timeout))
+        _sessions[loop] = session
+
+    return session
+
+
+async def close():
+    """Close the shared session of the running event loop."""
+
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class AsyncClient(object):
+
+    """Send requests to Mailgun from asyncio code on behalf of one account.
+    See :class:`pyholster.Client`. By default the shared connection pool of
+    the running event loop is used; pass an aiohttp `session` to use another
+    pool."""
+
+    def __init__(self, key, baseurl='https://api.mailgun.net/v3',
+                 session=None, rate_limiter=None, retry_policy=None):
+
+        self.key = key
+        self.baseurl = baseurl
+        self._session = session
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy
+
+    @property
+    def session(self):
+        return self._session or get_session()
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter or api.rate_limiter
+
+    @property
+    def retry_policy(self):
+        return self._retry_policy or api.retry_policy
+
+    async def request(self, method, url, params=None, data=None, files=None):
+        """Send a request and return the decoded response."""
+
+        if not self.key:
+            raise api.APIKeyError("No API key provided.")
+
+        if not url.startswith(('http://', 'https://')):
+            url = self.baseurl + url
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("PH %s: %s, %s", method, url, params or data)
+
+        kwargs = {'headers': {'Authorization': 'Basic ' + base64.b64encode(
+            'api:{}'.format(self.key).encode()).decode()}}
+        if params:
+            kwargs['params'] = dict((key, str(value))
+                                    for key, value in params.items())
+
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            limiter = ratelimit.limiter_for(self.rate_limiter, url)
+            if limiter is not None:
+                wait = limiter.try_acquire()
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = limiter.try_acquire()
+
+            if data is not None or files:
+                kwargs['data'] = _form_data(data or {}, files)
+
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    status, reason = r.status, r.reason
+                    retry_after = r.headers.get('Retry-After')
+                    text = await r.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as E:
+                delay = self._retry_delay(
+                    method, attempt, error=E,
+                    sent=not isinstance(E, aiohttp.ClientConnectorError))
+                if delay is None:
+                    raise api.ConnectionError() from E
+            else:
+                delay = self._retry_delay(method, attempt, status=status,
+                                          retry_after=retry_after)
+                if delay is None:
+                    break
+
+            await asyncio.sleep(delay)
+            api._rewind(data, files)
+
+        def describe(detailed=False):
+            if detailed:
+                return "[{}] {} :: {} :: {} :: {}".format(
+                    method, url, status, text, reason)
+            return "[{}] {} :: {}".format(method, url, reason)
+
+        try:
+            decoded = codec.loads(text)
+        except ValueError as E:
+            raise api.ServerError(describe(detailed=True)) from E
+
+        return api.check_response(decoded, status, self.key, describe)
+
+    def _retry_delay(self, method, attempt, **kwargs):
+        """Return the delay before retrying, or None to not retry."""
+
+        if self.retry_policy is None:
+            return None
+        return self.retry_policy.delay(method, attempt, **kwargs)
+
+    async def get(self, url, params=None):
+        """Send a GET request."""
+
+        return await self.request('GET', url, params=params)
+
+    async def post(self, url, data, files=None):
+        """Send a POST request."""
+
+        return await self.request('POST', url, data=data, files=files)
+
+    async def put(self, url, data):
+        """Send a PUT request."""
+
+        return await self.request('PUT', url, data=data)
+
+    async def delete(self, url):
+        """Send a DELETE request."""
+
+        return await self.request('DELETE', url)
+
+    async def iter_pages(self, url, params=None):
+        """Generate the pages of a paginated resource, following the `paging`
+        cursors Mailgun returns. See :meth:`pyholster.Client.iter_pages`."""
+
+        while url:
+            response = await self.get(url, params)
+            items = response.get('items')
+            if not items:
+                return
+            yield items
+            url, params = response.get('paging', {}).get('next'), None
+
+
+class _DefaultAsyncClient(AsyncClient):
+
+    """The AsyncClient used when none is given. It follows the module-level
+    `apikey` and `baseurl` of :mod:`pyholster.api`."""
+
+    def __init__(self):
+
+        self._session = None
+        self._rate_limiter = None
+        self._retry_policy = None
+
+    key = property(lambda self: api.apikey)
+    baseurl = property(lambda self: api.baseurl)
+
+
+default_client = _DefaultAsyncClient()
+
+
+def get_client(client=None):
+    """Return `client`, or the default AsyncClient if it is None."""
+
+    return client if client is not None else default_client
+
+
+async def get(url, params=None):
+    """Send a GET request."""
+
+    return await default_client.get(url, params)
+
+
+async def post(url, data, files=None):
+    """Send a POST request."""
+
+    return await default_client.post(url, data, files=files)
+
+
+async def put(url, data):
+    """Send a PUT request."""
+
+    return await default_client.put(url, data)
+
+
+async def delete(url):
+    """Send a DELETE request."""
+
+    return await default_client.delete(url)
+
+
+async def run(func, items, limit=100):
+    """Await `func(item)` for every item, with at most `limit` at a time, and
+    return the Results (see :mod:`pyholster.concurrency`)."""
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def call(item):
+        async with semaphore:
+            try:
+                return Result(item, value=await func(item))
+            except Exception as E:
+                return Result(item, error=E)
+
+    return Results(await asyncio.gather(*(call(item) for item in items)))
+
+
+def _form_data(data, files=None):
+    """Encode data (and files) like `requests` does: lists become repeated
+    fields and None values are left out."""
+
+    form = aiohttp.FormData()
+
+    for key, value in data.items():
+        for value in (value if isinstance(value, (list, tuple)) else [value]):
+            if value is not None:
+                form.add_field(key, str(value))
+
+    if isinstance(files, dict):
+        files = files.items()
+    for name, content in files or ():
+        filename, content_type = None, None
+        if isinstance(content, tuple):
+            filename, content, content_type = (content + (None,))[:3]
+        if isinstance(content, os.PathLike):
+            filename = filename or os.path.basename(content)
+            content = open(content, 'rb')
+        elif multipart._is_buffer(content) and \
+                not isinstance(content, bytes):
+            content = memoryview(content)
+        form.add_field(name, content, content_type=content_type,
+                       filename=filename or name)
+
+    return form
+
+
+class Member(_Member):
+
+    """asyncio variant of :class:`pyholster.Member`."""
+
+    __slots__ = ()
+
+    @property
+    def client(self):
+        if self._client is None and self.mailing_list is not None:
+            return getattr(self.mailing_list, 'client', default_client)
+        return get_client(self._client)
+
+    @classmethod
+    async def load(cls, lst, address, client=None):
+        if client is None:
+            client = getattr(lst, 'client', None)
+
+        try:
+            response = await get_client(client).get(
+                '/lists/{}/members/{}'.format(lst.address, address))
+        except api.CommunicationError:
+            raise cls.MemberNotLoadable(
+                "Could not load Member from Mailgun.")
+
+        data = response['member']
+        return cls(mailing_list=lst,
+                   client=client,
+                   address=data['address'],
+                   name=data.get('name'),
+                   vars=data.get('vars', {}),
+                   subscribed=data['subscribed'],
+                   implemented=True)
+
+    async def update(self, **kwargs):
+        update_data = self._prepare_update(kwargs)
+
+        if not len(update_data):
+            return True
+
+        try:
+            await self.client.put(self._url(), update_data)
+        except api.NotFound as E:
+            object.__setattr__(self, '_implemented', False)
+            raise self.MemberNotImplemented(
+                "Can not update non-implemented Member. Insert first.") from E
+        except api.CommunicationError as E:
+            raise self.MemberNotUpdated("Could not update Member.") from E
+        else:
+            self._updated()
+            return True
+
+    async def delete(self):
+        try:
+            await self.client.delete(self._url())
+        except api.CommunicationError as E:
+            raise self.MemberNotDeleted("Could not delete Member.") from E
+        else:
+            self._deleted()
+            return True
+
+    async def implement(self):
+        if self._implemented:
+            return await self.update()
+
+        try:
+            await self.client.post(
+                '/lists/{}/members'.format(self.mailing_list.address),
+                self._insert_data(upsert=False))
+        except api.BadRequest:
+            return await self.update(name=self.name, vars=self.vars,
+                                     subscribed=self.subscribed)
+        except api.CommunicationError as E:
+            raise self.MemberNotImplemented(
+                "Could not implement Member.") from E
+        else:
+            self._updated()
+            return True
+
+    async def upsert(self):
+        if self._implemented and not self.is_dirty:
+            return True
+
+        try:
+            await self.client.post(
+                '/lists/{}/members'.format(self.mailing_list.address),
+                self._insert_data(upsert=True))
+        except api.CommunicationError as E:
+            raise self.MemberNotUpdated("Could not upsert Member.") from E
+        else:
+            self._updated()
+            return True
+
+    async def is_implemented(self):
+        if self._implemented is None:
+            try:
+                await self.__class__.load(self.mailing_list, self.address,
+                                          client=self.client)
+            except self.MemberNotLoadable:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+
+        return self._implemented
+
+
+class MailingList(_MailingList):
+
+    """asyncio variant of :class:`pyholster.MailingList`. The members are
+    not loaded implicitly: use `load_members()` or `iter_members()`."""
+
+    def __init__(self, **kwargs):
+
+        _MailingList.__init__(self, **kwargs)
+        object.__setattr__(self, 'client', get_client(kwargs.get('client')))
+
+    @property
+    def members(self):
+        if not hasattr(self, '_members'):
+            raise AttributeError(
+                "The members are not loaded. Use load_members() first.")
+        return self._members
+
+    @classmethod
+    async def load(cls, address, client=None):
+        try:
+            response = await get_client(client).get(
+                '/lists/{}'.format(address))
+        except api.CommunicationError:
+            raise cls.MailingListNotLoadable(
+                "Could not load MailingList from Mailgun.")
+        data = response['list']
+        return cls(address=address,
+                   name=data.get('name', None),
+                   description=data.get('description', None),
+                   access_level=data.get('access_level'),
+                   client=client,
+                   implemented=True)
+
+    @classmethod
+    async def load_all(cls, client=None, page_size=100):
+        """Generate all MailingLists, loading them page by page."""
+
+        pages = get_client(client).iter_pages('/lists/pages',
+                                              {'limit': page_size})
+        try:
+            async for page in pages:
+                for data in page:
+                    yield cls(client=client, implemented=True, **data)
+        except api.CommunicationError as E:
+            raise LookupError(
+                'Could not load any MailingLists from Mailgun.') from E
+
+    async def update(self, safe=True, **kwargs):
+        if safe and self._implemented is False:
+            await self.implement()
+
+        update_data = self._prepare_update(kwargs)
+
+        if not len(update_data) or not safe:
+            return True
+
+        url = '/lists/{}'.format(self.address)
+
+        try:
+            await self.client.put(url, update_data)
+        except api.NotFound:
+            object.__setattr__(self, '_implemented', False)
+            await self.implement()
+            await self.client.put(url, update_data)
+
+        self._updated()
+        return True
+
+    async def implement(self):
+        if not self._implemented:
+            await self.client.post('/lists', self.get_data())
+            self._updated()
+
+        return await self.save_members()
+
+    async def delete(self):
+        await self.client.delete('/lists/{}'.format(self.address))
+        object.__setattr__(self, '_implemented', False)
+        cache.invalidate_list(self.client, self.address)
+        return True
+
+    async def is_implemented(self):
+        if self._implemented is None:
+            try:
+                await self.__class__.load(self.address, client=self.client)
+            except self.MailingListNotLoadable:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+
+        return self._implemented
+
+    async def iter_members(self, page_size=100):
+        """Generate all members, loading them from Mailgun page by page."""
+
+        pages = self.client.iter_pages(
+            '/lists/{}/members/pages'.format(self.address),
+            {'limit': page_size})
+
+        async for page in pages:
+            for member in page:
+                yield Member(mailing_list=self, implemented=True, **member)
+
+    async def load_members(self, page_size=100):
+        """Load all members of the MailingList."""
+
+        object.__setattr__(self, '_members', [
+            member async for member in self.iter_members(page_size)])
+        self.reindex()
+        return self._members
+
+    async def save_members(self, limit=100):
+        """Upsert the loaded members that are new or changed, with at most
+        `limit` requests at a time. Return the Results per member."""
+
+        if not hasattr(self, '_members'):
+            return Results()
+
+        return await run(lambda member: member.upsert(), self._members,
+                         limit)
+
+    async def flush(self):
+        """Send all local changes to Mailgun. See
+        :meth:`pyholster.MailingList.flush`."""
+
+        if self.is_dirty:
+            await self.update()
+
+        if not hasattr(self, '_members'):
+            return []
+
+        dirty = [member for member in self._members
+                 if not member._implemented or member.is_dirty]
+
+        return await self.bulk_add_members(dirty) if dirty else []
+
+    async def add_member(self, member):
+        """Add a member (an asyncio Member) to the MailingList."""
+
+        member.mailing_list = self
+        await member.upsert()
+        self._add_loaded_member(member)
+
+    async def add_members(self, members, limit=100):
+        """Add multiple members (asyncio Members or dicts), with at most
+        `limit` requests at a time. Return the Results per member."""
+
+        async def add(member):
+            await member.upsert()
+            self._add_loaded_member(member)
+
+        def prepare(member):
+            if isinstance(member, dict):
+                member = Member(**member)
+            member.mailing_list = self
+            return member
+
+        return await run(add, [prepare(member) for member in members],
+                         limit)
+
+    async def bulk_add_members(self, members, upsert=True, chunk_size=1000,
+                               limit=1):
+        """Add (or with `upsert`, add or update) members in bulk, with at
+        most `limit` requests at a time. See
+        :meth:`pyholster.MailingList.bulk_add_members`."""
+
+        if not 0 < chunk_size <= 1000:
+            raise ValueError("'chunk_size' should be between 1 and 1000.")
+
+        async def send(chunk):
+            try:
+                response = await self.client.post(
+                    self._bulk_url(), _list._bulk_data(chunk, upsert))
+            except (api.CommunicationError, api.ConnectionError) as E:
+                return _list.BulkResult(chunk, error=E)
+            return self._bulk_sent(chunk, response)
+
+        results = [result.value if result.ok
+                   else _list.BulkResult(result.item, error=result.error)
+                   for result in await run(
+                       send, list(_list._chunks(members, chunk_size, Member)),
+                       limit)]
+
+        self._bulk_added(results)
+        return results
+
+    async def delete_all_members(self, limit=100):
+        """Try to delete all loaded members, with at most `limit` requests
+        at a time. Return the Results per member."""
+
+        members = list(self.members)
+        del self._members[:]
+        self.reindex()
+
+        results = await run(lambda member: member.delete(), members, limit)
+
+        for result in results.failed:
+            self._add_loaded_member(result.item)
+
+        return results
+
+    def plan(self, *args, **kwargs):
+        raise TypeError("plan() is not supported by the asyncio "
+                        "MailingList.")
+
+    def reconcile(self, *args, **kwargs):
+        raise TypeError("reconcile() is not supported by the asyncio "
+                        "MailingList.")
+
+
+class Route(_Route):
+
+    """asyncio variant of :class:`pyholster.Route`."""
+
+    def __init__(self, **kwargs):
+
+        _Route.__init__(self, **kwargs)
+        object.__setattr__(self, 'client', get_client(kwargs.get('client')))
+
+    @classmethod
+    async def load(cls, id, client=None):
+        try:
+            response = await get_client(client).get('/routes/{}'.format(id))
+        except errors.PHException:
+            raise LookupError('Could not load Route from Mailgun.')
+        else:
+            return cls(client=client, implemented=True, **response['route'])
+
+    @classmethod
+    async def load_all(cls, client=None, page_size=100):
+        """Generate all Routes, loading them page by page."""
+
+        skip = 0
+        while True:
+            try:
+                response = await get_client(client).get(
+                    '/routes', {'skip': skip, 'limit': page_size})
+            except errors.PHException:
+                raise LookupError('Could not load Routes from Mailgun.')
+
+            items = response.get('items') or []
+            for data in items:
+                yield cls(client=client, implemented=True, **data)
+
+            if len(items) < page_size:
+                return
+            skip += len(items)
+
+    async def update(self, **kwargs):
+        update_data = self._prepare_update(kwargs)
+
+        if len(update_data):
+            try:
+                await self.client.put('/routes/{}'.format(self.id),
+                                      update_data)
+            except api.NotFound as E:
+                object.__setattr__(self, '_implemented', False)
+                raise errors.PHException(
+                    'Cannot update non-implemented Route. '
+                    'Implement first.') from E
+            self._updated()
+
+        return True
+
+    async def implement(self):
+        if await self.is_implemented():
+            raise errors.PHException("This Route is already implemented.")
+
+        response = await self.client.post('/routes', self.get_data())
+        object.__setattr__(self, 'id', response['route']['id'])
+        self._updated()
+        return True
+
+    async def delete(self):
+        await self.client.delete('/routes/{}'.format(self.id))
+        object.__setattr__(self, '_implemented', False)
+        cache.invalidate(self.client, '/routes/{}'.format(self.id))
+        return True
+
+    async def is_implemented(self):
+        if not self.id:
+            return False
+        if self._implemented is None:
+            try:
+                await self.__class__.load(self.id, client=self.client)
+            except LookupError:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+        return self._implemented
+
+
+class Mail(_Mail):
+
+    """asyncio variant of :class:`pyholster.Mail`."""
+
+    async def send(self, client=None):
+        url, data, files = self._prepare_send()
+
+        response = await get_client(client or self.client).post(
+            url, data, files=files)
+
+        return self._sent(response)
+
+    async def send_batch(self, recipients, batch_size=1000, client=None):
+        """Send the Mail to many recipients in batches, one batch at a time.
+        See :meth:`pyholster.Mail.send_batch`."""
+
+        if not 0 < batch_size <= 1000:
+            raise ValueError("'batch_size' should be between 1 and 1000.")
+
+        url, data, files = self._prepare_send(batch=True)
+        client = get_client(client or self.client)
+        results = []
+
+        for batch in _mail._batches(recipients, batch_size):
+            api._rewind(None, files)
+            try:
+                response = await client.post(
+                    url, dict(data, **_mail._batch_data(batch)), files=files)
+                results.append(_mail.BatchResult(
+                    batch, id=_mail._queued_id(response)))
+            except errors.PHException as E:
+                results.append(_mail.BatchResult(batch, error=E))
+
+        return results
@@ -4,22 +4,39 @@ import requests
 import hashlib
 import hmac
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import codec
+from . import errors
+from . import ratelimit
+from .multipart import MultipartBody
+from .stream import ItemStream
+from .transport import Transport
 
 logger = logging.getLogger(__name__)
 
 baseurl = 'https://api.mailgun.net/v3'
 apikey = None
+transport = Transport()
+rate_limiter = None
+retry_policy = None
+
+# The size of the chunks in which streamed responses are read.
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
-class APIKeyError(Exception): pass
-class ConnectionError(Exception): pass
-class TokenError(Exception): pass
+class APIKeyError(errors.PHException): pass
+class ConnectionError(errors.PHException): pass
+class TokenError(errors.PHException): pass
 
-class CommunicationError(Exception): pass
+class CommunicationError(errors.PHException): pass
 class BadRequest(CommunicationError): pass
 class Unauthorized(CommunicationError): pass
 class Failed(CommunicationError): pass
 class NotFound(CommunicationError): pass
 class NotAcceptable(CommunicationError): pass
+class TooManyRequests(CommunicationError): pass
 class ServerError(CommunicationError): pass
 
 html_status_codes = {
@@ -28,6 +45,7 @@ html_status_codes = {
     402: Failed,
     404: NotFound,
     406: NotAcceptable,
+    429: TooManyRequests,
     500: ServerError,
     502: ServerError,
     503: ServerError,
@@ -41,130 +59,406 @@ def set_key(key):
     apikey = key
 
 
-def get(url, params={}):
-    """Send a GET request."""
+def set_transport(new_transport):
+    """Set the Transport (connection pool) to use. The connections of the
+    previous Transport are closed."""
 
-    if not apikey:
-        raise APIKeyError("No API key provided.")
+    global transport
+    old_transport, transport = transport, new_transport
+    if old_transport is not new_transport:
+        old_transport.close()
 
-    url = baseurl + url
 
-    logger.debug("PH GET: {}, {}".format(url, params))
+def configure_transport(**kwargs):
+    """Replace the Transport by one configured with the given keyword
+    arguments (e.g. `pool_maxsize`, `timeout`). See :class:`Transport`."""
 
-    try:
-        response = handle_response(
-            requests.get(url, auth=('api', apikey), params=params))
+    set_transport(Transport(**kwargs))
 
-        return response.json()
 
-    except requests.exceptions.ConnectionError as E:
-        raise ConnectionError() from E
+def set_rate_limit(rate, capacity=None, path=None, **endpoints):
+    """Limit all Clients without their own rate limiter to `rate` requests
+    per second (with bursts of `capacity`). Pass None to remove the limit.
 
+    Separate rates can be set per endpoint class, e.g.
+    ``set_rate_limit(20, messages=5, lists=10)``. With `path` (a directory)
+    the limits are shared between all processes using the same `path`."""
 
-def post(url, data, files=None):
-    """Send a POST request."""
+    global rate_limiter
+    rate_limiter = ratelimit.make_limiter(rate, capacity, path, **endpoints)
 
-    if not apikey:
-        raise APIKeyError("No API key provided.")
 
-    url = (baseurl + url).format(**globals())
+def set_retry_policy(policy):
+    """Set the RetryPolicy of all Clients without their own policy. Pass None
+    to disable retries."""
 
-    logger.debug("PH GET: {}, {}".format(url, data))
+    global retry_policy
+    retry_policy = policy
 
-    try:
-        attributes = {'auth': ('api', apikey),
-                      'data': (data)}
 
-        if files:
-            attributes['files'] = files
+def close():
+    """Close all pooled connections of the current Transport."""
 
-        response = handle_response(
-            requests.post(url, **attributes), (url, attributes))
+    transport.close()
 
-        return response.json()
 
-    except requests.exceptions.ConnectionError as E:
-        raise ConnectionError() from E
+def reset():
+    """Forget the pooled connections without closing them, e.g. in a forked
+    child process. This happens automatically on `os.fork()`."""
 
+    transport.reset()
 
-def put(url, data):
-    """Send a PUT request."""
 
-    if not apikey:
-        raise APIKeyError("No API key provided.")
+class Client(object):
 
-    url = baseurl + url
+    """Send requests to Mailgun on behalf of one account.
 
-    logger.debug("PH GET: {}, {}".format(url, data))
+    A Client holds the API `key`, the `baseurl` (e.g. the EU endpoint
+    ``https://api.eu.mailgun.net/v3``) and the Transport to use. Clients do
+    not share mutable state, so several Clients with different keys or
+    regions can be used from multiple threads at the same time. By default
+    all Clients share the module-level connection pool; pass a `transport`
+    to give a Client its own pool (and e.g. its own `max_retries`).
+    `timeout` overrides the timeout of the Transport for this Client.
+    `rate_limiter` (e.g. a TokenBucket or EndpointRateLimiter) limits the
+    rate of requests; by default the module-level limit set by :func:`set_rate_limit` applies.
+    `retry_policy` (a RetryPolicy) decides which failed requests are retried;
+    by default the policy set by :func:`set_retry_policy` applies."""
 
-    try:
-        response = handle_response(
-            requests.put(url, auth=('api', apikey), data=data))
+    def __init__(self, key, baseurl='https://api.mailgun.net/v3',
+                 transport=None, timeout=None, rate_limiter=None,
+                 retry_policy=None):
 
-        return response.json()
+        self.key = key
+        self.baseurl = baseurl
+        self._transport = transport
+        self.timeout = timeout
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy
 
-    except requests.exceptions.ConnectionError as E:
-        raise ConnectionError() from E
+    @property
+    def transport(self):
+        """The Transport of this Client, or the module-level Transport."""
+
+        return self._transport or globals()['transport']
+
+    @property
+    def rate_limiter(self):
+        """The rate limiter of this Client, or the module-level one."""
+
+        return self._rate_limiter or globals()['rate_limiter']
+
+    @property
+    def retry_policy(self):
+        """The RetryPolicy of this Client, or the module-level one."""
+
+        return self._retry_policy or globals()['retry_policy']
+
+    def request(self, method, url, items=None, **kwargs):
+        """Send a request and return the decoded response. With `items`, the
+        response is streamed instead: an ItemStream of the array `items` of
+        the response is returned, which decodes the items while they are
+        received (see :func:`stream_response`)."""
+
+        if not self.key:
+            raise APIKeyError("No API key provided.")
+
+        if not url.startswith(('http://', 'https://')):
+            url = self.baseurl + url
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("PH %s: %s, %s", method, url,
+                         kwargs.get('params', kwargs.get('data')))
+
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if items is not None:
+            kwargs['stream'] = True
+
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            limiter = ratelimit.limiter_for(self.rate_limiter, url)
+            if limiter is not None:
+                limiter.acquire()
+
+            try:
+                r = self.transport.request(method, url,
+                                           auth=('api', self.key), **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as E:
+                delay = self._retry_delay(method, attempt, error=E,
+                                          sent=not _not_sent(E))
+                if delay is None:
+                    raise ConnectionError() from E
+            else:
+                delay = self._retry_delay(
+                    method, attempt, status=r.status_code,
+                    retry_after=r.headers.get('Retry-After'))
+                if delay is None:
+                    if items is not None:
+                        return stream_response(r, items, self.key)
+                    return decode_response(r, self.key)
+                r.close()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("PH retry %s: %s in %.2fs", method, url, delay)
+            time.sleep(delay)
+            _rewind(kwargs.get('data'), kwargs.get('files'))
+
+    def _retry_delay(self, method, attempt, **kwargs):
+        """Return the delay before retrying, or None to not retry."""
+
+        if self.retry_policy is None:
+            return None
+        return self.retry_policy.delay(method, attempt, **kwargs)
+
+    def get(self, url, params=None):
+        """Send a GET request."""
+
+        return self.request('GET', url, params=params or {})
+
+    def post(self, url, data, files=None):
+        """Send a POST request. With `files`, the data and files are streamed
+        as a multipart body (see :class:`pyholster.multipart.MultipartBody`).
+        """
+
+        if not files:
+            return self.request('POST', url, data=data)
+
+        body = MultipartBody(data, files)
+        try:
+            return self.request('POST', url, data=body,
+                                headers={'Content-Type': body.content_type})
+        finally:
+            body.close()
+
+    def put(self, url, data):
+        """Send a PUT request."""
+
+        return self.request('PUT', url, data=data)
+
+    def delete(self, url):
+        """Send a DELETE request."""
+
+        return self.request('DELETE', url)
+
+    def iter_pages(self, url, params=None, prefetch=False):
+        """Generate the pages of a paginated resource, following the `paging`
+        cursors Mailgun returns. Each page is the list of its items; the
+        iteration stops at the first empty page. With `prefetch`, the next
+        page is fetched in the background while the current page is used."""
+
+        def fetch(url, params=None):
+            response = self.get(url, params)
+            return (response.get('items') or [],
+                    response.get('paging', {}).get('next'))
+
+        if not prefetch:
+            while url:
+                items, url = fetch(url, params)
+                if not items:
+                    return
+                params = None
+                yield items
+            return
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(fetch, url, params)
+            while future is not None:
+                items, url = future.result()
+                if not items:
+                    return
+                future = executor.submit(fetch, url) if url else None
+                yield items
+
+
+    def iter_items(self, url, params=None, key='items'):
+        """Generate the items of a paginated resource one by one, following
+        the `paging` cursors like :meth:`iter_pages`. Each page is decoded
+        while it is received, so only one item is held in memory at a time
+        rather than a page."""
+
+        while url:
+            items = self.request('GET', url, params=params or {}, items=key)
+            with items:
+                count = 0
+                for item in items:
+                    count += 1
+                    yield item
+            if not count:
+                return
+            url = items.fields.get('paging', {}).get('next')
+            params = None
+
+
+class _DefaultClient(Client):
+
+    """The Client used when none is given. It follows the module-level
+    `apikey`, `baseurl` and `transport`, as set by :func:`set_key`."""
+
+    def __init__(self):
+
+        self.timeout = None
+        self._rate_limiter = None
+        self._retry_policy = None
+
+    key = property(lambda self: apikey)
+    baseurl = property(lambda self: baseurl)
+    transport = property(lambda self: transport)
+
+
+default_client = _DefaultClient()
+
+
+def get_client(client=None):
+    """Return `client`, or the default Client if it is None."""
+
+    return client if client is not None else default_client
+
+
+def get(url, params={}):
+    """Send a GET request."""
+
+    return default_client.get(url, params)
+
+
+def post(url, data, files=None):
+    """Send a POST request."""
+
+    return default_client.post(url, data, files=files)
+
+
+def put(url, data):
+    """Send a PUT request."""
+
+    return default_client.put(url, data)
 
 
 def delete(url):
     """Send a DELETE request."""
 
-    if not apikey:
-        raise APIKeyError("No API key provided.")
+    return default_client.delete(url)
+
+
+def handle_response(r, *args, **kwargs):
+    """Handle the response from Mailgun. Return the response itself, so this
+    can be used as a `requests` response hook."""
+
+    decode_response(r, kwargs.get('key'))
+    return r
+
 
-    url = baseurl + url
+def decode_response(r, key=None):
+    """Check the response from Mailgun and return its decoded body. The body
+    is decoded only once; error messages are only built on failure."""
 
-    logger.debug("PH GET: {}".format(url))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("PH handle: %s || %s", r, r.text)
 
     try:
-        response = handle_response(
-            requests.delete(url, auth=('api', apikey)))
+        data = codec.loads(r.content)
+    except ValueError as E:
+        raise ServerError(_error_message(r, detailed=True)) from E
 
-        return response.json()
+    return check_response(data, r.status_code, key,
+                          lambda detailed=False: _error_message(r, detailed))
 
-    except requests.exceptions.ConnectionError as E:
-        raise ConnectionError() from E
 
+def stream_response(r, items='items', key=None):
+    """Check a streamed response from Mailgun and return an ItemStream of
+    the array `items` of its body. Errors are raised like
+    :func:`decode_response` does; a malformed body raises a ServerError
+    while the items are iterated."""
 
-def handle_response(r, *args, **kwargs):
-    """Handle the response from Mailgun."""
+    if r.status_code != 200:
+        return decode_response(r, key)
 
-    message = "[{request[method]}] {request[url]} :: {reason}".format(
-        request=r.request.__dict__, reason=r.reason)
+    return ItemStream(_iter_content(r), items, close=r.close,
+                      error=ServerError)
 
-    logger.debug("PH handle: {} || {} || {}".format(r, dir(r), r.text))
 
+def _iter_content(r):
     try:
-        r.json()
-    except ValueError as E:
-        raise ServerError(
-            "[{req[method]}] {req[url]} :: {code} :: {code_type} :: {text} :: {reason}"
-            .format(code=r.status_code, code_type=str(type(r.status_code)),
-                    req=vars(r.request), text=r.text, reason=r.reason)) from E
+        yield from r.iter_content(STREAM_CHUNK_SIZE)
+    except requests.exceptions.RequestException as E:
+        raise ConnectionError() from E
+
 
-    if 'token' in r.json():
-        if not _verify_token(r.json()):
+def check_response(data, status_code, key=None, describe=None):
+    """Check the decoded body and status code of a response from Mailgun and
+    return the body, or raise the matching exception. `describe` is called to
+    build the error message, with `detailed=True` for unexpected errors."""
+
+    if isinstance(data, dict) and 'token' in data:
+        if not _verify_token(data, key):
             raise TokenError("The Token could not be verified.")
 
-    if r.status_code in html_status_codes:
-        raise html_status_codes[r.status_code](message)
+    if status_code == 200:
+        return data
 
-    elif r.status_code != 200:
-        raise ServerError(
-            "[{req[method]}] {req[url]} :: {code} :: {code_type} :: {reason}"
-            .format(code=r.status_code, code_type=str(type(r.status_code)),
-                    req=r.request.__dict__, reason=r.reason))
+    describe = describe or (lambda detailed=False: str(status_code))
 
-    return r
+    if status_code in html_status_codes:
+        raise html_status_codes[status_code](describe())
+
+    raise ServerError(describe(detailed=True))
+
+
+def _error_message(r, detailed=False):
+    """Describe a failed request."""
+
+    if not detailed:
+        return "[{req.method}] {req.url} :: {reason}".format(
+            req=r.request, reason=r.reason)
+
+    return "[{req.method}] {req.url} :: {code} :: {text} :: {reason}".format(
+        req=r.request, code=r.status_code, text=r.text, reason=r.reason)
+
+
+# urllib3 as requests uses it; versions before 1.13 have no
+# NewConnectionError.
+_NewConnectionError = getattr(requests.packages.urllib3.exceptions,
+                              'NewConnectionError', ())
+
+
+def _not_sent(error):
+    """Whether a request certainly did not reach Mailgun, because no
+    connection could be made."""
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, _NewConnectionError)
+
+
+def _rewind(data, files=None):
+    """Seek the body or file objects to send back to their start before a
+    retry."""
+
+    if hasattr(data, 'seek'):
+        data.seek(0)
+
+    if isinstance(files, dict):
+        files = files.items()
+
+    for _, value in files or ():
+        if isinstance(value, tuple):
+            value = value[1]
+        if hasattr(value, 'seek'):
+            value.seek(0)
 
 
-def _verify_token(params):
-    """Verify the token sent by Mailgun."""
+def _verify_token(params, key=None):
+    """Verify the token sent by Mailgun with `key`, or the module-level API
+    key."""
 
     return params['signature'] == hmac.new(
-        key=globals()['apikey'],
-        msg='{}{}'.format(params['timestamp'], params['token']),
+        key=(key or apikey).encode(),
+        msg='{}{}'.format(params['timestamp'], params['token']).encode(),
         digestmod=hashlib.sha256).hexdigest()
 
 hooks = dict(response=handle_response)
@@ -0,0 +1,232 @@
+"""Cache the responses of the loaders of MailingList, Member and Route.
+
+When enabled, `MailingList.load`, `Member.load` and `Route.load` (and so
+`is_implemented`) read through the cache: a response is requested from
+Mailgun only if it is not cached or has expired. Objects that are updated,
+implemented or deleted through pyholster are removed from the cache of the
+process. Deleting a MailingList or changing its address removes its members
+as well. Changes made elsewhere are seen once the cached response expired.
+
+The cache is disabled by default; enable it with :func:`enable`. The
+default backend is an in-process LRUCache; other backends (e.g. one shared
+between processes) implement `get`, `set`, `delete` and `clear` like it.
+"""
+
+import copy
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from . import api
+
+_cache = None
+
+
+class LRUCache(object):
+
+    """A thread-safe in-process cache of at most `maxsize` entries, which
+    evicts the least recently used entry when it is full."""
+
+    def __init__(self, maxsize=1024):
+
+        self.maxsize = maxsize
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of `key`, or None if it is missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` under `key` for `ttl` seconds (or forever)."""
+
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ReadThroughCache(object):
+
+    """Cache responses in `backend` (by default an LRUCache of `maxsize`
+    entries) for `ttl` seconds. Responses saying that an object does not
+    exist are cached as well, so repeated `is_implemented` checks are
+    cheap."""
+
+    def __init__(self, backend=None, ttl=60, maxsize=1024):
+
+        self.backend = backend if backend is not None else LRUCache(maxsize)
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @property
+    def stats(self):
+        """Return the number of `hits`, `misses` and `invalidations`, and
+        the `size` and `evictions` of the backend if it reports them."""
+
+        with self._lock:
+            stats = dict(self._stats)
+        if hasattr(self.backend, '__len__'):
+            stats['size'] = len(self.backend)
+        if hasattr(self.backend, 'evictions'):
+            stats['evictions'] = self.backend.evictions
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get(self, client, path):
+        """Return the response to ``GET path``, from the cache if possible."""
+
+        key = self._key(client, path)
+        entry = self.backend.get(key)
+
+        if entry is not None:
+            self._count('hits')
+            found, response = entry
+            if not found:
+                raise api.NotFound("[GET] {} :: Not Found (cached)".format(
+                    path))
+            return copy.deepcopy(response)
+
+        self._count('misses')
+
+        try:
+            response = client.get(path)
+        except api.NotFound:
+            self.backend.set(key, (False, None), self.ttl)
+            raise
+
+        self.backend.set(key, (True, copy.deepcopy(response)), self.ttl)
+        return response
+
+    def invalidate(self, client, *paths):
+        """Remove the responses to ``GET path`` from the cache."""
+
+        for path in paths:
+            self.backend.delete(self._key(client, path))
+            self._count('invalidations')
+
+    def invalidate_list(self, client, address):
+        """Remove the responses for the MailingList at `address` and for all
+        of its members from the cache."""
+
+        path = '/lists/{}'.format(address)
+        self.backend.delete(_key(client, path))
+        self.backend.delete(_generation_key(client, path))
+        self._count('invalidations')
+
+    def clear(self):
+        self.backend.clear()
+
+    def _key(self, client, path):
+        """Return the cache key of a path. The key of a member includes the
+        generation of its MailingList, a token that is replaced when the
+        list is invalidated, so that its members are dropped at once. The
+        token is kept in the backend, so processes sharing it agree."""
+
+        match = _member_path.match(path)
+        if match is None:
+            return _key(client, path)
+
+        generation_key = _generation_key(client, match.group(1))
+        generation = self.backend.get(generation_key)
+        if generation is None:
+            generation = uuid.uuid4().hex[:16]
+            self.backend.set(generation_key, generation)
+        return '{}#{}'.format(_key(client, path), generation)
+
+
+def enable(ttl=60, maxsize=1024, backend=None):
+    """Cache the responses of the loaders for `ttl` seconds, in `backend` or
+    an LRUCache of `maxsize` entries. Return the ReadThroughCache."""
+
+    global _cache
+    _cache = ReadThroughCache(backend, ttl, maxsize)
+    return _cache
+
+
+def disable():
+    """Stop caching the responses of the loaders."""
+
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """Return the ReadThroughCache in use, or None if caching is disabled."""
+
+    return _cache
+
+
+def get(client, path):
+    """Send ``GET path`` through the cache, if it is enabled."""
+
+    if _cache is None:
+        return client.get(path)
+    return _cache.get(client, path)
+
+
+def invalidate(client, *paths):
+    """Remove the responses to ``GET path`` from the cache, if it is
+    enabled."""
+
+    if _cache is not None:
+        _cache.invalidate(client, *paths)
+
+
+def invalidate_list(client, address):
+    """Remove the responses for the MailingList at `address` and for all of
+    its members from the cache, if it is enabled."""
+
+    if _cache is not None:
+        _cache.invalidate_list(client, address)
+
+
+_member_path = re.compile(r'(/lists/[^/]+)/members/')
+
+
+def _generation_key(client, path):
+    return '{}#generation'.format(_key(client, path))
+
+
+def _key(client, path):
+    """Return the cache key of a path. The API key and base url are part of
+    the key (hashed), as different accounts can have the same paths."""
+
+    account = hashlib.sha1('{} {}'.format(
+        client.key, client.baseurl).encode('utf-8')).hexdigest()[:16]
+    return '{}{}'.format(account, path)
@@ -0,0 +1,124 @@
+"""Encode and decode JSON.
+
+pyholster encodes and decodes the JSON it exchanges with Mailgun (decoded
+responses, member vars, message variables, bulk member lists) through the
+codec set here. By default this is orjson if it is installed, or else the
+json module of the standard library. Use :func:`set_codec` to choose one,
+e.g. to compare them.
+
+The hashes that are stored (see :func:`pyholster.member.fingerprint`) and
+the vars that Members compare to find changes are always encoded with the
+json module, so they do not depend on the codec.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONCodec(object):
+
+    """The json module of the standard library."""
+
+    name = 'json'
+
+    def dumps(self, value, sort_keys=False):
+        return json.dumps(value, sort_keys=sort_keys)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(object):
+
+    """orjson, which is several times faster than the json module. Values
+    orjson cannot encode (e.g. integers of more than 64 bits) are encoded
+    with the json module. Documents orjson rejects (e.g. with NaN) or
+    might decode inexactly (with integers of more than 64 bits, which
+    orjson decodes as floats) are decoded with the json module."""
+
+    name = 'orjson'
+
+    def __init__(self):
+
+        if orjson is None:
+            raise ImportError("The orjson codec requires orjson.")
+
+    def dumps(self, value, sort_keys=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+
+        try:
+            return orjson.dumps(value, option=options).decode('utf-8')
+        except TypeError:
+            return json.dumps(value, sort_keys=sort_keys)
+
+    def loads(self, data):
+        if _long_number(data):
+            return json.loads(data)
+
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+
+def _long_number(data):
+    """Whether a JSON string or bytes has a run of 19 or more digits, which
+    may be an integer orjson can not decode exactly. The digits are mapped
+    to '0' so the run is found by a plain substring search, which is much
+    faster than a regular expression or walking the decoded value."""
+
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return _LONG_RUN in data.translate(_DIGITS)
+
+
+_DIGITS = bytes.maketrans(b'123456789', b'000000000')
+_LONG_RUN = b'0' * 19
+
+_codecs = {'json': JSONCodec, 'orjson': OrjsonCodec}
+
+codec = OrjsonCodec() if orjson is not None else JSONCodec()
+
+
+def set_codec(name=None):
+    """Set the codec by name ('json' or 'orjson'), or to an object with
+    `dumps` and `loads` methods like JSONCodec. Without a name, the fastest
+    available codec is used. Return the codec."""
+
+    global codec
+
+    if name is None:
+        name = 'orjson' if orjson is not None else 'json'
+    if isinstance(name, str):
+        try:
+            codec = _codecs[name]()
+        except KeyError as E:
+            raise ValueError("Unknown codec {!r}.".format(name)) from E
+    else:
+        codec = name
+
+    return codec
+
+
+def get_codec():
+    """Return the codec in use."""
+
+    return codec
+
+
+def dumps(value, sort_keys=False):
+    """Encode `value` as a JSON string."""
+
+    return codec.dumps(value, sort_keys)
+
+
+def loads(data):
+    """Decode a JSON string or bytes."""
+
+    return codec.loads(data)
@@ -0,0 +1,77 @@
+"""Run operations on many objects concurrently and collect their results."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Result(object):
+
+    """The outcome of an operation on a single item: the returned `value`,
+    or the `error` raised."""
+
+    def __init__(self, item, value=None, error=None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<Result {!r} {}>'.format(
+            self.item, 'ok' if self.ok else repr(self.error))
+
+
+class Results(list):
+
+    """The Results of an operation on many items, in the order of the items.
+    A Results is true if all operations succeeded, like the boolean the bulk
+    operations used to return."""
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self)
+
+    @property
+    def succeeded(self):
+        return [result for result in self if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self if not result.ok]
+
+    def __bool__(self):
+        return self.ok
+
+
+def _call(func, item):
+    try:
+        return Result(item, value=func(item))
+    except Exception as E:
+        return Result(item, error=E)
+
+
+def run(func, items, workers=1):
+    """Call `func` for every item and return the Results. With `workers` > 1
+    the calls run on a thread pool of that size. `items` is consumed lazily:
+    at most twice as many items as there are workers are in flight.
+
+    Requests made by `func` pass through the rate limiter of their Client,
+    so a rate limit is respected regardless of the number of workers."""
+
+    results = Results()
+
+    if workers <= 1:
+        results.extend(_call(func, item) for item in items)
+        return results
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= 2 * workers:
+                results.append(pending.popleft().result())
+            pending.append(executor.submit(_call, func, item))
+        results.extend(future.result() for future in pending)
+
+    return results
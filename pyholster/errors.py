@@ -0,0 +1,6 @@
+"""Exceptions raised by pyholster."""
+
+
+class PHException(Exception):
+
+    """Base class of all exceptions raised by pyholster."""
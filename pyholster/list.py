@@ -1,19 +1,139 @@
+import itertools
+import json
+import threading
+
 from . import api
-from .member import Member
+from . import cache
+from . import codec
+from . import concurrency
+from .member import Member, fingerprint
+from .tracking import Tracked
+
+
+class BulkResult(object):
+
+    """The result of sending one chunk of members to Mailgun in bulk.
+    `response` holds the decoded response, or `error` the exception if the
+    chunk could not be sent."""
+
+    def __init__(self, members, response=None, error=None):
+        self.members = members
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<BulkResult {} members {}>'.format(
+            len(self.members), 'ok' if self.ok else repr(self.error))
+
+
+class MembershipPlan(object):
+
+    """The changes needed to make the members of a MailingList match a
+    desired set of members: the Members to `add`, the Members to `update`
+    (changed name or vars, or a subscription flip) and the addresses to
+    `remove`. See :meth:`MailingList.plan`."""
+
+    results = None
+
+    def __init__(self, mailing_list, add, update, remove):
+        self.mailing_list = mailing_list
+        self.add = add
+        self.update = update
+        self.remove = remove
+
+    def __len__(self):
+        return len(self.add) + len(self.update) + len(self.remove)
+
+    def __str__(self):
+        lines = ['Plan for {}: {} to add, {} to update, {} to remove'.format(
+            self.mailing_list.address, len(self.add), len(self.update),
+            len(self.remove))]
+        lines += ['  + {}'.format(member.address) for member in self.add]
+        lines += ['  ~ {}'.format(member.address) for member in self.update]
+        lines += ['  - {}'.format(address) for address in self.remove]
+        return '\n'.join(lines)
+
+    def apply(self, chunk_size=1000, workers=1):
+        """Apply the plan: the added and updated members are upserted in
+        bulk, the removed members are deleted with up to `workers`
+        concurrent requests. Return the BulkResults of the upserts and the
+        Results of the deletes."""
+
+        lst = self.mailing_list
 
+        upserted = lst.bulk_add_members(self.add + self.update,
+                                        chunk_size=chunk_size,
+                                        workers=workers)
 
-class MailingList(object):
+        def remove(address):
+            member = lst._indexes().get(address) if hasattr(
+                lst, '_members') else None
+            if member is None:
+                member = Member(mailing_list=lst, address=address,
+                                implemented=True)
+            member.delete()
+
+        removed = concurrency.run(remove, self.remove, workers)
+
+        return upserted, removed
+
+
+def _chunks(members, chunk_size, member_class):
+    """Generate lists of `chunk_size` Members from an iterable of Members or
+    dicts (made into a `member_class`)."""
+
+    iterator = iter(members)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield [m if isinstance(m, Member) else member_class(**m)
+               for m in chunk]
+
+
+def _bulk_data(chunk, upsert):
+    """Return the data to send a chunk of members to the bulk endpoint."""
+
+    return {'members': codec.dumps([member.get_data() for member in chunk]),
+            'upsert': 'yes' if upsert else 'no'}
+
+
+def _hashable(value):
+    """Return a hashable representation of a var value for the indexes. It
+    is encoded with the json module, so the keys do not depend on the
+    codec."""
+
+    try:
+        hash(value)
+    except TypeError:
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+    else:
+        return value
+
+
+class MailingList(Tracked):
 
     """Represent a MailingList in Mailgun. This class manages the alias
     (address), name, description and access level, as well as the members."""
 
     class MailingListNotLoadable(Exception): pass
 
+    tracked_fields = ('name', 'description', 'access_level')
+
     address = None
     name = None
     description = None
     access_level = None
     members = None
+    client = None
+    mirror = None
+
+    _indexed_vars = ()
+    _address_index = None
 
     ##
     # Magic methods
@@ -27,6 +147,14 @@ class MailingList(object):
         object.__setattr__(
             self, 'description', kwargs.get('description', None))
         object.__setattr__(self, 'access_level', kwargs.get('access_level'))
+        object.__setattr__(
+            self, 'client', api.get_client(kwargs.get('client')))
+        object.__setattr__(self, 'mirror', kwargs.get('mirror'))
+        object.__setattr__(self, '_implemented', kwargs.get('implemented'))
+        object.__setattr__(self, '_lock', threading.RLock())
+
+        if self._implemented:
+            self._mark_clean()
 
     @property
     def members(self):
@@ -34,6 +162,112 @@ class MailingList(object):
             self._load_members()
         return self._members
 
+    ##
+    # Indexes
+    ##
+
+    def index_vars(self, *keys):
+        """Maintain an index on the given `vars` keys, so
+        `get_members_by_vars` on these keys does not scan all members. The
+        address index is always maintained."""
+
+        object.__setattr__(self, '_indexed_vars',
+                           tuple(set(self._indexed_vars) | set(keys)))
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild the member indexes. Changes made through `add_member(s)`,
+        `Member.update` and `Member.delete` are indexed automatically; call
+        this after changing the `vars` of members directly."""
+
+        object.__setattr__(self, '_address_index', {})
+        object.__setattr__(self, '_var_indexes',
+                           dict((key, {}) for key in self._indexed_vars))
+        object.__setattr__(self, '_indexed_values', {})
+
+        for member in self.members:
+            self._index_member(member)
+
+    def _indexes(self):
+        """Return the address index, rebuilding the indexes if the members
+        were changed without going through the MailingList."""
+
+        if (self._address_index is None
+                or len(self._address_index) != len(self.members)):
+            self.reindex()
+        return self._address_index
+
+    def _index_member(self, member):
+        """Add a member to the indexes."""
+
+        self._address_index[member.address] = member
+
+        values = []
+        for key, index in self._var_indexes.items():
+            if key in member.vars:
+                value = _hashable(member.vars[key])
+                index.setdefault(value, {})[id(member)] = member
+                values.append((key, value))
+        self._indexed_values[id(member)] = values
+
+    def _unindex_member(self, member, address=None):
+        """Remove a member from the indexes. `address` is the address under
+        which the member was indexed, if it changed since."""
+
+        address = address or member.address
+        if self._address_index.get(address) is member:
+            del self._address_index[address]
+
+        for key, value in self._indexed_values.pop(id(member), ()):
+            bucket = self._var_indexes[key].get(value, {})
+            bucket.pop(id(member), None)
+            if not bucket:
+                self._var_indexes[key].pop(value, None)
+
+    def _reindex_member(self, member, address=None):
+        """Update the indexes after the address or vars of a member changed.
+        `address` is the previous address of the member."""
+
+        if hasattr(self, '_members') and self._address_index is not None:
+            with self._lock:
+                self._unindex_member(member, address)
+                self._index_member(member)
+
+    def _add_loaded_member(self, member):
+        """Add a member to the loaded members, replacing a member with the
+        same address."""
+
+        if not hasattr(self, '_members'):
+            return
+
+        with self._lock:
+            index = self._indexes()
+            existing = index.get(member.address)
+
+            if existing is member:
+                return
+            elif existing is not None:
+                self._unindex_member(existing)
+                self._members[self._members.index(existing)] = member
+            else:
+                self._members.append(member)
+
+            self._index_member(member)
+
+    def _remove_loaded_member(self, member):
+        """Remove a member from the loaded members."""
+
+        if not hasattr(self, '_members'):
+            return
+
+        with self._lock:
+            try:
+                self._members.remove(member)
+            except ValueError:
+                pass
+            else:
+                if self._address_index is not None:
+                    self._unindex_member(member)
 
     ##
     # Class methods
@@ -41,11 +275,13 @@ class MailingList(object):
 
 
     @classmethod
-    def load(cls, address):
-        """Load a single MailingList by address."""
+    def load(cls, address, client=None):
+        """Load a single MailingList by address, using `client` (or the
+        default Client)."""
 
         try:
-            response = api.get('/lists/{}'.format(address))
+            response = cache.get(api.get_client(client),
+                                 '/lists/{}'.format(address))
         except api.CommunicationError:
             raise cls.MailingListNotLoadable(
                 "Could not load MailingList from Mailgun.")
@@ -53,19 +289,31 @@ class MailingList(object):
         return cls(address=address,
                    name=data.get('name', None),
                    description=data.get('description', None),
-                   access_level=data.get('access_level'))
+                   access_level=data.get('access_level'),
+                   client=client,
+                   implemented=True)
 
     @classmethod
-    def load_all(cls):
-        """Load all MailingLists."""
+    def load_all(cls, client=None, page_size=100, limit=None,
+                 prefetch=False):
+        """Generate all MailingLists (or the first `limit`), using `client`
+        (or the default Client). The lists are loaded lazily, `page_size` at
+        a time: a page is only requested once the lists before it were
+        used. With `prefetch`, the next page is loaded in the background."""
+
+        if limit is not None:
+            page_size = max(1, min(page_size, limit))
+
+        pages = api.get_client(client).iter_pages(
+            '/lists/pages', {'limit': page_size}, prefetch=prefetch)
+        lists = (cls(client=client, implemented=True, **data)
+                 for page in pages for data in page)
 
         try:
-            response = api.get('/lists')
+            yield from itertools.islice(lists, limit)
         except api.CommunicationError as E:
             raise LookupError(
                 'Could not load any MailingLists from Mailgun.') from E
-        else:
-            return (cls(**m) for m in response['items'])
 
     ##
     # Getter, setters, deleters
@@ -73,109 +321,317 @@ class MailingList(object):
 
     def update(self, safe=True, **kwargs):
         """Update the given attributes (by key=value). Update the MailingList
-        at Mailgun if `safe` is True."""
+        at Mailgun if `safe` is True, implementing it if it does not exist.
+        Only attributes that changed since the MailingList was last loaded or
+        saved are sent."""
 
-        if safe and not self.is_implemented():
+        if safe and self._implemented is False:
             self.implement()
 
-        update_data = {}
+        update_data = self._prepare_update(kwargs)
+
+        if not len(update_data) or not safe:
+            return True
+
+        return self._safe(update_data)
+
+    def _prepare_update(self, kwargs):
+        """Set the given attributes and return the data to send."""
 
         for key in (set(kwargs.keys())
                     & set(['name', 'description', 'access_level'])):
-            if getattr(self, key) != kwargs.get(key):
-                object.__setattr__(self, key, kwargs.get(key))
-                update_data[key] = kwargs.get(key)
+            object.__setattr__(self, key, kwargs.get(key))
+
+        update_data = dict((key, getattr(self, key))
+                           for key in self._fields_to_send(kwargs))
 
         if 'address' in kwargs and kwargs['address'] != self.address:
             object.__setattr__(self, 'new_address', kwargs.get('address'))
             update_data['address'] = kwargs.get('address')
 
-        if not len(update_data) or not safe:
-            return True
-
-        return self._safe(update_data)
+        return update_data
 
     def _safe(self, data):
-        """Safe update data to Mailgun."""
+        """Safe update data to Mailgun. If the MailingList does not exist,
+        implement it first."""
+
+        url = '/lists/{}'.format(self.address)
 
         try:
-            api.put('/lists/{}'.format(self.address),
-                    data)
-        except api.CommunicationError as E:
-            raise E
+            self.client.put(url, data)
+        except api.NotFound:
+            object.__setattr__(self, '_implemented', False)
+            self.implement()
+            self.client.put(url, data)
+
+        self._updated()
+        return True
+
+    def _updated(self):
+        """Register that the MailingList was saved to Mailgun."""
+
+        object.__setattr__(self, '_implemented', True)
+        self._mark_clean()
+        if hasattr(self, 'new_address'):
+            # The members moved with the list, so neither address holds
+            # valid responses.
+            cache.invalidate_list(self.client, self.address)
+            object.__setattr__(self, 'address', self.new_address)
+            delattr(self, 'new_address')
+            cache.invalidate_list(self.client, self.address)
         else:
-            if hasattr(self, 'new_address'):
-                object.__setattr__(self, 'address', self.new_address)
-                delattr(self, 'new_address')
-            return True
+            cache.invalidate(self.client, '/lists/{}'.format(self.address))
 
     def implement(self):
         """Implement a MailingList for the first time on Mailgun. Not for
         updating."""
 
-        if self.is_implemented():
-            self.update()
-
-        data = {'address': self.address,
-                'name': self.name,
-                'description': self.description,
-                'access_level': self.access_level}
+        if self._implemented:
+            return self.save_members()
 
         try:
-            api.post('/lists', data)
+            self.client.post('/lists', self.get_data())
         except api.CommunicationError:
             raise
         else:
+            self._updated()
             return self.save_members()
 
+    def get_data(self):
+        """Return the attributes of the MailingList as sent to Mailgun."""
+
+        return {'address': self.address,
+                'name': self.name,
+                'description': self.description,
+                'access_level': self.access_level}
+
     def delete(self):
         try:
-            api.delete('/lists/{}'.format(self.address))
+            self.client.delete('/lists/{}'.format(self.address))
         except api.CommunicationError:
             raise
         else:
+            object.__setattr__(self, '_implemented', False)
+            cache.invalidate_list(self.client, self.address)
             return True
 
     ##
     #  Members: getting, setting, removing
     ##
 
-    def save_members(self):
-        """Insert/safe all set members individually."""
+    def save_members(self, workers=1):
+        """Insert/safe all set members individually, using up to `workers`
+        concurrent requests. Members that are known to exist and did not
+        change are skipped. Return the Results per member, which are true if
+        all members were saved."""
+
+        return concurrency.run(lambda member: member.upsert(), self.members,
+                               workers)
+
+    def flush(self):
+        """Send all local changes to Mailgun: the changed attributes of the
+        MailingList and, in bulk, the loaded members that are new or changed.
+        Return the BulkResults of the members (see `bulk_add_members`)."""
+
+        if self.is_dirty:
+            self.update()
+
+        if not hasattr(self, '_members'):
+            return []
+
+        dirty = [member for member in self._members
+                 if not member._implemented or member.is_dirty]
+
+        return self.bulk_add_members(dirty) if dirty else []
+
+    def _load_members(self, page_size=100, prefetch=False):
+        """Load all members of the MailingList, from its Mirror if it has
+        one, or else from Mailgun."""
+
+        if self.mirror is not None:
+            self._members = list(self.mirror.iter_members(self))
+        else:
+            self._members = list(self.iter_members(page_size, prefetch))
+        self.reindex()
+
+    def iter_members(self, page_size=100, prefetch=False, stream=False):
+        """Generate all members of the MailingList, loading them from Mailgun
+        page by page (`page_size` members per request), so only one page is
+        held in memory. With `prefetch`, the next page is loaded in the
+        background. With `stream`, each page is decoded while it is
+        received and its members are generated one by one, so only one
+        member is held in memory (`prefetch` does not apply then)."""
+
+        url = '/lists/{}/members/pages'.format(self.address)
+
+        if stream:
+            for member in self.client.iter_items(url, {'limit': page_size}):
+                yield Member(mailing_list=self, implemented=True, **member)
+            return
+
+        pages = self.client.iter_pages(url, {'limit': page_size},
+                                       prefetch=prefetch)
+
+        for page in pages:
+            for member in page:
+                yield Member(mailing_list=self, implemented=True, **member)
+
+
+    def plan(self, members, remove=True, page_size=100):
+        """Compare the members of the MailingList with the desired
+        `members` (an iterable of Members or dicts, consumed lazily) and
+        return the MembershipPlan to make them match. Members are compared
+        by their fingerprint. Unless `remove` is False, members that are not
+        desired are removed.
+
+        The current members are the loaded members, if they are all known
+        to be in Mailgun as they are (none has unflushed changes or failed
+        to be added). Otherwise they are loaded from Mailgun page by page,
+        keeping only their fingerprints."""
+
+        loaded = getattr(self, '_members', None)
+
+        if loaded is not None and all(
+                member._implemented and not member.is_dirty
+                for member in loaded):
+            current = dict((member.address, member.fingerprint())
+                           for member in loaded)
+        else:
+            current = {}
+            for page in self.client.iter_pages(
+                    '/lists/{}/members/pages'.format(self.address),
+                    {'limit': page_size}):
+                for data in page:
+                    current[data['address']] = fingerprint(
+                        data.get('name'), data.get('vars'),
+                        data.get('subscribed'))
+
+        add, update, seen = [], [], set()
 
-        return all(member.upsert() for member in self.members)
+        for member in members:
+            if isinstance(member, dict):
+                member = Member(**member)
+            if member.address in seen:
+                continue
+            seen.add(member.address)
+
+            known = current.get(member.address)
+            if known is None:
+                add.append(member)
+            elif known != member.fingerprint():
+                update.append(member)
 
-    def _load_members(self):
-        """Load all members of the MailingList."""
+        removed = [address for address in current
+                   if address not in seen] if remove else []
 
-        response = api.get('/lists/{}/members'.format(self.address))
-        self._members = [Member(mailing_list=self, **member)
-                         for member in response['items']]
+        return MembershipPlan(self, add, update, removed)
 
+    def reconcile(self, members, remove=True, dry_run=False, workers=1):
+        """Make the members of the MailingList match the desired `members`
+        with as few writes as possible (see :meth:`plan`). Return the
+        MembershipPlan; unless `dry_run` is set, it is applied and its
+        `results` are set to the results of :meth:`MembershipPlan.apply`."""
+
+        plan = self.plan(members, remove)
+        if not dry_run:
+            plan.results = plan.apply(workers=workers)
+        return plan
 
     def add_member(self, member):
         """Add a member to the MailingList."""
 
         member.mailing_list = self
         member.upsert()
-        self.members.append(member)
+        self._add_loaded_member(member)
 
-    def add_members(self, members):
-        """Add multiple members to the MailingList."""
+    def add_members(self, members, workers=1):
+        """Add multiple members to the MailingList, using up to `workers`
+        concurrent requests. Return the Results per member; members that
+        could not be added are not added to the loaded members."""
 
-        for member in members:
-            if isinstance(member, dict):
-                member = Member(**member)
-            member.mailing_list = self
+        def add(member):
             member.upsert()
+            self._add_loaded_member(member)
+
+        def prepare():
+            for member in members:
+                if isinstance(member, dict):
+                    member = Member(**member)
+                member.mailing_list = self
+                yield member
+
+        return concurrency.run(add, prepare(), workers)
+
+    def bulk_add_members(self, members, upsert=True, chunk_size=1000,
+                         workers=1):
+        """Add (or with `upsert`, add or update) members in bulk, sending
+        them to Mailgun in chunks of `chunk_size` (at most 1000) members per
+        request. `members` can be any iterable of Members or dicts and is
+        consumed lazily. With `workers` > 1, chunks are sent concurrently.
+
+        Return a list of BulkResults, one per chunk, in order. Members of
+        successful chunks are added to the loaded members."""
+
+        if not 0 < chunk_size <= 1000:
+            raise ValueError("'chunk_size' should be between 1 and 1000.")
+
+        results = [result.value if result.ok
+                   else BulkResult(result.item, error=result.error)
+                   for result in concurrency.run(
+                       lambda chunk: self._bulk_send(chunk, upsert),
+                       _chunks(members, chunk_size, Member), workers)]
+
+        self._bulk_added(results)
+        return results
+
+    def _bulk_added(self, results):
+        """Add the members of the successful chunks to the loaded members."""
+
+        for result in results:
+            if result.ok:
+                for member in result.members:
+                    self._add_loaded_member(member)
+
+    def _bulk_send(self, chunk, upsert):
+        """Send one chunk of members to the bulk endpoint."""
+
+        try:
+            response = self.client.post(self._bulk_url(),
+                                        _bulk_data(chunk, upsert))
+        except (api.CommunicationError, api.ConnectionError) as E:
+            return BulkResult(chunk, error=E)
+
+        return self._bulk_sent(chunk, response)
 
-        self.members.extend(members)
+    def _bulk_url(self):
+        return '/lists/{}/members.json'.format(self.address)
+
+    def _bulk_sent(self, chunk, response):
+        """Register that a chunk of members was saved to Mailgun."""
+
+        for member in chunk:
+            member.mailing_list = self
+            object.__setattr__(member, '_implemented', True)
+            member._mark_clean()
+        cache.invalidate(self.client, *(member._url() for member in chunk))
+        return BulkResult(chunk, response=response)
 
     def get_members_by_vars(self, **vars_):
         """Return a generator generating a filtered list of members based on
-        the passed variables (plural)."""
+        the passed variables (plural). Indexed vars (see `index_vars`) are
+        looked up in their index instead of scanning all members."""
+
+        self._indexes()
 
-        members = [member for member in self.members
+        indexed = [var for var in vars_ if var in self._var_indexes]
+        if indexed:
+            candidates = min(
+                (self._var_indexes[var].get(_hashable(vars_[var]), {})
+                 for var in indexed), key=len).values()
+        else:
+            candidates = self.members
+
+        members = [member for member in candidates
                    if all(var in member.vars and member.vars[var] == value
                           for var, value in vars_.items())]
 
@@ -212,37 +668,43 @@ class MailingList(object):
 
     def get_member_by_address(self, address):
         """Get a member based on his address."""
-        try:
-            return next(member for member in self.members
-                        if member.address == address)
-        except StopIteration:
-            return []
 
-    def delete_all_members(self):
-        """Try to delete all members. Return False if one or more delete
-        attempts raised an error."""
+        return self._indexes().get(address, [])
+
+    def delete_all_members(self, workers=1):
+        """Try to delete all members, using up to `workers` concurrent
+        requests. Return the Results per member, which are false if one or
+        more delete attempts raised an error."""
+
+        with self._lock:
+            members = list(self.members)
+            del self._members[:]
+            self.reindex()
+
+        results = concurrency.run(lambda member: member.delete(), members,
+                                  workers)
 
-        def internal():
-            for member in self.members():
-                try:
-                    member.delete()
-                    yield True
-                except api.CommunicationError:
-                    yield False
+        for result in results.failed:
+            self._add_loaded_member(result.item)
 
-        return all(list(internal()))
+        return results
 
     ##
     # Miscellaneous
     ##
 
     def is_implemented(self):
-        """Check whether a MailingList with this address is implemented by
-        trying to load it from Mailgun."""
-
-        try:
-            self.__class__.load(self.address)
-        except self.MailingListNotLoadable:
-            return False
-        else:
-            return True
+        """Check whether a MailingList with this address is implemented.
+        Unless this is already known (e.g. because the MailingList was loaded,
+        implemented or deleted), this is checked by trying to load it from
+        Mailgun."""
+
+        if self._implemented is None:
+            try:
+                self.__class__.load(self.address, client=self.client)
+            except self.MailingListNotLoadable:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+
+        return self._implemented
@@ -1,6 +1,34 @@
-import json
+import itertools
+from urllib.parse import urlencode
 
 from . import api
+from . import codec
+from . import concurrency
+from . import errors
+from . import multipart
+
+
+class BatchResult(object):
+
+    """The result of sending one batch of a batch send. `count` is the
+    number of recipients in the batch; `id` holds the message id Mailgun
+    returned, or `error` the exception if the batch could not be sent. Only
+    a failed batch keeps its `recipients`, the (address, variables) pairs to
+    send again, so a large send does not hold all recipients in memory."""
+
+    def __init__(self, recipients, id=None, error=None):
+        self.count = len(recipients)
+        self.recipients = recipients if error is not None else None
+        self.id = id
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<BatchResult {} recipients {}>'.format(
+            self.count, 'ok' if self.ok else repr(self.error))
 
 
 class Mail(object):
@@ -23,6 +51,7 @@ class Mail(object):
     options = None
     headers = None
     variables = None
+    client = None
 
     def __init__(self, **kwargs):
         """Initialize a Mail object."""
@@ -33,7 +62,8 @@ class Mail(object):
                 'subject',
                 'text', 'html', 'message',
                 'attachments', 'inline',
-                'options', 'headers', 'variables')
+                'options', 'headers', 'variables',
+                'client')
 
         unknown_attrs = set(kwargs.keys()) - set(args)
 
@@ -44,26 +74,79 @@ class Mail(object):
         for attr in kwargs:
             setattr(self, attr, kwargs[attr])
 
-    def send(self):
-        """Send the Mail to Mailgun."""
+    def send(self, client=None):
+        """Send the Mail to Mailgun, using `client`, or else the Client given
+        on creation, or else the default Client."""
 
-        self.check_attributes()
-        data = self.get_data()
-        files = self.get_files()
+        url, data, files = self._prepare_send()
+
+        response = api.get_client(client or self.client).post(
+            url, data, files=files)
+
+        return self._sent(response)
+
+    def _prepare_send(self, batch=False, template=False):
+        """Check the attributes and return the url, data and files to send.
+        For a `batch` send, the recipients are added per batch."""
+
+        self.check_attributes(batch, template)
 
         url = ('/{}/messages.mime' if self.message
                else '/{}/messages').format(self.domain)
 
-        response = api.post(url, data, files=files)
+        data = self.get_data()
+        if batch:
+            data.pop('to', None)
 
-        if response['message'] == "Queued. Thank you.":
-            self.id = response.get('id')
-            self.sent = True
-            return True
+        return url, data, self.get_files()
 
-        else:
-            raise errors.MailgunException(
-                "Could not send message: {}".format(response.message))
+    def _sent(self, response):
+        """Handle the response of Mailgun to sending the Mail."""
+
+        self.id = _queued_id(response)
+        self.sent = True
+        return True
+
+    def send_batch(self, recipients, batch_size=1000, client=None,
+                   workers=1):
+        """Send the Mail to many recipients, `batch_size` (at most 1000) per
+        request, using Mailgun's batch sending. Every recipient receives an
+        individual message, personalised with ``%recipient.<key>%``
+        placeholders.
+
+        `recipients` can be any iterable of addresses, (address, variables)
+        pairs or Members (whose `vars` are used) and is consumed lazily.
+        `to` is ignored; `cc` and `bcc` are added to every message. With
+        `workers` > 1, batches are sent concurrently; attachments must then
+        not be file objects.
+
+        Return a list of BatchResults, one per batch, in order. Only the
+        BatchResults of failed batches keep their recipients."""
+
+        if not 0 < batch_size <= 1000:
+            raise ValueError("'batch_size' should be between 1 and 1000.")
+
+        url, data, files = self._prepare_send(batch=True)
+
+        if workers > 1 and _has_file_objects(files):
+            raise ValueError(
+                "File objects can not be sent by several workers at once.")
+
+        client = api.get_client(client or self.client)
+
+        def send(batch):
+            batch_data = dict(data, **_batch_data(batch))
+            api._rewind(None, files)
+            try:
+                response = client.post(url, batch_data, files=files)
+                return BatchResult(batch, id=_queued_id(response))
+            except errors.PHException as E:
+                return BatchResult(batch, error=E)
+
+        return [result.value if result.ok
+                else BatchResult(result.item, error=result.error)
+                for result in concurrency.run(
+                    send, _batches(recipients, batch_size), workers)]
 
     def get_data(self):
         """Create a data structure."""
@@ -77,29 +160,34 @@ class Mail(object):
         data['from'] = self.sender
 
         for attr in (x for x in ('options', 'headers') if getattr(self, x)):
-            for key, value in getattr(self, attr).iteritems():
+            for key, value in getattr(self, attr).items():
                 data['{}:{}'.format(attr[0], key)] = value
 
         if self.variables:
-            for key, value in self['variables'].iteritems():
-                data['v:{}'.format(key)] = json.dumps(value)
+            for key, value in self.variables.items():
+                data['v:{}'.format(key)] = codec.dumps(value)
 
         return data
 
     def get_files(self):
-        """Create a file structure."""
+        """Create a file structure. The message, attachments and inline
+        files can be given as paths (``os.PathLike``), binary file objects,
+        buffers such as mmaps, or strings with the content; all but strings
+        are streamed while sending instead of read into memory."""
 
         if self.message:
             return {'message': self.message}
-        elif self.attachments:
-            return [('attachment', attachment)
-                    for attachment in self.attachments]
-        else:
-            return None
 
-    def check_attributes(self):
-        """Check whether the attributes are the right format."""
+        files = ([('attachment', attachment)
+                  for attachment in self.attachments or ()] +
+                 [('inline', inline) for inline in self.inline or ()])
 
+        return files or None
+
+    def check_attributes(self, batch=False, template=False):
+        """Check whether the attributes are the right format. For a `batch`
+        send the recipients are given separately; for a `template` the
+        subject may be given separately as well."""
 
         if not any(bool(x) for x in [self.text, self.message, self.html]):
             raise ValueError(
@@ -112,12 +200,159 @@ class Mail(object):
             raise ValueError("'domain' should be set.")
         if not self.sender and not self.message:
             raise ValueError("'sender' should be set.")
-        if not any([self.to, self.cc, self.bcc]):
+        if not batch and not any([self.to, self.cc, self.bcc]):
             raise ValueError("'to', 'cc' and/or 'bcc' should be set.")
-        if not self.subject and not self.message:
+        if not template and not self.subject and not self.message:
             raise Warning("'subject' should be set.")
 
         if self.attachments and self.message:
             raise ValueError("'attachments' and 'message' cannot both be set.")
+        if self.inline and self.message:
+            raise ValueError("'inline' and 'message' cannot both be set.")
 
         return True
+
+
+class PreparedMail(Mail):
+
+    """A Mail to send many times, e.g. a transactional mail. The attributes
+    are checked and encoded once, on creation; :meth:`send` only encodes the
+    fields of each message. The attributes should not be changed after
+    creation. A PreparedMail can be sent from several threads at once, so
+    its attachments should be given as paths or bytes rather than as file
+    objects, which the threads would read at the same time.
+
+    :meth:`send_batch` can be used as well, if the template has a subject."""
+
+    message_fields = ('to', 'cc', 'bcc', 'subject', 'variables', 'headers')
+
+    def __init__(self, **kwargs):
+        """Initialize and prepare a PreparedMail. The recipients can be left
+        out and given to :meth:`send` instead."""
+
+        Mail.__init__(self, **kwargs)
+
+        url, data, files = self._prepare_send(batch=True, template=True)
+
+        if _has_file_objects(files):
+            raise ValueError("A PreparedMail can not send file objects; "
+                             "give the files as paths or bytes.")
+        for key in ('cc', 'bcc', 'subject'):
+            data.pop(key, None)
+
+        self._url = url
+        self._data = data
+        self._files = files
+        self._encoded = None if files else urlencode(data, doseq=True)
+
+    def send(self, client=None, **fields):
+        """Send a message to Mailgun and return its id. `fields` are the
+        `to`, `cc`, `bcc` and `subject` of the message, overriding those of
+        the template, and its `variables` and `headers`, which are added to
+        those of the template."""
+
+        unknown_fields = set(fields.keys()) - set(self.message_fields)
+
+        if len(unknown_fields):
+            raise AttributeError(
+                "Unknown fields {}.".format(', '.join(unknown_fields)))
+
+        data = self._message_data(fields)
+        client = api.get_client(client or self.client)
+
+        if self._files:
+            api._rewind(None, self._files)
+            response = client.post(self._url, dict(self._data, **data),
+                                   files=self._files)
+        else:
+            response = client.request(
+                'POST', self._url,
+                data=self._encoded + '&' + urlencode(data, doseq=True),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+        return _queued_id(response)
+
+    def _message_data(self, fields):
+        """Check the fields of a message and return the data to send."""
+
+        data = {}
+
+        for key in ('to', 'cc', 'bcc', 'subject'):
+            value = fields.get(key) or getattr(self, key)
+            if value:
+                data[key] = value
+
+        if not any(key in data for key in ('to', 'cc', 'bcc')):
+            raise ValueError("'to', 'cc' and/or 'bcc' should be set.")
+        if 'subject' not in data and not self.message:
+            raise Warning("'subject' should be set.")
+
+        for attr, prefix, encode in (('headers', 'h', None),
+                                     ('variables', 'v', codec.dumps)):
+            values = fields.get(attr) or {}
+            duplicates = set(values) & set(getattr(self, attr) or {})
+            if duplicates:
+                raise ValueError("{} {} are already set in the template."
+                                 .format(attr, ', '.join(duplicates)))
+            for key, value in values.items():
+                data['{}:{}'.format(prefix, key)] = \
+                    encode(value) if encode else value
+
+        return data
+
+
+def _queued_id(response):
+    """Return the message id if Mailgun queued the message."""
+
+    if response['message'] != "Queued. Thank you.":
+        raise errors.PHException(
+            "Could not send message: {}".format(response['message']))
+
+    return response.get('id')
+
+
+def _batches(recipients, batch_size):
+    """Generate lists of (address, variables) pairs of `batch_size`."""
+
+    iterator = iter(recipients)
+    while True:
+        batch = [_recipient(recipient)
+                 for recipient in itertools.islice(iterator, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def _recipient(recipient):
+    """Return the (address, variables) pair of a recipient."""
+
+    if isinstance(recipient, str):
+        return recipient, {}
+    if hasattr(recipient, 'address'):
+        return recipient.address, recipient.vars or {}
+    address, variables = recipient
+    return address, variables or {}
+
+
+def _batch_data(batch):
+    """Return the data for sending to a batch of recipients. The
+    recipient-variables are always sent, as Mailgun would otherwise send a
+    single message to all recipients."""
+
+    return {'to': [address for address, _ in batch],
+            'recipient-variables': codec.dumps(dict(batch))}
+
+
+def _has_file_objects(files):
+    """Whether any of the files is a file object, which is read from its
+    current position rather than sent as a whole."""
+
+    if isinstance(files, dict):
+        files = files.items()
+
+    for _, content in files or ():
+        if isinstance(content, tuple):
+            content = content[1]
+        if hasattr(content, 'read') and not multipart._is_buffer(content):
+            return True
+    return False
@@ -1,17 +1,30 @@
+import hashlib
 import json
 
 from . import api
+from . import cache
+from . import codec
+from .tracking import Tracked
 
 
-class Member(object):
+class Member(Tracked):
 
-    """Describes a MailingList member"""
+    """Describes a MailingList member.
+
+    Lists can have hundreds of thousands of members, so Members are kept
+    small: they have no instance dict, and their vars are remembered (to
+    find changes) as compact JSON rather than as a copy."""
+
+    __slots__ = ('address', 'name', 'vars', 'subscribed', 'mailing_list',
+                 'new_address', '_client', '_implemented', '_clean')
 
     class MemberNotLoadable(Exception): pass
     class MemberNotImplemented(Exception): pass
     class MemberNotDeleted(Exception): pass
     class MemberNotUpdated(Exception): pass
 
+    tracked_fields = ('name', 'vars', 'subscribed')
+
     ##
     # Magic methods
     # #
@@ -23,36 +36,87 @@ class Member(object):
         object.__setattr__(self, 'vars', kwargs.get('vars', {}))
         object.__setattr__(self, 'subscribed', kwargs.get('subscribed', True))
         object.__setattr__(self, 'mailing_list', kwargs.get('mailing_list'))
+        object.__setattr__(self, '_client', kwargs.get('client'))
+        object.__setattr__(self, '_implemented', kwargs.get('implemented'))
+        object.__setattr__(self, '_clean', None)
+
+        if self._implemented:
+            self._mark_clean()
+
+    @property
+    def client(self):
+        """The Client given on creation, or else the Client of the
+        MailingList, or else the default Client."""
+
+        if self._client is None and self.mailing_list is not None:
+            return getattr(self.mailing_list, 'client', api.default_client)
+        return api.get_client(self._client)
+
 
+    def _comparable(self, field, value):
+        if field == 'vars':
+            return json.dumps(value, sort_keys=True, separators=(',', ':'))
+        return value
 
     ##
     # Class methods
     ##
 
     @classmethod
-    def load(cls, lst, address):
+    def load(cls, lst, address, client=None):
+        """Load a single Member of MailingList `lst` by address, using
+        `client` (or the Client of `lst`)."""
+
+        if client is None:
+            client = getattr(lst, 'client', None)
+
         try:
-            response = api.get('/lists/{}/members/{}'
-                               .format(lst.address, address))
+            response = cache.get(
+                api.get_client(client),
+                '/lists/{}/members/{}'.format(lst.address, address))
         except api.CommunicationError:
             raise cls.MemberNotLoadable(
                 "Could not load Member from Mailgun.")
 
         data = response['member']
         return cls(mailing_list=lst,
+                   client=client,
                    address=data['address'],
                    name=data.get('name'),
                    vars=data.get('vars', {}),
-                   subscribed=data['subscribed'])
+                   subscribed=data['subscribed'],
+                   implemented=True)
 
     ##
     # Getters and setters
     ##
 
     def update(self, **kwargs):
-        """Update the given attributes (by key=value) and send to Mailgun."""
+        """Update the given attributes (by key=value) and send to Mailgun.
+        Only attributes that changed since the Member was last loaded or
+        saved are sent; if nothing changed, no request is made."""
 
-        if not self.is_implemented():
+        update_data = self._prepare_update(kwargs)
+
+        if not len(update_data):
+            return True
+
+        try:
+            self.client.put(self._url(), update_data)
+        except api.NotFound as E:
+            object.__setattr__(self, '_implemented', False)
+            raise self.MemberNotImplemented(
+                "Can not update non-implemented Member. Insert first.") from E
+        except api.CommunicationError as E:
+            raise self.MemberNotUpdated("Could not update Member.") from E
+        else:
+            self._updated()
+            return True
+
+    def _prepare_update(self, kwargs):
+        """Set the given attributes and return the data to send."""
+
+        if self._implemented is False:
             raise self.MemberNotImplemented(
                 "Can not update non-implemented Member. Insert first.")
 
@@ -61,86 +125,149 @@ class Member(object):
                 "The MailingList can not be changed. "
                 "Create a new Member instance for another MailingList.")
 
-        update_data = {}
-
         for key in set(kwargs.keys()) & set(['name', 'vars', 'subscribed']):
             object.__setattr__(self, key, kwargs[key])
-            update_data[key] = kwargs[key]
 
-        if 'address' in kwargs:
+        update_data = dict((key, getattr(self, key))
+                           for key in self._fields_to_send(kwargs))
+
+        if 'address' in kwargs and kwargs['address'] != self.address:
             object.__setattr__(self, 'new_address', kwargs['address'])
             update_data['address'] = kwargs['address']
 
-        if 'vars' in kwargs:
-            object.__setattr__(self, 'vars', kwargs['vars'])
-            update_data['vars'] = json.dumps(kwargs['vars'])
+        if 'vars' in update_data:
+            update_data['vars'] = codec.dumps(self.vars)
 
-        try:
-            api.put('/lists/{}/members/{}'.format(self.mailing_list.address,
-                                                  self.address),
-                    update_data)
-        except api.CommunicationError as E:
-            raise self.MemberNotUpdated("Could not update Member.") from E
-        else:
-            if hasattr(self, 'new_address'):
-                object.__setattr__(self, 'address', self.new_address)
-                delattr(self, 'new_address')
-            return True
+        return update_data
+
+    def _updated(self):
+        """Register that the Member was saved to Mailgun."""
+
+        object.__setattr__(self, '_implemented', True)
+        self._mark_clean()
+        cache.invalidate(self.client, self._url())
+        address = self.address
+        if hasattr(self, 'new_address'):
+            object.__setattr__(self, 'address', self.new_address)
+            delattr(self, 'new_address')
+            cache.invalidate(self.client, self._url())
+        if hasattr(self.mailing_list, '_reindex_member'):
+            self.mailing_list._reindex_member(self, address)
+
+    def _url(self):
+        return '/lists/{}/members/{}'.format(self.mailing_list.address,
+                                             self.address)
 
     def delete(self):
         """Delete the Member from Mailgun and, if it succeeds, from the
         MailingList it belongs to."""
 
         try:
-            api.delete(
-                '/lists/{}/members/{}'.format(self.mailing_list.address,
-                                              self.address))
+            self.client.delete(self._url())
         except api.CommunicationError as E:
             raise self.MemberNotDeleted("Could not delete Member.") from E
         else:
-            try:
-                self.mailing_list.members.remove(self)
-            except:
-                pass
+            self._deleted()
             return True
 
+    def _deleted(self):
+        """Register that the Member was deleted from Mailgun."""
+
+        object.__setattr__(self, '_implemented', False)
+        cache.invalidate(self.client, self._url())
+        if hasattr(self.mailing_list, '_remove_loaded_member'):
+            self.mailing_list._remove_loaded_member(self)
+
     def implement(self):
         """Implements a member for the first time on Mailgun. Don't use for
-        updates."""
+        updates. If the Member turns out to exist already, it is updated
+        instead."""
 
-        if self.is_implemented():
-            self.update()
-            return
+        if self._implemented:
+            return self.update()
 
-        data = {'address': self.address,
-                'name': self.name,
-                'vars': json.dumps(self.vars),
-                'subscribed': self.subscribed,
-                'upsert': False}
+        data = self._insert_data(upsert=False)
 
         try:
-            api.post(
+            self.client.post(
                 '/lists/{}/members'.format(self.mailing_list.address), data)
+        except api.BadRequest:
+            # Most likely the Member exists already. If not, update() fails
+            # with a 404 and raises MemberNotImplemented.
+            return self.update(name=self.name, vars=self.vars,
+                               subscribed=self.subscribed)
         except api.CommunicationError as E:
             raise self.MemberNotImplemented(
                 "Could not implement Member.") from E
         else:
+            self._updated()
             return True
 
+    def get_data(self):
+        """Return the attributes of the Member as sent to Mailgun."""
+
+        return {'address': self.address,
+                'name': self.name,
+                'vars': self.vars,
+                'subscribed': self.subscribed}
+
+    def fingerprint(self):
+        """Return a hash of the name, vars and subscription of the Member, to
+        compare Members without comparing all their attributes."""
+
+        return fingerprint(self.name, self.vars, self.subscribed)
+
+    def _insert_data(self, upsert):
+        """Return the data to send when inserting the Member."""
+
+        data = self.get_data()
+        data['vars'] = codec.dumps(self.vars)
+        data['upsert'] = 'yes' if upsert else 'no'
+        return data
+
     ##
     # Checkers
     ##
 
     def upsert(self):
-        return self.update() if self.is_implemented() else self.implement()
+        """Insert the Member, or update it if it exists already, in a single
+        request. Nothing is sent if the Member is known to exist and did not
+        change."""
 
-    def is_implemented(self):
-        """Checks whether a Member with this address is implemented by trying
-        to load it from Mailgun."""
+        if self._implemented and not self.is_dirty:
+            return True
+
+        data = self._insert_data(upsert=True)
 
         try:
-            self.__class__.load(self.mailing_list, self.address)
-        except self.MemberNotLoadable:
-            return False
+            self.client.post(
+                '/lists/{}/members'.format(self.mailing_list.address), data)
+        except api.CommunicationError as E:
+            raise self.MemberNotUpdated("Could not upsert Member.") from E
         else:
+            self._updated()
             return True
+
+    def is_implemented(self):
+        """Checks whether a Member with this address is implemented. Unless
+        this is already known (e.g. because the Member was loaded, inserted or
+        deleted), this is checked by trying to load it from Mailgun."""
+
+        if self._implemented is None:
+            try:
+                self.__class__.load(self.mailing_list, self.address,
+                                    client=self.client)
+            except self.MemberNotLoadable:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+
+        return self._implemented
+
+
+def fingerprint(name, vars, subscribed):
+    """Return a hash of the name, vars and subscription of a member."""
+
+    return hashlib.sha1(json.dumps(
+        [name or '', vars or {}, bool(subscribed)], sort_keys=True,
+        separators=(',', ':')).encode('utf-8')).hexdigest()
@@ -0,0 +1,363 @@
+"""Keep a local copy of the MailingLists and their members.
+
+A Mirror stores the MailingLists and members in a SQLite database, so they
+can be read without requests to Mailgun. :meth:`Mirror.sync` brings the
+mirror up to date: it sends the local changes to Mailgun and then loads
+the members of the lists that changed.
+
+Mailgun does not report when members were changed, so a list is considered
+changed when its attributes or its number of members changed. Changes to
+the name or vars of existing members of an otherwise unchanged list are
+found by a full sync (`full=True`) or once the list was last synced more
+than `max_age` seconds ago.
+"""
+
+import hashlib
+import json
+import sys
+import time
+
+from . import api
+from . import codec
+from . import concurrency
+from . import storage
+from .list import MailingList
+from .member import Member, fingerprint
+
+_schema = """
+CREATE TABLE IF NOT EXISTS lists (
+    address TEXT PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    access_level TEXT,
+    members_count INTEGER,
+    fingerprint TEXT,
+    synced REAL
+);
+CREATE TABLE IF NOT EXISTS members (
+    list TEXT NOT NULL,
+    address TEXT NOT NULL,
+    name TEXT,
+    vars TEXT NOT NULL,
+    subscribed INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (list, address)
+);
+CREATE INDEX IF NOT EXISTS members_dirty ON members (dirty);
+"""
+
+
+class Mirror(object):
+
+    """A local copy of the MailingLists and members of an account, in the
+    SQLite database at `path`, synced using `client` (or the default
+    Client)."""
+
+    def __init__(self, path, client=None):
+
+        self.path = path
+        self.client = client
+        storage.initialize(path, _schema)
+
+    def _connect(self):
+        return storage.connect(self.path)
+
+    ##
+    # Reading
+    ##
+
+    def lists(self):
+        """Return the mirrored MailingLists. Their members are read from the
+        mirror when they are used."""
+
+        with self._connect() as db:
+            rows = db.execute('SELECT * FROM lists ORDER BY address')
+            return [self._list(row) for row in rows]
+
+    def get_list(self, address):
+        """Return the mirrored MailingList with `address`, or None."""
+
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM lists WHERE address = ?',
+                             (address,)).fetchone()
+
+        return self._list(row) if row is not None else None
+
+    def _list(self, row):
+        return MailingList(address=row['address'],
+                           name=row['name'],
+                           description=row['description'],
+                           access_level=row['access_level'],
+                           client=self.client,
+                           mirror=self,
+                           implemented=True)
+
+    def iter_members(self, lst):
+        """Generate the mirrored members of MailingList `lst` (or the list
+        with address `lst`), including local changes not yet synced."""
+
+        if isinstance(lst, str):
+            lst = self.get_list(lst) or MailingList(address=lst,
+                                                    client=self.client)
+
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT address, name, vars, subscribed, dirty '
+                'FROM members WHERE list = ? AND deleted = 0 '
+                'ORDER BY address', (lst.address,)).fetchall()
+
+        for row in rows:
+            member = Member(mailing_list=lst,
+                            address=row['address'],
+                            name=row['name'],
+                            vars=_load_vars(row['vars']),
+                            subscribed=bool(row['subscribed']),
+                            implemented=True)
+            if row['dirty']:
+                object.__setattr__(member, '_clean', None)
+            yield member
+
+    ##
+    # Local changes
+    ##
+
+    def set_member(self, list_address, member):
+        """Add or change a member of a mirrored list locally. The change is
+        sent to Mailgun by the next :meth:`sync`."""
+
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO members (list, address, name, vars, '
+                'subscribed, fingerprint, dirty, deleted) '
+                'VALUES (?, ?, ?, ?, ?, ?, 1, 0)',
+                (list_address, member.address, member.name,
+                 codec.dumps(member.vars or {}), bool(member.subscribed),
+                 member.fingerprint()))
+
+    def remove_member(self, list_address, address):
+        """Remove a member of a mirrored list locally. The member is deleted
+        from Mailgun by the next :meth:`sync`."""
+
+        with self._connect() as db:
+            db.execute('UPDATE members SET dirty = 1, deleted = 1 '
+                       'WHERE list = ? AND address = ?',
+                       (list_address, address))
+
+    ##
+    # Syncing
+    ##
+
+    def sync(self, full=False, max_age=None, page_size=100, workers=1):
+        """Send the local changes to Mailgun (see :meth:`push`) and update
+        the mirror from Mailgun (see :meth:`pull`). Return the counts of
+        what was done."""
+
+        report = self.push(workers)
+        report.update(self.pull(full, max_age, page_size))
+        return report
+
+    def push(self, workers=1):
+        """Send the local changes to Mailgun: added and changed members in
+        bulk, removed members one by one with up to `workers` concurrent
+        requests. Changes that could not be sent are kept for the next
+        sync."""
+
+        report = {'pushed': 0, 'push_failed': 0}
+
+        with self._connect() as db:
+            addresses = [row[0] for row in db.execute(
+                'SELECT DISTINCT list FROM members WHERE dirty = 1')]
+
+        for address in addresses:
+            lst = MailingList(address=address, client=self.client,
+                              implemented=True)
+
+            with self._connect() as db:
+                rows = db.execute(
+                    'SELECT address, name, vars, subscribed, deleted '
+                    'FROM members WHERE list = ? AND dirty = 1',
+                    (address,)).fetchall()
+
+            changed = [Member(address=row['address'], name=row['name'],
+                              vars=codec.loads(row['vars']),
+                              subscribed=bool(row['subscribed']))
+                       for row in rows if not row['deleted']]
+            removed = [Member(mailing_list=lst, address=row['address'],
+                              implemented=True)
+                       for row in rows if row['deleted']]
+
+            done, failed = [], 0
+
+            for result in lst.bulk_add_members(changed, workers=workers):
+                if result.ok:
+                    done += [member.address for member in result.members]
+                else:
+                    failed += len(result.members)
+
+            for result in concurrency.run(_delete, removed, workers):
+                if result.ok:
+                    done.append(result.item.address)
+                else:
+                    failed += 1
+
+            with self._connect() as db:
+                db.execute('BEGIN')
+                db.executemany(
+                    'DELETE FROM members WHERE list = ? AND address = ? '
+                    'AND deleted = 1', [(address, a) for a in done])
+                db.executemany(
+                    'UPDATE members SET dirty = 0 '
+                    'WHERE list = ? AND address = ?',
+                    [(address, a) for a in done])
+                self._pushed(db, address)
+
+            report['pushed'] += len(done)
+            report['push_failed'] += failed
+
+        return report
+
+    def _pushed(self, db, address):
+        """Update the fingerprint of a list after its changes were pushed, so
+        that the next sync does not load its members again because of them."""
+
+        row = db.execute('SELECT * FROM lists WHERE address = ?',
+                         (address,)).fetchone()
+        if row is None:
+            return
+
+        count = db.execute(
+            'SELECT COUNT(*) FROM members WHERE list = ? AND deleted = 0',
+            (address,)).fetchone()[0]
+        data = dict(row, members_count=count)
+        db.execute('UPDATE lists SET members_count = ?, fingerprint = ? '
+                   'WHERE address = ?',
+                   (count, _list_fingerprint(data), address))
+
+    def pull(self, full=False, max_age=None, page_size=100):
+        """Update the mirror from Mailgun. The members of a list are only
+        loaded if the list changed since the last sync, or if `full` is set
+        or the list was synced more than `max_age` seconds ago. Members with
+        local changes are not overwritten."""
+
+        report = {'lists': 0, 'lists_skipped': 0, 'members_changed': 0,
+                  'members_removed': 0}
+        now = time.time()
+        seen = set()
+
+        with self._connect() as db:
+            known = dict((row['address'], row) for row in db.execute(
+                'SELECT address, fingerprint, synced FROM lists'))
+
+        for page in api.get_client(self.client).iter_pages(
+                '/lists/pages', {'limit': page_size}):
+            for data in page:
+                address = data['address']
+                seen.add(address)
+                report['lists'] += 1
+
+                previous = known.get(address)
+                if (not full and previous is not None
+                        and previous['fingerprint'] == _list_fingerprint(data)
+                        and (max_age is None
+                             or now - previous['synced'] <= max_age)):
+                    report['lists_skipped'] += 1
+                    continue
+
+                changed, removed = self._pull_members(address, page_size)
+                report['members_changed'] += changed
+                report['members_removed'] += removed
+
+                with self._connect() as db:
+                    db.execute(
+                        'INSERT OR REPLACE INTO lists VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?)',
+                        (address, data.get('name'), data.get('description'),
+                         data.get('access_level'), data.get('members_count'),
+                         _list_fingerprint(data), now))
+
+        with self._connect() as db:
+            db.execute('BEGIN')
+            for address in set(known) - seen:
+                db.execute('DELETE FROM lists WHERE address = ?', (address,))
+                db.execute('DELETE FROM members WHERE list = ? AND dirty = 0',
+                           (address,))
+
+        return report
+
+    def _pull_members(self, address, page_size):
+        """Load the members of a list into the mirror, writing only the
+        members that changed. Return the numbers of changed and removed
+        members."""
+
+        with self._connect() as db:
+            local = dict((row[0], (row[1], row[2])) for row in db.execute(
+                'SELECT address, fingerprint, dirty FROM members '
+                'WHERE list = ?', (address,)))
+
+        changed = 0
+        remote = set()
+        lst = MailingList(address=address, client=self.client)
+
+        for page in lst.client.iter_pages(
+                '/lists/{}/members/pages'.format(address),
+                {'limit': page_size}):
+            rows = []
+            for data in page:
+                remote.add(data['address'])
+                hash_ = fingerprint(data.get('name'), data.get('vars'),
+                                    data.get('subscribed'))
+                known, dirty = local.get(data['address'], (None, 0))
+                if hash_ == known or dirty:
+                    continue
+                rows.append((address, data['address'], data.get('name'),
+                             codec.dumps(data.get('vars') or {}),
+                             bool(data.get('subscribed')), hash_))
+
+            if rows:
+                with self._connect() as db:
+                    db.execute('BEGIN')
+                    db.executemany(
+                        'INSERT OR REPLACE INTO members (list, address, '
+                        'name, vars, subscribed, fingerprint) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', rows)
+                changed += len(rows)
+
+        removed = [(address, member) for member, (_, dirty) in local.items()
+                   if member not in remote and not dirty]
+        if removed:
+            with self._connect() as db:
+                db.execute('BEGIN')
+                db.executemany('DELETE FROM members '
+                               'WHERE list = ? AND address = ?', removed)
+
+        return changed, len(removed)
+
+
+def _list_fingerprint(data):
+    """Return a hash of the attributes of a list that Mailgun reports."""
+
+    return hashlib.sha1(json.dumps(
+        [data.get(key) for key in ('name', 'description', 'access_level',
+                                   'members_count')]
+    ).encode('utf-8')).hexdigest()
+
+
+def _load_vars(text):
+    """Load the vars of a member. The keys are interned, so the members of a
+    list share one copy of each key rather than one per member."""
+
+    return dict((sys.intern(key), value)
+                for key, value in codec.loads(text).items())
+
+
+def _delete(member):
+    """Delete a member from Mailgun; a member that is gone already counts
+    as deleted."""
+
+    try:
+        member.delete()
+    except Member.MemberNotDeleted as E:
+        if not isinstance(E.__cause__, api.NotFound):
+            raise
@@ -0,0 +1,279 @@
+"""Stream multipart/form-data bodies, e.g. for attachments.
+
+`requests` builds a multipart body in memory, holding a copy of every file
+it sends. A MultipartBody reads its files only while the body is sent, a
+chunk at a time, so the memory used does not depend on the size of the
+files. Files can be given as paths, file objects or buffers (bytes, mmap,
+memoryview).
+"""
+
+import io
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+class MultipartBody(object):
+
+    """A multipart/form-data body to be read as a stream. `data` holds the
+    form fields (lists become repeated fields, None values are left out),
+    `files` the files, as a dict or a list of (field, content) pairs.
+
+    The content of a file is a path (``os.PathLike``), a file object, a
+    buffer or a string, or a (filename, content[, content_type]) tuple.
+    Strings are sent as they are, not treated as paths. Strings and text
+    files are encoded as UTF-8."""
+
+    def __init__(self, data=None, files=None, boundary=None):
+
+        self.boundary = boundary or uuid.uuid4().hex
+        self._sources = []
+
+        for name, value in _pairs(data):
+            for value in (value if isinstance(value, (list, tuple))
+                          else [value]):
+                if value is not None:
+                    self._add_part(name, _Buffer(_bytes(value)))
+
+        for name, content in _pairs(files):
+            filename, content_type = None, None
+            if isinstance(content, tuple):
+                filename, content, content_type = (content + (None,))[:3]
+            source = _source(content)
+            self._add_part(name, source,
+                           filename or source.filename or name, content_type)
+
+        self._sources.append(_Buffer(
+            '--{}--\r\n'.format(self.boundary).encode()))
+
+        self._length = sum(source.length for source in self._sources)
+        self.seek(0)
+
+    def _add_part(self, name, source, filename=None, content_type=None):
+
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(
+            self.boundary, _quote(name))
+        if filename is not None:
+            header += '; filename="{}"'.format(_quote(filename))
+        if content_type is not None:
+            header += '\r\nContent-Type: {}'.format(content_type)
+
+        self._sources += [_Buffer((header + '\r\n\r\n').encode()),
+                          source,
+                          _Buffer(b'\r\n')]
+
+    @property
+    def content_type(self):
+        """The Content-Type header of the body."""
+
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        """Rewind the body. Only seeking to the start is supported, so a
+        request can be sent again (e.g. when it is retried)."""
+
+        if offset != 0 or whence != 0:
+            raise ValueError("A MultipartBody can only be rewound.")
+
+        for source in self._sources:
+            source.rewind()
+        self._index = 0
+        self._position = 0
+        return 0
+
+    def read(self, size=-1):
+        """Read up to `size` bytes (at most one chunk if `size` is -1)."""
+
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+
+        chunks = []
+
+        while size > 0 and self._index < len(self._sources):
+            chunk = self._sources[self._index].read(size)
+            if not chunk:
+                self._sources[self._index].close()
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+
+        data = b''.join(chunks)
+        self._position += len(data)
+        return data
+
+    def __iter__(self):
+        chunk = self.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = self.read(CHUNK_SIZE)
+
+    def close(self):
+        """Close the files opened by the body."""
+
+        for source in self._sources:
+            source.close()
+
+
+class _Buffer(object):
+
+    """Content in memory: bytes, an mmap or another buffer."""
+
+    filename = None
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        with memoryview(buffer) as view:
+            self.length = view.nbytes
+        self.offset = 0
+
+    def read(self, size):
+        # The view is released after every read, so that e.g. an mmap can be
+        # closed once the body was sent.
+        with memoryview(self.buffer) as view:
+            with view.cast('B') as view:
+                chunk = bytes(view[self.offset:self.offset + size])
+        self.offset += len(chunk)
+        return chunk
+
+    def rewind(self):
+        self.offset = 0
+
+    def close(self):
+        pass
+
+
+class _File(object):
+
+    """Content read from a seekable binary file object, from its current
+    position."""
+
+    def __init__(self, file):
+        self.file = file
+        self.filename = _basename(getattr(file, 'name', None))
+        self.start = file.tell()
+        file.seek(0, os.SEEK_END)
+        self.length = file.tell() - self.start
+        file.seek(self.start)
+        self.remaining = self.length
+
+    def read(self, size):
+        chunk = self.file.read(min(size, self.remaining))
+        self.remaining -= len(chunk)
+        return chunk
+
+    def rewind(self):
+        self.file.seek(self.start)
+        self.remaining = self.length
+
+    def close(self):
+        pass
+
+
+class _Text(object):
+
+    """Content read from a seekable text file object, from its current
+    position, encoded as UTF-8. The file is read once up front to find the
+    length of the encoded content."""
+
+    def __init__(self, file):
+        self.file = file
+        self.filename = _basename(getattr(file, 'name', None))
+        self.start = file.tell()
+        self.length = sum(len(text.encode())
+                          for text in iter(lambda: file.read(CHUNK_SIZE), ''))
+        self.rewind()
+
+    def read(self, size):
+        while len(self.pending) < size:
+            text = self.file.read(CHUNK_SIZE)
+            if not text:
+                break
+            self.pending += text.encode()
+
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+    def rewind(self):
+        self.file.seek(self.start)
+        self.pending = b''
+
+    def close(self):
+        pass
+
+
+class _Path(object):
+
+    """Content read from the file at a path, which is opened only while it
+    is read."""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.filename = os.path.basename(self.path)
+        self.length = os.path.getsize(self.path)
+        self.file = None
+
+    def read(self, size):
+        if self.file is None:
+            self.file = open(self.path, 'rb')
+        return self.file.read(size)
+
+    def rewind(self):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _source(content):
+    """Return the source to read `content` from."""
+
+    if isinstance(content, os.PathLike):
+        return _Path(content)
+    if isinstance(content, io.TextIOBase):
+        return _Text(content)
+    if hasattr(content, 'read') and not _is_buffer(content):
+        return _File(content)
+    return _Buffer(_bytes(content))
+
+
+def _pairs(fields):
+    if isinstance(fields, dict):
+        return list(fields.items())
+    return list(fields or ())
+
+
+def _is_buffer(value):
+    try:
+        memoryview(value).release()
+    except TypeError:
+        return False
+    return True
+
+
+def _bytes(value):
+    if isinstance(value, str):
+        return value.encode()
+    if _is_buffer(value):
+        return value
+    return str(value).encode()
+
+
+def _basename(name):
+    if isinstance(name, str) and name and not name.startswith('<'):
+        return os.path.basename(name)
+    return None
+
+
+def _quote(value):
+    return str(value).replace('"', '%22').replace('\r', '%0D') \
+        .replace('\n', '%0A')
@@ -0,0 +1,181 @@
+"""Limit the rate of requests sent to Mailgun."""
+
+import os
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+ENDPOINTS = ('messages', 'lists', 'routes')
+
+
+class TokenBucket(object):
+
+    """Allow on average `rate` requests per second, with bursts of up to
+    `capacity` requests. A TokenBucket can be shared between threads."""
+
+    def __init__(self, rate, capacity=None):
+
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def acquire(self, tokens=1):
+        """Take `tokens` tokens, waiting until they are available."""
+
+        wait = self.try_acquire(tokens)
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire(tokens)
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` tokens if they are available and return 0, or else
+        return the number of seconds to wait before trying again."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = self._take(self._tokens,
+                                            now - self._updated, tokens)
+            self._updated = now
+            return wait
+
+    def _take(self, available, elapsed, tokens):
+        """Refill `available` for `elapsed` seconds and take `tokens`. Return
+        the tokens left and the number of seconds to wait (0 if taken)."""
+
+        available = min(self.capacity, available + elapsed * self.rate)
+
+        if available >= tokens:
+            return available - tokens, 0
+
+        return available, (tokens - available) / self.rate
+
+
+class FileTokenBucket(TokenBucket):
+
+    """A TokenBucket whose state is kept in the file at `path`, so it can be
+    shared between processes on the same machine (e.g. the workers of a web
+    server or a multiprocessing Pool). All processes using the same `path`
+    should use the same `rate` and `capacity`. Requires ``fcntl`` (Unix)."""
+
+    _format = struct.Struct('dd')
+
+    def __init__(self, path, rate, capacity=None):
+
+        if fcntl is None:
+            raise RuntimeError(
+                "FileTokenBucket requires fcntl, which is not available.")
+
+        super().__init__(rate, capacity)
+        self.path = path
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` tokens if they are available and return 0, or else
+        return the number of seconds to wait before trying again."""
+
+        # The file is opened for each call, because flock() locks are shared
+        # by forked processes that inherit the file descriptor.
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+                now = time.time()
+                state = os.pread(fd, self._format.size, 0)
+                if len(state) == self._format.size:
+                    available, updated = self._format.unpack(state)
+                else:
+                    available, updated = self.capacity, now
+
+                available, wait = self._take(available,
+                                             max(0.0, now - updated), tokens)
+                os.pwrite(fd, self._format.pack(available, now), 0)
+                return wait
+            finally:
+                os.close(fd)
+
+
+class EndpointRateLimiter(object):
+
+    """Limit the rate of requests per endpoint class. `messages`, `lists` and
+    `routes` are the limiters (e.g. TokenBuckets) for sending messages and
+    for the mailing list and route endpoints; `default` limits all other
+    requests, and those of endpoint classes without their own limiter.
+    Limiters that are None do not limit."""
+
+    def __init__(self, default=None, messages=None, lists=None, routes=None):
+
+        self.default = default
+        self.limiters = {'messages': messages,
+                         'lists': lists,
+                         'routes': routes}
+
+    def for_url(self, url):
+        """Return the limiter for requests to `url`."""
+
+        return self.limiters.get(endpoint(url)) or self.default
+
+
+def endpoint(url):
+    """Return the endpoint class of `url`: 'messages', 'lists', 'routes' or
+    None."""
+
+    parts = urlparse(url).path.strip('/').split('/')
+
+    if 'lists' in parts[:2]:
+        return 'lists'
+    if 'routes' in parts[:2]:
+        return 'routes'
+    if parts[-1].startswith('messages'):
+        return 'messages'
+    return None
+
+
+def limiter_for(limiter, url):
+    """Return the limiter that applies to a request to `url`: `limiter`
+    itself, or its limiter for the endpoint class of `url`."""
+
+    if limiter is not None and hasattr(limiter, 'for_url'):
+        return limiter.for_url(url)
+    return limiter
+
+
+def make_limiter(rate=None, capacity=None, path=None, **endpoints):
+    """Create a rate limiter allowing `rate` requests per second (bursts of
+    `capacity`), with separate rates per endpoint class given by keyword
+    (`messages`, `lists`, `routes`), which allow bursts of `capacity` as
+    well. If `path` (a directory) is given, the limits are shared between
+    processes through files in that directory. Return None if no rate is
+    given."""
+
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise TypeError("Unknown endpoint class(es): {}".format(
+            ', '.join(sorted(unknown))))
+
+    def bucket(name, rate):
+        if not rate:
+            return None
+        if path is None:
+            return TokenBucket(rate, capacity)
+        return FileTokenBucket(
+            os.path.join(path, 'pyholster-{}.bucket'.format(name)),
+            rate, capacity)
+
+    default = bucket('default', rate)
+
+    if not any(endpoints.values()):
+        return default
+
+    return EndpointRateLimiter(
+        default, **dict((name, bucket(name, value))
+                        for name, value in endpoints.items()))
@@ -0,0 +1,108 @@
+"""Retry failed requests with exponential backoff."""
+
+import email.utils
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+
+    """Decide whether and when to retry a failed request.
+
+    A request is attempted at most `max_attempts` times. The n-th retry waits
+    ``backoff * 2 ** (n - 1)`` seconds, at most `max_backoff`, with full
+    jitter if `jitter` is set. A ``Retry-After`` header sent by Mailgun takes
+    precedence (up to `max_retry_after` seconds).
+
+    Requests with an idempotent method (`idempotent_methods`) are retried on
+    the `statuses` and on connection errors and timeouts. Other requests,
+    notably ``POST /messages``, are only retried when Mailgun certainly did
+    not process them: on a 429 response or when no connection could be made.
+    This way a message is never sent twice.
+
+    The counters in :attr:`stats` can be used for monitoring. A RetryPolicy
+    can be shared between Clients and threads."""
+
+    def __init__(self, max_attempts=4, backoff=0.5, max_backoff=30,
+                 jitter=True, statuses=(429, 500, 502, 503, 504),
+                 idempotent_methods=('GET', 'PUT', 'DELETE'),
+                 max_retry_after=300):
+
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.max_retry_after = max_retry_after
+
+        self._lock = threading.Lock()
+        self._stats = {'retries': 0, 'gave_up': 0}
+
+    @property
+    def stats(self):
+        """Return the counters: the total number of `retries`, the number of
+        requests that failed after all attempts (`gave_up`) and the number of
+        retries per status code or exception name."""
+
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._stats[key] = self._stats.get(key, 0) + 1
+
+    def delay(self, method, attempt, status=None, error=None,
+              retry_after=None, sent=True):
+        """Return the number of seconds to wait before retrying, or None if
+        the request should not be retried. `attempt` is the number of the
+        attempt that failed (starting at 1), with either the `status` of the
+        response (and its ``Retry-After`` header) or the `error` raised.
+        `sent` tells whether the request may have reached Mailgun."""
+
+        if status is not None:
+            if status not in self.statuses:
+                return None
+            retryable = (method in self.idempotent_methods or status == 429)
+            reason = status
+        else:
+            retryable = method in self.idempotent_methods or not sent
+            reason = type(error).__name__
+
+        if not retryable:
+            return None
+
+        if attempt >= self.max_attempts:
+            self._count('gave_up')
+            return None
+
+        self._count('retries', reason)
+
+        wait = _parse_retry_after(retry_after)
+        if wait is not None:
+            return min(wait, self.max_retry_after)
+
+        wait = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, wait) if self.jitter else wait
+
+
+def _parse_retry_after(value):
+    """Return the number of seconds in a ``Retry-After`` header value, which
+    is either a number of seconds or an HTTP date."""
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, date.timestamp() - time.time())
@@ -1,10 +1,63 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
 from dateutil import parser as dtparser
 
 from . import api
+from . import cache
+from . import concurrency
 from . import errors
+from .tracking import Tracked
+
+
+class RoutePlan(object):
+
+    """The changes needed to make the Routes match a desired set of Routes:
+    the Routes to `create`, the (Route, changes) pairs to `update` and the
+    Routes to `delete`. See :meth:`Route.plan`."""
+
+    results = None
+
+    def __init__(self, create, update, delete, client=None):
+        self.create = create
+        self.update = update
+        self.delete = delete
+        self.client = client
+
+    def __len__(self):
+        return len(self.create) + len(self.update) + len(self.delete)
+
+    def __str__(self):
+        lines = ['Route plan: {} to create, {} to update, {} to delete'.format(
+            len(self.create), len(self.update), len(self.delete))]
+        lines += ['  + {}'.format(_describe(route)) for route in self.create]
+        lines += ['  ~ {} ({})'.format(_describe(route), ', '.join(
+            sorted(changes))) for route, changes in self.update]
+        lines += ['  - {}'.format(_describe(route)) for route in self.delete]
+        return '\n'.join(lines)
+
+    def apply(self, workers=1):
+        """Apply the plan with up to `workers` concurrent requests. Return
+        the Results per change."""
+
+        changes = ([('create', route, None) for route in self.create] +
+                   [('update', route, data) for route, data in self.update] +
+                   [('delete', route, None) for route in self.delete])
 
+        def apply(change):
+            action, route, data = change
+            if action == 'create':
+                return route.implement()
+            elif action == 'update':
+                return route.update(**data)
+            return route.delete()
 
-class Route(object):
+        return concurrency.run(apply, changes, workers)
+
+
+class Route(Tracked):
+
+    tracked_fields = ('priority', 'description', 'expression', 'actions')
 
     def __init__(self, **kwargs):
 
@@ -17,93 +70,251 @@ class Route(object):
         object.__setattr__(
             self, 'description', kwargs.get('description', None))
         object.__setattr__(self, 'id', kwargs.get('id', None))
+        object.__setattr__(
+            self, 'client', api.get_client(kwargs.get('client')))
+        object.__setattr__(self, '_implemented', kwargs.get('implemented'))
         object.__setattr__(self, 'created_at', (dtparser.parse(kwargs.get('created_at'))
                                                 if 'created_at' in kwargs else None))
 
+        if self._implemented:
+            self._mark_clean()
+
     def __setattr__(self, name, value):
         raise AttributeError(
             'The Route object cannot be altered directly. Use the update() method instead.')
 
     @classmethod
-    def load(cls, id):
+    def load(cls, id, client=None):
         try:
-            response = api.get('/routes/{}'.format(id))
+            response = cache.get(api.get_client(client),
+                                 '/routes/{}'.format(id))
         except errors.PHException:
             raise LookupError('Could not load Route from Mailgun.')
         else:
-            return cls(**response['route'])
+            return cls(client=client, implemented=True, **response['route'])
 
     @classmethod
-    def load_all(cls):
+    def load_all(cls, client=None, page_size=100, limit=None,
+                 prefetch=False):
+        """Generate all Routes (or the first `limit`), using `client` (or the
+        default Client). The Routes are loaded lazily, `page_size` at a
+        time: a page is only requested once the Routes before it were used.
+        With `prefetch`, the next page is loaded in the background."""
+
+        if limit is not None:
+            page_size = max(1, min(page_size, limit))
+
+        routes = (route for page in cls._iter_pages(client, page_size,
+                                                    prefetch)
+                  for route in page)
+
         try:
-            response = api.get('/routes')
-        except errors.PHException:
-            raise LookupError('Could not load Routes from Mailgun.')
-        else:
-            return (cls(**m) for m in response['items'])
+            yield from itertools.islice(routes, limit)
+        except errors.PHException as E:
+            raise LookupError('Could not load Routes from Mailgun.') from E
+
+    @classmethod
+    def _iter_pages(cls, client=None, page_size=100, prefetch=False):
+        """Generate the pages of Routes, using skip and limit. With
+        `prefetch`, the next page is fetched in the background while the
+        current page is used."""
+
+        client = api.get_client(client)
+
+        def fetch(skip):
+            response = client.get('/routes', {'skip': skip,
+                                              'limit': page_size})
+            items = response.get('items') or []
+            skip += len(items)
+            if 'total_count' in response:
+                more = items and skip < response['total_count']
+            else:
+                more = len(items) == page_size
+            return ([cls(client=client, implemented=True, **item)
+                     for item in items], skip if more else None)
+
+        if not prefetch:
+            skip = 0
+            while skip is not None:
+                page, skip = fetch(skip)
+                if page:
+                    yield page
+            return
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(fetch, 0)
+            while future is not None:
+                page, skip = future.result()
+                future = (executor.submit(fetch, skip)
+                          if skip is not None else None)
+                if page:
+                    yield page
+
+    @classmethod
+    def plan(cls, routes, client=None, delete=True, page_size=100):
+        """Compare the existing Routes with the desired `routes` and return
+        the RoutePlan to make them match. A desired Route is matched with an
+        existing Route with the same description or, if there is none, the
+        same expression. Unless `delete` is False, existing Routes that are
+        not matched are deleted."""
+
+        by_description, by_expression = {}, {}
+        existing = []
+
+        for page in cls._iter_pages(client, page_size):
+            for route in page:
+                existing.append(route)
+                if route.description:
+                    by_description.setdefault(route.description, []) \
+                        .append(route)
+                by_expression.setdefault(route.expression, []).append(route)
+
+        matched = set()
+        create, update = [], []
+
+        def match(index, key):
+            for route in index.get(key, ()):
+                if id(route) not in matched:
+                    return route
+
+        for desired in routes:
+            route = (desired.description and
+                     match(by_description, desired.description)) or \
+                match(by_expression, desired.expression)
+
+            if route is None:
+                create.append(cls(client=client, **_route_data(desired)))
+                continue
+
+            matched.add(id(route))
+            changes = dict((key, value)
+                           for key, value in _route_data(desired).items()
+                           if (getattr(route, key) or None) != (value or None))
+            if changes:
+                update.append((route, changes))
+
+        remove = [route for route in existing
+                  if id(route) not in matched] if delete else []
+
+        return RoutePlan(create, update, remove, client)
+
+    @classmethod
+    def reconcile(cls, routes, client=None, delete=True, dry_run=False,
+                  workers=1):
+        """Make the Routes match the desired `routes` (see :meth:`plan`).
+        Return the RoutePlan; unless `dry_run` is set, it is applied with up
+        to `workers` concurrent requests and its `results` are set."""
+
+        plan = cls.plan(routes, client, delete)
+        if not dry_run:
+            plan.results = plan.apply(workers)
+        return plan
 
     def update(self, **kwargs):
+        update_data = self._prepare_update(kwargs)
+
+        if len(update_data):
+            try:
+                self.client.put('/routes/{}'.format(self.id), update_data)
+            except api.NotFound as E:
+                object.__setattr__(self, '_implemented', False)
+                raise errors.PHException(
+                    'Cannot update non-implemented Route. '
+                    'Implement first.') from E
+            except errors.PHException:
+                raise
+            self._updated()
+
+        return True
+
+    def _prepare_update(self, kwargs):
+        """Set the given attributes and return the data to send."""
+
         id_set = False
         if 'id' in kwargs and not self.id:
             object.__setattr__(self, 'id', kwargs['id'])
             del kwargs['id']
             id_set = True
 
-        if not self.is_implemented() and not id_set:
+        if (not self.id or self._implemented is False) and not id_set:
             raise errors.PHException(
                 'Cannot update non-implemented Route. Implement first.')
 
-        update_data = {}
-
-        for key in set(kwargs.keys()) & set(['priority',
-                                             'description', 'expression']):
+        for key in set(kwargs.keys()) & set(['priority', 'description',
+                                             'expression', 'actions']):
             object.__setattr__(self, key, kwargs[key])
-            update_data[key] = kwargs[key]
 
-        if 'actions' in kwargs:
-            object.__setattr__(self, 'actions', kwargs['actions'])
-            update_data['action'] = kwargs['actions']
+        update_data = dict((key, getattr(self, key))
+                           for key in self._fields_to_send(kwargs))
 
-        if len(update_data):
-            try:
-                api.put('/routes/{}'.format(self.id), update_data)
-            except errors.PHException:
-                raise
+        if 'actions' in update_data:
+            update_data['action'] = update_data.pop('actions')
 
-        return True
+        return update_data
 
-    def implement(self):
-        if self.is_implemented():
-            raise errors.PHException("This Route is already implemented.")
+    def _updated(self):
+        """Register that the Route was saved to Mailgun."""
+
+        object.__setattr__(self, '_implemented', True)
+        self._mark_clean()
+        cache.invalidate(self.client, '/routes/{}'.format(self.id))
 
-        data = {'priority': self.priority,
+    def get_data(self):
+        """Return the attributes of the Route as sent to Mailgun."""
+
+        return {'priority': self.priority,
                 'description': self.description,
                 'expression': self.expression,
                 'action': self.actions}
 
-        print(data)
+    def implement(self):
+        if self.is_implemented():
+            raise errors.PHException("This Route is already implemented.")
 
         try:
-            response = api.post('/routes', data)
-            self.update(id=response['route']['id'])
+            response = self.client.post('/routes', self.get_data())
         except errors.PHException:
             raise
         else:
+            object.__setattr__(self, 'id', response['route']['id'])
+            self._updated()
             return True
 
     def delete(self):
         try:
-            api.delete('/routes/{}'.format(self.id))
+            self.client.delete('/routes/{}'.format(self.id))
         except errors.PHException:
             raise
+        object.__setattr__(self, '_implemented', False)
+        cache.invalidate(self.client, '/routes/{}'.format(self.id))
         return True
 
     def is_implemented(self):
+        """Check whether the Route is implemented. Unless this is already
+        known (e.g. because the Route was loaded, implemented or deleted),
+        this is checked by trying to load it from Mailgun."""
+
         if not self.id:
             return False
-        try:
-            self.__class__.load(self.id)
-        except LookupError:
-            return False
-        else:
-            return True
+        if self._implemented is None:
+            try:
+                self.__class__.load(self.id, client=self.client)
+            except LookupError:
+                object.__setattr__(self, '_implemented', False)
+            else:
+                object.__setattr__(self, '_implemented', True)
+        return self._implemented
+
+
+def _route_data(route):
+    """Return the attributes of a Route that are compared and sent."""
+
+    return {'priority': route.priority,
+            'description': route.description,
+            'expression': route.expression,
+            'actions': route.actions}
+
+
+def _describe(route):
+    return '{} [{}]'.format(route.description or route.expression,
+                            route.id or 'new')
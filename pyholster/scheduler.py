@@ -0,0 +1,238 @@
+"""Schedule outgoing Mail by priority class.
+
+A Scheduler sends Mail on a pool of worker threads, within one rate budget.
+Each Mail is submitted in a priority class, e.g. 'transactional' for
+password resets and 'bulk' for newsletters. When several classes have Mail
+waiting, each class gets a share of the rate budget in proportion to its
+weight; a class without waiting Mail leaves its share to the others. Within
+a class, the sending domains share the budget equally, so one large send
+does not hold up the other domains.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from . import api
+from .ratelimit import TokenBucket
+
+
+class _FairShare(object):
+
+    """Share a budget between keys by stride scheduling: of the keys with
+    waiting items, the one with the lowest pass goes next, after which its
+    pass advances by 1 / weight."""
+
+    def __init__(self):
+        self.passes = {}
+        self.virtual_time = 0.0
+
+    def activate(self, key):
+        """Register that `key` has waiting items again. A key that was idle
+        does not catch up on the share it did not use."""
+
+        self.passes[key] = max(self.passes.get(key, 0.0), self.virtual_time)
+
+    def choose(self, keys, weight=lambda key: 1):
+        key = min(keys, key=self.passes.__getitem__)
+        self.virtual_time = self.passes[key]
+        self.passes[key] += 1.0 / weight(key)
+        return key
+
+
+class _Stats(object):
+
+    """Counters and recent latencies of one priority class."""
+
+    def __init__(self, window):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+
+    def summary(self, queued):
+        return {'queued': queued,
+                'sent': self.sent,
+                'failed': self.failed,
+                'latency': _percentiles(self.latencies),
+                'wait': _percentiles(self.waits)}
+
+
+class Scheduler(object):
+
+    """Send Mail by priority class, within a rate budget of `rate` Mails per
+    second (bursts of `capacity`), on `workers` threads, with `client` (or
+    the default Client). The Client should not have a rate limit of its own,
+    as the Scheduler could then not decide which Mail uses the budget.
+
+    `weights` maps the priority classes to their weight; by default
+    'transactional' Mail gets 20 times the share of 'bulk' Mail. The
+    latencies of the last `window` Mails per class are kept for
+    :meth:`metrics`."""
+
+    def __init__(self, client=None, rate=None, capacity=None, workers=4,
+                 weights=None, window=1000):
+
+        self.client = client
+        self.rate_limiter = TokenBucket(rate, capacity) if rate else None
+        self.workers = workers
+        self.weights = dict(weights or {'transactional': 20, 'bulk': 1})
+
+        self._queues = dict((name, OrderedDict()) for name in self.weights)
+        self._class_share = _FairShare()
+        self._domain_shares = dict((name, _FairShare())
+                                   for name in self.weights)
+        self._length = 0
+        self._stats = dict((name, _Stats(window)) for name in self.weights)
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def submit(self, mail, priority='bulk'):
+        """Queue `mail` in priority class `priority` and return a Future,
+        which holds the message id once the Mail was sent."""
+
+        if priority not in self.weights:
+            raise ValueError("Unknown priority class {!r}.".format(priority))
+
+        mail.check_attributes()
+        future = Future()
+
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("The Scheduler is stopped.")
+
+            domains = self._queues[priority]
+            if not domains:
+                self._class_share.activate(priority)
+            if mail.domain not in domains:
+                domains[mail.domain] = deque()
+                self._domain_shares[priority].activate(mail.domain)
+            domains[mail.domain].append((mail, future, time.monotonic()))
+
+            self._length += 1
+            self._condition.notify()
+
+        return future
+
+    def send(self, mail, priority='transactional', timeout=None):
+        """Queue `mail` and wait until it was sent. Return the message id."""
+
+        return self.submit(mail, priority).result(timeout)
+
+    def start(self):
+        """Start the worker threads."""
+
+        with self._condition:
+            self._stopping = False
+
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, daemon=True,
+                                      name='pyholster-scheduler')
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain=True):
+        """Stop the worker threads, after sending the queued Mail if `drain`
+        is set. Otherwise the queued Mail is cancelled."""
+
+        with self._condition:
+            self._stopping = True
+            if not drain:
+                while self._length:
+                    self._next()[1][1].cancel()
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def metrics(self):
+        """Return per priority class the number of Mails `queued`, `sent`
+        and `failed`, and the `latency` (from submitting until sent) and
+        `wait` (from submitting until sending started) in seconds, as the
+        mean, median, 95th percentile and maximum over recent Mails."""
+
+        with self._condition:
+            return dict(
+                (name, stats.summary(self._queued(name)))
+                for name, stats in self._stats.items())
+
+    def _queued(self, name):
+        return sum(len(queue) for queue in self._queues[name].values())
+
+    def _next(self):
+        """Take the next Mail: the priority class and then the domain are
+        chosen by their fair share."""
+
+        name = self._class_share.choose(
+            [name for name, domains in self._queues.items() if domains],
+            self.weights.__getitem__)
+
+        domains = self._queues[name]
+        domain = self._domain_shares[name].choose(domains)
+        item = domains[domain].popleft()
+
+        if not domains[domain]:
+            del domains[domain]
+            del self._domain_shares[name].passes[domain]
+
+        self._length -= 1
+        return name, item
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._length and not self._stopping:
+                    self._condition.wait()
+                if not self._length:
+                    return
+
+            # Wait for the rate budget before choosing the Mail, so that Mail
+            # submitted in the meantime is taken into account.
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            with self._condition:
+                if not self._length:
+                    continue
+                name, (mail, future, submitted) = self._next()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+
+            try:
+                mail.send(api.get_client(self.client or mail.client))
+            except Exception as E:
+                with self._condition:
+                    self._stats[name].failed += 1
+                future.set_exception(E)
+            else:
+                finished = time.monotonic()
+                with self._condition:
+                    stats = self._stats[name]
+                    stats.sent += 1
+                    stats.latencies.append(finished - submitted)
+                    stats.waits.append(started - submitted)
+                future.set_result(mail.id)
+
+
+def _percentiles(values):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return {'mean': sum(values) / len(values),
+            'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1]}
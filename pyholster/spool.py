@@ -0,0 +1,345 @@
+"""Queue outgoing Mail in a local SQLite database and send it in the
+background.
+
+Enqueueing a Mail only writes it to the spool, so sending no longer blocks
+on Mailgun. A Spool's worker threads send the queued messages, retrying
+them with exponential backoff while Mailgun is unavailable. Messages that
+were being sent when a process stopped are sent again once their lease
+expired, so nothing is lost when a process crashes; such a message may be
+delivered twice. Several processes can share one spool file.
+"""
+
+import base64
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import api
+from . import codec
+from . import concurrency
+from . import storage
+from .mail import Mail
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+_schema = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    mail TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due REAL NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_due
+    ON messages (status, due, priority);
+CREATE INDEX IF NOT EXISTS messages_message_id
+    ON messages (message_id);
+"""
+
+# Errors after which a message is sent again; others fail immediately. A
+# connection error only counts if the request did not reach Mailgun. As with
+# RetryPolicy, a 5xx reply is not retried: Mailgun may have accepted the
+# message (and a 200 reply with a body that can not be decoded, which also
+# raises a ServerError, means it did).
+_temporary_errors = (api.ConnectionError, api.TooManyRequests)
+
+
+class Spool(object):
+
+    """A durable queue of outgoing Mail in the SQLite database at `path`.
+
+    Messages are sent with `client` (or the default Client), which applies
+    its rate limit, on `workers` threads. Due messages are claimed from the
+    database `batch_size` at a time. A message that fails with a temporary
+    error (no connection could be made, or 429) is retried after
+    ``backoff * 2 ** (attempts - 1)`` seconds (at most `max_backoff`), up
+    to `max_attempts` attempts. A message whose request may have reached
+    Mailgun (e.g. the response timed out, or Mailgun replied with a 5xx) is
+    not retried, as it may have been sent; it fails with the error. A
+    message that is being sent is leased for `lease` seconds; if it is not
+    sent by then (e.g. because the process crashed), it is sent again."""
+
+    def __init__(self, path, client=None, workers=4, batch_size=50,
+                 max_attempts=8, backoff=30, max_backoff=3600, lease=300,
+                 poll_interval=1):
+
+        self.path = path
+        self.client = client
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+
+        storage.initialize(path, _schema)
+
+    def _connect(self):
+        return storage.connect(self.path)
+
+    ##
+    # Queueing
+    ##
+
+    def enqueue(self, mail, priority=0):
+        """Add `mail` to the spool and return the id to look up its status
+        with. Messages with a higher `priority` are sent first."""
+
+        mail.check_attributes()
+
+        spool_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO messages (id, mail, priority, status, due, '
+                'created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (spool_id, codec.dumps(_dump_mail(mail)), priority, QUEUED,
+                 now, now, now))
+
+        self._wakeup.set()
+        return spool_id
+
+    def status(self, id):
+        """Return the status of a message, by the id returned by
+        :meth:`enqueue` or the message id returned by Mailgun, as a dict with
+        the `status` ('queued', 'sending', 'sent' or 'failed'), the number
+        of `attempts`, the Mailgun `message_id` and the last `error`. Return
+        None for an unknown id."""
+
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT id, status, attempts, message_id, error, created, '
+                'updated FROM messages WHERE id = ? OR message_id = ?',
+                (id, id)).fetchone()
+
+        return dict(row) if row is not None else None
+
+    def counts(self):
+        """Return the number of messages per status."""
+
+        with self._connect() as db:
+            return dict(db.execute(
+                'SELECT status, COUNT(*) FROM messages GROUP BY status'))
+
+    def purge(self, older_than=7 * 24 * 3600):
+        """Remove sent and failed messages last updated more than
+        `older_than` seconds ago. Return the number removed."""
+
+        with self._connect() as db:
+            return db.execute(
+                'DELETE FROM messages WHERE status IN (?, ?) AND updated < ?',
+                (SENT, FAILED, time.time() - older_than)).rowcount
+
+    ##
+    # Sending
+    ##
+
+    def process(self):
+        """Claim and send one batch of due messages. Return the number of
+        messages handled."""
+
+        claimed = self._claim()
+        if claimed:
+            for result in concurrency.run(self._send, claimed,
+                                          self.workers).failed:
+                logger.error("PH spool %s: could not record the outcome",
+                             result.item[0], exc_info=result.error)
+        return len(claimed)
+
+    def drain(self):
+        """Send due messages until none are left."""
+
+        while self.process():
+            pass
+
+    def start(self):
+        """Start sending in a background thread."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='pyholster-spool', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread after the current batch. Messages
+        still queued are sent when the spool is started again."""
+
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                handled = self.process()
+            except sqlite3.Error:
+                logger.exception("PH spool: could not process %s", self.path)
+                handled = 0
+
+            if not handled:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self):
+        """Lease a batch of due messages, including messages whose lease
+        expired, and return their (id, mail, attempts)."""
+
+        now = time.time()
+
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            rows = db.execute(
+                'SELECT id, mail, attempts FROM messages '
+                'WHERE status IN (?, ?) AND due <= ? '
+                'ORDER BY priority DESC, due LIMIT ?',
+                (QUEUED, SENDING, now, self.batch_size)).fetchall()
+            db.executemany(
+                'UPDATE messages SET status = ?, attempts = attempts + 1, '
+                'due = ?, updated = ? WHERE id = ?',
+                [(SENDING, now + self.lease, now, row['id'])
+                 for row in rows])
+
+        return [(row['id'], row['mail'], row['attempts'] + 1)
+                for row in rows]
+
+    def _send(self, claimed):
+        """Send a claimed message and record the outcome."""
+
+        spool_id, data, attempts = claimed
+
+        try:
+            mail = _load_mail(codec.loads(data), self.client)
+            mail.send()
+        except _temporary_errors as E:
+            if attempts < self.max_attempts and _may_retry(E):
+                delay = min(self.max_backoff,
+                            self.backoff * 2 ** (attempts - 1))
+                self._update(spool_id, QUEUED, error=repr(E), delay=delay)
+            else:
+                self._update(spool_id, FAILED, error=repr(E))
+        except Exception as E:
+            self._update(spool_id, FAILED, error=repr(E))
+        else:
+            self._update(spool_id, SENT, message_id=mail.id)
+
+    def _update(self, spool_id, status, message_id=None, error=None,
+                delay=0):
+
+        now = time.time()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("PH spool %s: %s %s", spool_id, status, error or '')
+
+        with self._connect() as db:
+            db.execute(
+                'UPDATE messages SET status = ?, message_id = ?, error = ?, '
+                'due = ?, updated = ? WHERE id = ? AND status = ?',
+                (status, message_id, error, now + delay, now, spool_id,
+                 SENDING))
+
+
+def _may_retry(error):
+    """Whether a message can be sent again after a temporary error without
+    risking to send it twice."""
+
+    if not isinstance(error, api.ConnectionError):
+        return True
+    return error.__cause__ is not None and api._not_sent(error.__cause__)
+
+
+# The Mail attributes that are stored, and those holding file contents.
+_mail_fields = ('domain', 'sender', 'to', 'cc', 'bcc', 'subject', 'text',
+                'html', 'message', 'attachments', 'inline', 'options',
+                'headers', 'variables')
+_file_fields = ('message', 'attachments', 'inline')
+
+
+def _dump_mail(mail):
+    """Return the attributes of `mail` as JSON compatible data. Paths are
+    stored as paths; file objects and buffers by their content."""
+
+    data = dict((field, getattr(mail, field, None))
+                for field in _mail_fields
+                if getattr(mail, field, None) is not None)
+
+    for field in _file_fields:
+        if field not in data:
+            continue
+        if field == 'message':
+            data[field] = _dump_file(data[field])
+        else:
+            data[field] = [_dump_file(value) for value in data[field]]
+
+    return data
+
+
+def _dump_file(value):
+
+    if isinstance(value, tuple):
+        return {'tuple': [_dump_file(item) for item in value]}
+    if isinstance(value, os.PathLike):
+        return {'path': os.fspath(value)}
+    if isinstance(value, str):
+        return value
+    if hasattr(value, 'read') and not isinstance(value, (bytes, bytearray)):
+        value.seek(0)
+        value = value.read()
+        if isinstance(value, str):
+            return value
+    return {'base64': base64.b64encode(bytes(value)).decode('ascii')}
+
+
+def _load_mail(data, client=None):
+
+    for field in _file_fields:
+        if field not in data:
+            continue
+        if field == 'message':
+            data[field] = _load_file(data[field])
+        else:
+            data[field] = [_load_file(value) for value in data[field]]
+
+    return Mail(client=client, **data)
+
+
+def _load_file(value):
+
+    if not isinstance(value, dict):
+        return value
+    if 'tuple' in value:
+        return tuple(_load_file(item) for item in value['tuple'])
+    if 'path' in value:
+        return pathlib.Path(value['path'])
+    return base64.b64decode(value['base64'])
@@ -0,0 +1,35 @@
+"""Helpers for the SQLite databases of the spool and the mirror."""
+
+import sqlite3
+
+
+class connect(object):
+
+    """Connect to the SQLite database at `path`, in autocommit mode. Used as
+    a context manager, an open transaction is committed (or rolled back on
+    an exception) and the connection is closed on exit."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path, timeout=30,
+                                  isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        return self.db
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if self.db.in_transaction:
+                self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.db.close()
+
+
+def initialize(path, schema):
+    """Create the tables in `schema` if needed, using write-ahead logging so
+    that readers do not block the writer."""
+
+    with connect(path) as db:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(schema)
@@ -0,0 +1,159 @@
+"""Decode the items of a JSON response while it is received.
+
+Mailgun returns collections as an object like ``{"items": [...], "paging":
+{...}}``. An ItemStream decodes such a body incrementally from its chunks
+and yields the items one at a time, so only the item being decoded is held
+in memory rather than the whole body and all of its items. The other
+members of the object (e.g. `paging`) are collected in `fields`.
+"""
+
+import codecs
+import json
+import re
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class ItemStream(object):
+
+    """The items of array `key` in the JSON object sent as `chunks` (an
+    iterable of bytes). Iterating yields the decoded items; once all were
+    yielded, `fields` holds the other members of the object. `close` is
+    called when the stream is exhausted or closed. A malformed body raises
+    `error` (ValueError by default)."""
+
+    def __init__(self, chunks, key='items', close=None, error=ValueError):
+
+        self.key = key
+        self.fields = {}
+
+        self._chunks = iter(chunks)
+        self._close = close
+        self._error = error
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._iterator = None
+
+    def __iter__(self):
+        if self._iterator is None:
+            self._iterator = self._items()
+        return self._iterator
+
+    def close(self):
+        """Stop receiving the body."""
+
+        if self._iterator is not None:
+            self._iterator.close()
+        self._closed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _closed(self):
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+
+    ##
+    # Parsing
+    ##
+
+    def _items(self):
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+
+            while True:
+                name = self._value()
+                if not isinstance(name, str):
+                    raise self._fail("Expecting a property name")
+                self._expect(':')
+
+                if name == self.key:
+                    yield from self._array()
+                else:
+                    self.fields[name] = self._value()
+
+                char = self._peek()
+                if char not in (',', '}'):
+                    raise self._fail("Expecting ',' or '}'")
+                self._pos += 1
+                if char == '}':
+                    return
+        finally:
+            self._closed()
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+
+            char = self._peek()
+            if char not in (',', ']'):
+                raise self._fail("Expecting ',' or ']'")
+            self._pos += 1
+            if char == ']':
+                return
+
+    def _value(self):
+        """Decode the next value. A value that ends at the end of the data
+        received so far may continue (e.g. a number), so it is only taken
+        once more data or the end of the body was received."""
+
+        self._peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except ValueError as E:
+                if self._eof:
+                    raise self._fail(E.msg) from E
+            else:
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            self._read()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self._fail("Expecting {!r}".format(char))
+        self._pos += 1
+
+    def _peek(self):
+        """Skip whitespace and return the next character ('' at the end)."""
+
+        while True:
+            self._pos = _whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                return ''
+            self._read()
+
+    def _read(self):
+        """Receive the next chunk, dropping what was decoded already."""
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+        try:
+            text = self._decode(chunk or b'', self._eof)
+        except UnicodeDecodeError as E:
+            raise self._fail(E.reason) from E
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+
+    def _fail(self, message):
+        return self._error("Malformed JSON: {} at {!r}".format(
+            message, self._buffer[self._pos:self._pos + 20]))
@@ -0,0 +1,56 @@
+"""Track changes of objects since they were last in sync with Mailgun."""
+
+import copy
+
+
+class Tracked(object):
+
+    """Mixin that keeps track of which fields changed since the object was
+    last loaded from or saved to Mailgun. Subclasses list the fields in
+    `tracked_fields`. Changes inside mutable values (e.g. `Member.vars`) are
+    detected as well."""
+
+    __slots__ = ()
+
+    tracked_fields = ()
+
+    _clean = None
+
+    def _mark_clean(self):
+        """Remember the current values as being in sync with Mailgun."""
+
+        object.__setattr__(self, '_clean', tuple(
+            copy.deepcopy(self._comparable(field, getattr(self, field)))
+            for field in self.tracked_fields))
+
+    def _comparable(self, field, value):
+        """Return the form in which the value of `field` is remembered and
+        compared. Subclasses may use a more compact form than the value."""
+
+        return value
+
+    def dirty_fields(self):
+        """Return the set of fields changed since the object was last in
+        sync with Mailgun. All fields are dirty if it never was."""
+
+        if self._clean is None:
+            return set(self.tracked_fields)
+
+        return set(field for field, clean in zip(self.tracked_fields,
+                                                 self._clean)
+                   if self._comparable(field, getattr(self, field)) != clean)
+
+    @property
+    def is_dirty(self):
+        """Whether any field changed since the object was last in sync."""
+
+        return bool(self.dirty_fields())
+
+    def _fields_to_send(self, given):
+        """Return the fields to send in an update: the dirty fields or, if
+        the object was never in sync, only the `given` fields."""
+
+        if self._clean is None:
+            return set(given) & set(self.tracked_fields)
+
+        return self.dirty_fields()
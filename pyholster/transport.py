@@ -0,0 +1,108 @@
+"""Pooled, keep-alive HTTP transport used for all requests to Mailgun."""
+
+import os
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Transport(object):
+
+    """Keep a pool of keep-alive connections to Mailgun.
+
+    A Transport wraps a :class:`requests.Session` with a configured
+    :class:`requests.adapters.HTTPAdapter`, so connections are reused between
+    requests instead of doing a TCP and TLS handshake for every call. The
+    session is created lazily and is safe to share between threads.
+
+    `pool_connections` is the number of hosts to keep a pool for,
+    `pool_maxsize` the number of connections kept per host and `pool_block`
+    whether to wait for a free connection instead of opening an extra one
+    when a pool is exhausted. `timeout` is passed to every request, either as
+    a number or as a (connect, read) tuple.
+
+    After a fork the child process automatically starts with a fresh session;
+    connections of the parent are never shared."""
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 max_retries=0, timeout=(5, 60), keep_alive=True):
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = os.getpid()
+
+        _transports.add(self)
+
+    @property
+    def session(self):
+        """Return the session, creating it if necessary."""
+
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._create_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _create_session(self):
+        """Create a session with a pooled adapter mounted for HTTP(S)."""
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              pool_block=self.pool_block,
+                              max_retries=self.max_retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Send a request over a pooled connection."""
+
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        """Close all pooled connections. The next request opens a new
+        session."""
+
+        with self._lock:
+            session, self._session = self._session, None
+
+        if session is not None and self._pid == os.getpid():
+            session.close()
+
+    def reset(self):
+        """Drop the session without closing its connections. Used in a
+        forked child, where the sockets still belong to the parent."""
+
+        with self._lock:
+            self._session = None
+            self._pid = os.getpid()
+
+
+_transports = weakref.WeakSet()
+
+
+def _reset_all():
+    """Reset all transports after a fork."""
+
+    for transport in list(_transports):
+        transport.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_all)
@@ -0,0 +1,270 @@
+import asyncio
+import io
+import json
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from pyholster import aio, cache  # noqa: E402
+from pyholster.retry import RetryPolicy  # noqa: E402
+
+
+def run_with_server(routes, coroutine, client_options=None):
+    """Run `coroutine(client, calls)` against a local server with the given
+    routes, as (method, path, status, body) tuples. A route with a list of
+    statuses responds with them in turn. Uploaded files are recorded by
+    their content."""
+
+    calls = []
+
+    def handler(status, body):
+        statuses = list(status) if isinstance(status, list) else None
+
+        async def handle(request):
+            form = (await request.post()).copy()
+            for key, value in list(form.items()):
+                if isinstance(value, web.FileField):
+                    form[key] = value.file.read()
+            calls.append((request.method, request.path, form))
+            return web.Response(
+                status=statuses.pop(0) if statuses else status,
+                text=json.dumps(body))
+        return handle
+
+    async def main():
+        app = web.Application()
+        for method, path, status, body in routes:
+            app.router.add_route(method, '/v3' + path, handler(status, body))
+
+        async with TestServer(app) as server:
+            client = aio.AsyncClient('key-test',
+                                     str(server.make_url('/v3')),
+                                     **(client_options or {}))
+            try:
+                return await coroutine(client, calls)
+            finally:
+                await aio.close()
+
+    return asyncio.run(main())
+
+
+class TestAio:
+
+    def test_verbs(self):
+        routes = [('GET', '/testing', 200, {'message': 'OK'}),
+                  ('POST', '/testing', 200, {'message': 'posted'}),
+                  ('PUT', '/testing', 200, {'message': 'put'}),
+                  ('DELETE', '/testing', 200, {'message': 'deleted'}),
+                  ('GET', '/missing', 404, {})]
+
+        async def test(client, calls):
+            assert await client.get('/testing') == {'message': 'OK'}
+            assert await client.post('/testing', {'a': [1, 2]}) == {
+                'message': 'posted'}
+            assert await client.put('/testing', {'b': None}) == {
+                'message': 'put'}
+            assert await client.delete('/testing') == {'message': 'deleted'}
+
+            with pytest.raises(aio.api.NotFound):
+                await client.get('/missing')
+
+            assert calls[1][2].getall('a') == ['1', '2']
+            assert 'b' not in calls[2][2]
+
+        run_with_server(routes, test)
+
+    def test_concurrent_requests_share_pool(self):
+        routes = [('GET', '/testing', 200, {'message': 'OK'})]
+
+        async def test(client, calls):
+            responses = await asyncio.gather(
+                *(client.get('/testing') for _ in range(50)))
+            assert len(responses) == 50
+            assert client.session is aio.get_session()
+
+        run_with_server(routes, test)
+
+    def test_mailing_list(self):
+        members = [{'address': 'member{}@tests.eu'.format(i),
+                    'subscribed': True, 'vars': {'id': i}}
+                   for i in range(3)]
+        routes = [('GET', '/lists/list@tests.eu', 200,
+                   {'list': {'address': 'list@tests.eu', 'name': 'List'}}),
+                  ('GET', '/lists/list@tests.eu/members/pages', 200,
+                   {'items': members}),
+                  ('PUT', '/lists/list@tests.eu', 200, {}),
+                  ('POST', '/lists/list@tests.eu/members', 200, {}),
+                  ('DELETE', '/lists/list@tests.eu', 200, {})]
+
+        async def test(client, calls):
+            lst = await aio.MailingList.load('list@tests.eu', client=client)
+            assert lst.name == 'List'
+            assert await lst.is_implemented()
+
+            assert await lst.update(name='Renamed')
+            assert calls[-1] == ('PUT', '/v3/lists/list@tests.eu',
+                                 {'name': 'Renamed'})
+
+            pages = []
+            async for member in lst.iter_members():
+                pages.append(member)
+                if len(pages) == 3:
+                    break
+            assert [m.address for m in pages] == [
+                m['address'] for m in members]
+
+            lst._members = pages
+            lst.reindex()
+            pages[1].vars['id'] = 'changed'
+            results = await lst.save_members()
+            assert results
+            assert [c[0] for c in calls].count('POST') == 1
+
+            assert await lst.delete()
+            assert not await lst.is_implemented()
+
+        run_with_server(routes, test)
+
+    def test_mailing_list_members(self):
+        url = '/lists/list@tests.eu/members'
+        routes = [('GET', url + '/pages', 200, {'items': []}),
+                  ('POST', url + '.json', 200, {'message': 'updated'}),
+                  ('POST', url, 200, {}),
+                  ('DELETE', url + '/member0@tests.eu', 200, {}),
+                  ('DELETE', url + '/member1@tests.eu', 200, {}),
+                  ('DELETE', url + '/new@tests.eu', 200, {}),
+                  ('DELETE', url + '/other@tests.eu', 200, {})]
+
+        async def test(client, calls):
+            lst = aio.MailingList(address='list@tests.eu', client=client,
+                                  implemented=True)
+            assert await lst.load_members() == []
+
+            results = await lst.bulk_add_members(
+                [{'address': 'member{}@tests.eu'.format(i)}
+                 for i in range(3)], chunk_size=2, limit=2)
+            assert [len(result.members) for result in results] == [2, 1]
+            assert all(result.ok for result in results)
+            assert [c[1] for c in calls[1:]] == ['/v3' + url + '.json'] * 2
+            assert not any(m.is_dirty for m in lst.members)
+
+            lst.members[2].vars['id'] = 2
+            assert len(await lst.flush()) == 1
+            assert len(calls) == 4
+
+            await lst.add_member(aio.Member(address='new@tests.eu'))
+            assert await lst.add_members([{'address': 'other@tests.eu'}])
+            assert [c[1] for c in calls[4:]] == ['/v3' + url] * 2
+            assert len(lst.members) == 5
+
+            results = await lst.delete_all_members()
+            assert len(results.failed) == 1
+            assert [c[0] for c in calls].count('DELETE') == 4
+            assert [m.address for m in lst.members] == ['member2@tests.eu']
+
+            with pytest.raises(TypeError):
+                lst.plan([])
+            with pytest.raises(ValueError):
+                await lst.bulk_add_members([], chunk_size=1001)
+
+        run_with_server(routes, test)
+
+    def test_route(self):
+        routes = [('POST', '/routes', 200,
+                   {'route': {'id': 'abc'}}),
+                  ('PUT', '/routes/abc', 200, {}),
+                  ('DELETE', '/routes/abc', 200, {})]
+
+        async def test(client, calls):
+            route = aio.Route(expression='match_recipient(".*")',
+                              actions=['stop()', 'forward("a@b.c")'],
+                              client=client)
+            assert await route.implement()
+            assert route.id == 'abc'
+            assert await route.update(priority=3)
+            assert calls[-1][2] == {'priority': '3'}
+            assert await route.delete()
+
+        run_with_server(routes, test)
+
+    def test_mail(self):
+        routes = [('POST', '/tests.eu/messages', 200,
+                   {'message': 'Queued. Thank you.', 'id': '<1@tests.eu>'})]
+
+        async def test(client, calls):
+            mail = aio.Mail(domain='tests.eu', sender='me@tests.eu',
+                            to='you@tests.eu', subject='Hi', text='Hello')
+            assert await mail.send(client)
+            assert mail.id == '<1@tests.eu>'
+            assert calls[0][2]['from'] == 'me@tests.eu'
+
+        run_with_server(routes, test)
+
+    def test_mail_send_batch(self):
+        routes = [('POST', '/example.com/messages', 200,
+                   {'message': 'Queued. Thank you.', 'id': '<1@example.com>'})]
+
+        async def test(client, calls):
+            mail = aio.Mail(sender='foo@example.com', domain='example.com',
+                            subject='Hi', text='Hi %recipient.name%',
+                            client=client)
+            results = await mail.send_batch(
+                [('a@example.com', {'name': 'A'}), 'b@example.com'],
+                batch_size=1)
+
+            assert [result.id for result in results] == \
+                ['<1@example.com>'] * 2
+            assert calls[0][2].getall('to') == ['a@example.com']
+            assert json.loads(calls[0][2]['recipient-variables']) == \
+                {'a@example.com': {'name': 'A'}}
+
+        run_with_server(routes, test)
+
+    def test_mail_rewinds_files(self):
+        routes = [('POST', '/example.com/messages', [429, 200, 200, 200],
+                   {'message': 'Queued. Thank you.', 'id': '<1@example.com>'})]
+        policy = RetryPolicy(backoff=0, jitter=False)
+
+        async def test(client, calls):
+            mail = aio.Mail(sender='foo@example.com', domain='example.com',
+                            subject='Hi', text='Hi', client=client,
+                            attachments=[('a.bin', io.BytesIO(b'x' * 1000))])
+            results = await mail.send_batch(
+                ['a@example.com', 'b@example.com', 'c@example.com'],
+                batch_size=1)
+
+            assert all(result.ok for result in results)
+            assert len(calls) == 4
+            assert [len(call[2]['attachment']) for call in calls] == \
+                [1000] * 4
+
+        run_with_server(routes, test, {'retry_policy': policy})
+
+    def test_delete_invalidates_cache(self):
+        routes = [('DELETE', '/lists/list@tests.eu', 200, {}),
+                  ('DELETE', '/routes/abc', 200, {})]
+
+        async def test(client, calls):
+            paths = ('/lists/list@tests.eu', '/routes/abc')
+            for path in paths:
+                cached.backend.set(cache._key(client, path), (True, {}))
+
+            lst = aio.MailingList(address='list@tests.eu', client=client,
+                                  implemented=True)
+            route = aio.Route(id='abc', expression='match_recipient(".*")',
+                              actions=['stop()'], client=client)
+            assert await lst.delete()
+            assert await route.delete()
+
+            assert len(calls) == 2
+            assert cached.stats['invalidations'] == 2
+            assert all(cached.backend.get(cache._key(client, path)) is None
+                       for path in paths)
+
+        cached = cache.enable()
+        try:
+            run_with_server(routes, test)
+        finally:
+            cache.disable()
@@ -1,7 +1,10 @@
 import pyholster as ph
 import responses
+import requests
 import json
 import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from utils import load_fixture
 
@@ -73,3 +76,366 @@ class TestAPI:
                         func('/status_400', dict(input='random'))
                     else:
                         func('/status_400')
+
+    class TestTransport:
+
+        def setup_method(self, method):
+            self.apikey = ph.api.apikey
+            ph.api.set_key('key-test')
+
+        def teardown_method(self, method):
+            ph.api.set_key(self.apikey)
+
+        @responses.activate
+        def test_session_reused(self):
+            responses.add(responses.GET,
+                          ph.api.baseurl + '/testing/',
+                          status=200,
+                          body=json.dumps(dict(message="OK")))
+
+            session = ph.api.transport.session
+            ph.api.get('/testing/')
+            ph.api.get('/testing/')
+
+            assert ph.api.transport.session is session
+            assert len(responses.calls) == 2
+
+        def test_pool_configuration(self):
+            transport = ph.Transport(pool_connections=2, pool_maxsize=20,
+                                     pool_block=True)
+            adapter = transport.session.get_adapter(ph.api.baseurl)
+
+            assert adapter._pool_connections == 2
+            assert adapter._pool_maxsize == 20
+            assert adapter._pool_block
+
+        def test_close_and_reset(self):
+            transport = ph.Transport()
+            session = transport.session
+
+            transport.close()
+            assert transport.session is not session
+
+            session = transport.session
+            transport.reset()
+            assert transport.session is not session
+
+        def test_set_transport(self):
+            old_transport = ph.api.transport
+            try:
+                ph.api.configure_transport(pool_maxsize=5)
+                assert ph.api.transport is not old_transport
+                assert ph.api.transport.pool_maxsize == 5
+            finally:
+                ph.api.set_transport(old_transport)
+
+    class TestClient:
+
+        @responses.activate
+        def test_request(self):
+            responses.add(responses.GET,
+                          'https://api.eu.mailgun.net/v3/testing/',
+                          status=200,
+                          body=json.dumps(dict(message="OK")))
+
+            client = ph.Client('key-eu', 'https://api.eu.mailgun.net/v3')
+            respons = client.get('/testing/')
+
+            assert respons == dict(message="OK")
+            assert responses.calls[0].request.headers['Authorization'] == \
+                requests.auth._basic_auth_str('api', 'key-eu')
+
+        def test_no_key(self):
+            with pytest.raises(ph.api.APIKeyError):
+                ph.Client(None).get('/testing/')
+
+        def test_default_client(self):
+            apikey = ph.api.apikey
+            try:
+                ph.api.set_key('key-default')
+                assert ph.api.get_client().key == 'key-default'
+                assert ph.api.get_client().baseurl == ph.api.baseurl
+                assert ph.api.get_client().transport is ph.api.transport
+            finally:
+                ph.api.set_key(apikey)
+
+        @responses.activate
+        def test_concurrent_clients(self):
+            for region in ('us', 'eu'):
+                responses.add(responses.GET,
+                              'https://{}.test/v3/lists/list@{}.test'
+                              .format(region, region),
+                              status=200,
+                              body=json.dumps({'list': {
+                                  'address': 'list@{}.test'.format(region)}}))
+
+            clients = dict((region,
+                            ph.Client('key-' + region,
+                                      'https://{}.test/v3'.format(region)))
+                           for region in ('us', 'eu'))
+
+            def load(region):
+                return ph.MailingList.load('list@{}.test'.format(region),
+                                           client=clients[region])
+
+            with ThreadPoolExecutor(4) as executor:
+                lists = list(executor.map(load, ['us', 'eu'] * 10))
+
+            assert all(lst.client is clients[lst.address[5:7]]
+                       for lst in lists)
+            for call in responses.calls:
+                region = call.request.url[8:10]
+                assert call.request.headers['Authorization'] == \
+                    requests.auth._basic_auth_str('api', 'key-' + region)
+
+    class TestDecodeResponse:
+
+        @responses.activate
+        def test_errors(self):
+            client = ph.Client('key-test')
+            for path, status, body, exception in (
+                    ('/not_found', 404, '{}', ph.api.NotFound),
+                    ('/no_json', 200, 'not json', ph.api.ServerError),
+                    ('/teapot', 418, '{}', ph.api.ServerError)):
+                responses.add(responses.GET, ph.api.baseurl + path,
+                              status=status, body=body)
+
+                with pytest.raises(exception) as excinfo:
+                    client.get(path)
+                assert path in str(excinfo.value)
+
+        @responses.activate
+        def test_decodes_once(self, monkeypatch):
+            responses.add(responses.GET, ph.api.baseurl + '/testing/',
+                          status=200, body=json.dumps(dict(message="OK")))
+
+            calls = []
+            original = ph.codec.loads
+
+            def loads(data):
+                calls.append(data)
+                return original(data)
+
+            monkeypatch.setattr(ph.codec, 'loads', loads)
+
+            assert ph.Client('key-test').get('/testing/') == \
+                dict(message="OK")
+            assert len(calls) == 1
+
+    class TestStream:
+
+        url = ph.api.baseurl + '/lists/pages'
+
+        @responses.activate
+        def test_iter_items(self):
+            for page in range(2):
+                responses.add(responses.GET, self.url, status=200,
+                              body=json.dumps({
+                                  'items': [page * 2, page * 2 + 1],
+                                  'paging': {'next': self.url}}))
+            responses.add(responses.GET, self.url, status=200,
+                          body=json.dumps({'items': []}))
+
+            items = ph.Client('key-test').iter_items(self.url, {'limit': 2})
+            assert list(items) == [0, 1, 2, 3]
+            assert len(responses.calls) == 3
+            assert 'limit=2' in responses.calls[0].request.url
+            assert responses.calls[0].request.req_kwargs['stream']
+
+        @responses.activate
+        def test_errors(self):
+            client = ph.Client('key-test')
+            responses.add(responses.GET, self.url, status=404, body='{}')
+            with pytest.raises(ph.api.NotFound):
+                client.request('GET', self.url, items='items')
+
+            responses.replace(responses.GET, self.url, status=200,
+                              body='{"items": [1, 2')
+            items = client.request('GET', self.url, items='items')
+            with pytest.raises(ph.api.ServerError):
+                list(items)
+
+    class TestRateLimit:
+
+        def test_token_bucket(self):
+            bucket = ph.ratelimit.TokenBucket(rate=50, capacity=5)
+
+            start = time.monotonic()
+            for _ in range(10):
+                bucket.acquire()
+            elapsed = time.monotonic() - start
+
+            assert 0.08 <= elapsed < 0.5
+
+        @responses.activate
+        def test_client_rate_limit(self):
+            responses.add(responses.GET, ph.api.baseurl + '/testing/',
+                          status=200, body=json.dumps(dict(message="OK")))
+
+            acquired = []
+
+            class Limiter(object):
+                def acquire(self, tokens=1):
+                    acquired.append(tokens)
+
+            try:
+                ph.api.rate_limiter = Limiter()
+                ph.Client('key-test').get('/testing/')
+                assert acquired == [1]
+            finally:
+                ph.api.set_rate_limit(None)
+            assert ph.api.rate_limiter is None
+
+        def test_endpoint(self):
+            endpoint = ph.ratelimit.endpoint
+            base = ph.api.baseurl
+
+            assert endpoint(base + '/example.com/messages') == 'messages'
+            assert endpoint(base + '/example.com/messages.mime') == 'messages'
+            assert endpoint(base + '/lists/l@example.com/members') == 'lists'
+            assert endpoint(base + '/routes/123') == 'routes'
+            assert endpoint(base + '/domains') is None
+
+        @responses.activate
+        def test_endpoint_limits(self):
+            for path in ('/lists/pages', '/routes', '/domains'):
+                responses.add(responses.GET, ph.api.baseurl + path,
+                              status=200, body=json.dumps(dict(items=[])))
+
+            acquired = []
+
+            class Limiter(object):
+                def __init__(self, name):
+                    self.name = name
+
+                def acquire(self, tokens=1):
+                    acquired.append(self.name)
+
+            limiter = ph.ratelimit.EndpointRateLimiter(
+                default=Limiter('default'), lists=Limiter('lists'))
+            client = ph.Client('key-test', rate_limiter=limiter)
+
+            for path in ('/lists/pages', '/routes', '/domains'):
+                client.get(path)
+
+            assert acquired == ['lists', 'default', 'default']
+
+        def test_set_rate_limit(self):
+            try:
+                ph.api.set_rate_limit(20, messages=5)
+                limiter = ph.api.rate_limiter
+                assert limiter.for_url('/example.com/messages').rate == 5
+                assert limiter.for_url('/routes').rate == 20
+
+                ph.api.set_rate_limit(20, capacity=7, messages=5)
+                limiter = ph.api.rate_limiter
+                assert limiter.for_url('/example.com/messages').capacity == 7
+                assert limiter.for_url('/routes').capacity == 7
+
+                with pytest.raises(TypeError):
+                    ph.api.set_rate_limit(20, domains=5)
+            finally:
+                ph.api.set_rate_limit(None)
+
+        def test_file_token_bucket(self, tmpdir):
+            path = str(tmpdir.join('bucket'))
+            first = ph.ratelimit.FileTokenBucket(path, rate=1, capacity=2)
+            second = ph.ratelimit.FileTokenBucket(path, rate=1, capacity=2)
+
+            assert first.try_acquire() == 0
+            assert second.try_acquire() == 0
+            assert first.try_acquire() > 0
+            assert second.try_acquire() > 0
+
+        def test_file_token_bucket_processes(self, tmpdir):
+            multiprocessing = pytest.importorskip('multiprocessing')
+            path = str(tmpdir.join('bucket'))
+
+            with multiprocessing.get_context('fork').Pool(4) as pool:
+                waits = pool.starmap(_try_acquire, [(path,)] * 8)
+
+            assert waits.count(0) == 5
+
+    class TestRetry:
+
+        url = ph.api.baseurl + '/testing/'
+
+        @responses.activate
+        def test_retry_get(self):
+            responses.add(responses.GET, self.url, status=503, body='{}')
+            responses.add(responses.GET, self.url, status=200,
+                          body=json.dumps(dict(message="OK")))
+
+            policy = ph.retry.RetryPolicy(backoff=0)
+            client = ph.Client('key-test', retry_policy=policy)
+
+            assert client.get('/testing/') == dict(message="OK")
+            assert len(responses.calls) == 2
+            assert policy.stats == {'retries': 1, 'gave_up': 0, 503: 1}
+
+        @responses.activate
+        def test_give_up(self):
+            responses.add(responses.GET, self.url, status=500, body='{}')
+
+            policy = ph.retry.RetryPolicy(max_attempts=3, backoff=0)
+            client = ph.Client('key-test', retry_policy=policy)
+
+            with pytest.raises(ph.api.ServerError):
+                client.get('/testing/')
+            assert len(responses.calls) == 3
+            assert policy.stats['gave_up'] == 1
+
+        @responses.activate
+        def test_no_post_retry(self):
+            responses.add(responses.POST, self.url, status=500, body='{}')
+
+            client = ph.Client('key-test',
+                               retry_policy=ph.retry.RetryPolicy(backoff=0))
+
+            with pytest.raises(ph.api.ServerError):
+                client.post('/testing/', {'to': 'a@example.com'})
+            assert len(responses.calls) == 1
+
+        @responses.activate
+        def test_retry_after(self, monkeypatch):
+            responses.add(responses.POST, self.url, status=429, body='{}',
+                          headers={'Retry-After': '2'})
+            responses.add(responses.POST, self.url, status=200,
+                          body=json.dumps(dict(message="OK")))
+
+            slept = []
+            monkeypatch.setattr(ph.api.time, 'sleep', slept.append)
+
+            client = ph.Client('key-test',
+                               retry_policy=ph.retry.RetryPolicy())
+
+            assert client.post('/testing/', {}) == dict(message="OK")
+            assert slept == [2.0]
+
+        @responses.activate
+        def test_no_retry_by_default(self):
+            responses.add(responses.GET, self.url, status=503, body='{}')
+
+            with pytest.raises(ph.api.ServerError):
+                ph.Client('key-test').get('/testing/')
+            assert len(responses.calls) == 1
+
+        def test_not_sent(self):
+            policy = ph.retry.RetryPolicy(jitter=False, backoff=1)
+            error = requests.exceptions.ConnectTimeout()
+
+            assert policy.delay('POST', 1, error=error, sent=True) is None
+            assert policy.delay('POST', 2, error=error, sent=False) == 2
+            assert ph.api._not_sent(error)
+            assert not ph.api._not_sent(requests.exceptions.ReadTimeout())
+
+            urllib3 = requests.packages.urllib3
+            reason = urllib3.exceptions.NewConnectionError(None, 'refused')
+            error = requests.exceptions.ConnectionError(
+                urllib3.exceptions.MaxRetryError(None, '/', reason))
+            assert ph.api._not_sent(error)
+
+
+def _try_acquire(path):
+    return ph.ratelimit.FileTokenBucket(path, rate=0.1, capacity=5) \
+        .try_acquire()
@@ -0,0 +1,177 @@
+import json
+import responses
+import pyholster as ph
+import pytest
+import time
+
+from pyholster import cache
+
+
+list_url = ph.api.baseurl + '/lists/cached@token.eu'
+member_url = list_url + '/members/member@token.eu'
+
+
+@pytest.fixture
+def client():
+    cache.enable(ttl=60, maxsize=100)
+    yield ph.Client('key-test')
+    cache.disable()
+
+
+class TestLRUCache:
+
+    def test_lru(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        assert lru.get('a') == 1
+        lru.set('c', 3)
+
+        assert lru.get('b') is None
+        assert lru.get('a') == 1
+        assert lru.get('c') == 3
+        assert lru.evictions == 1
+        assert len(lru) == 2
+
+    def test_ttl(self):
+        lru = cache.LRUCache()
+        lru.set('a', 1, ttl=0.01)
+        lru.set('b', 2)
+        time.sleep(0.02)
+
+        assert lru.get('a') is None
+        assert lru.get('b') == 2
+
+
+class TestReadThrough:
+
+    @responses.activate
+    def test_load(self, client):
+        responses.add(responses.GET, list_url, status=200, body=json.dumps(
+            {'list': {'address': 'cached@token.eu', 'name': 'Cached'}}))
+
+        first = ph.MailingList.load('cached@token.eu', client)
+        second = ph.MailingList.load('cached@token.eu', client)
+
+        assert first.name == second.name == 'Cached'
+        assert len(responses.calls) == 1
+        assert cache.get_cache().stats['hits'] == 1
+        assert cache.get_cache().stats['misses'] == 1
+
+        # Other accounts do not share the cache.
+        ph.MailingList.load('cached@token.eu', ph.Client('key-other'))
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_invalidate_on_update(self, client):
+        responses.add(responses.GET, list_url, status=200, body=json.dumps(
+            {'list': {'address': 'cached@token.eu', 'name': 'Cached'}}))
+        responses.add(responses.PUT, list_url, status=200, body='{}')
+
+        lst = ph.MailingList.load('cached@token.eu', client)
+        lst.update(name='Changed')
+        ph.MailingList.load('cached@token.eu', client)
+
+        assert [call.request.method for call in responses.calls] == [
+            'GET', 'PUT', 'GET']
+        assert cache.get_cache().stats['invalidations'] == 1
+
+    @responses.activate
+    def test_not_found(self, client):
+        responses.add(responses.GET, member_url, status=404, body='{}')
+        responses.add(responses.POST, list_url + '/members', status=200,
+                      body='{}')
+
+        lst = ph.MailingList(address='cached@token.eu', client=client)
+
+        for _ in range(3):
+            member = ph.Member(address='member@token.eu', mailing_list=lst)
+            assert not member.is_implemented()
+        assert len(responses.calls) == 1
+
+        member.implement()
+        # Implementing removed the cached 404, so Mailgun is asked again.
+        ph.Member(address='member@token.eu', mailing_list=lst) \
+            .is_implemented()
+        assert [call.request.method for call in responses.calls] == [
+            'GET', 'POST', 'GET']
+
+    @responses.activate
+    def test_copies(self, client):
+        responses.add(responses.GET, member_url, status=200, body=json.dumps(
+            {'member': {'address': 'member@token.eu', 'subscribed': True,
+                        'vars': {'id': 1}}}))
+
+        lst = ph.MailingList(address='cached@token.eu', client=client)
+        member = ph.Member.load(lst, 'member@token.eu')
+        member.vars['id'] = 2
+
+        assert ph.Member.load(lst, 'member@token.eu').vars == {'id': 1}
+
+    @responses.activate
+    def test_invalidate_members_on_delete(self, client):
+        responses.add(responses.GET, member_url, status=200, body=json.dumps(
+            {'member': {'address': 'member@token.eu', 'subscribed': True}}))
+        responses.add(responses.DELETE, list_url, status=200, body='{}')
+
+        lst = ph.MailingList(address='cached@token.eu', client=client,
+                             implemented=True)
+        ph.Member.load(lst, 'member@token.eu')
+        ph.Member.load(lst, 'member@token.eu')
+        lst.delete()
+        ph.Member.load(lst, 'member@token.eu')
+
+        assert [call.request.method for call in responses.calls] == [
+            'GET', 'DELETE', 'GET']
+
+    @responses.activate
+    def test_invalidate_members_on_address_change(self, client):
+        moved_url = ph.api.baseurl + '/lists/moved@token.eu'
+        for url in (member_url, moved_url + '/members/member@token.eu'):
+            responses.add(responses.GET, url, status=404, body='{}')
+        responses.add(responses.PUT, list_url, status=200, body='{}')
+
+        lst = ph.MailingList(address='cached@token.eu', client=client,
+                             implemented=True)
+        moved = ph.MailingList(address='moved@token.eu', client=client)
+        for mailing_list in (lst, moved):
+            ph.Member(address='member@token.eu',
+                      mailing_list=mailing_list).is_implemented()
+
+        lst.update(address='moved@token.eu')
+        for mailing_list in (ph.MailingList(address='cached@token.eu',
+                                            client=client), moved):
+            ph.Member(address='member@token.eu',
+                      mailing_list=mailing_list).is_implemented()
+
+        assert [call.request.url for call in responses.calls
+                if call.request.method == 'GET'] == [
+            member_url, moved_url + '/members/member@token.eu'] * 2
+
+    @responses.activate
+    def test_route(self, client):
+        url = ph.api.baseurl + '/routes/1'
+        responses.add(responses.GET, url, status=200, body=json.dumps(
+            {'route': {'id': '1', 'expression': 'catch_all()',
+                       'actions': ['stop()']}}))
+        responses.add(responses.DELETE, url, status=200, body='{}')
+
+        route = ph.Route.load('1', client)
+        ph.Route.load('1', client)
+        route.delete()
+        ph.Route.load('1', client)
+
+        assert [call.request.method for call in responses.calls] == [
+            'GET', 'DELETE', 'GET']
+
+    @responses.activate
+    def test_disabled(self):
+        responses.add(responses.GET, list_url, status=200, body=json.dumps(
+            {'list': {'address': 'cached@token.eu'}}))
+
+        client = ph.Client('key-test')
+        ph.MailingList.load('cached@token.eu', client)
+        ph.MailingList.load('cached@token.eu', client)
+
+        assert cache.get_cache() is None
+        assert len(responses.calls) == 2
@@ -0,0 +1,104 @@
+import json
+import pytest
+
+import pyholster as ph
+from pyholster import codec
+
+
+@pytest.fixture(params=['json', 'orjson'])
+def each_codec(request):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+
+    previous = codec.get_codec()
+    yield codec.set_codec(request.param)
+    codec.set_codec(previous)
+
+
+class TestCodec:
+
+    def test_roundtrip(self, each_codec):
+        value = {'b': [1, 2.5, None, True], 'a': {'é': 'ü'}}
+
+        assert json.loads(codec.dumps(value)) == value
+        assert codec.loads(codec.dumps(value)) == value
+        assert codec.loads(codec.dumps(value).encode('utf-8')) == value
+        assert isinstance(codec.dumps(value), str)
+
+        assert codec.dumps({'b': 1, 'a': 2}, sort_keys=True) == \
+            codec.dumps({'a': 2, 'b': 1}, sort_keys=True)
+
+    def test_like_json(self, each_codec):
+        for value in ({1: 'int key'}, (1, 2), 2 ** 70):
+            assert json.loads(codec.dumps(value)) == \
+                json.loads(json.dumps(value))
+
+        with pytest.raises(ValueError):
+            codec.loads(b'not json')
+
+    def test_loads(self, each_codec):
+        for text in ('{"id": 123456789012345678901234,'
+                     ' "n": -9223372036854775809}',
+                     '[18446744073709551615, 1.5, "12345678901234567890"]',
+                     '{"a": NaN, "b": [Infinity]}',
+                     '{"\u00e9": "\u00fc", "b": [true, null]}'):
+            expected = json.loads(text)
+            for data in (text, text.encode('utf-8')):
+                assert repr(codec.loads(data)) == repr(expected)
+
+    def test_set_codec_keeps_members_clean(self, each_codec):
+        member = ph.Member(address='foo@tests.eu',
+                           vars={'k': 1, 'j': [1, 2]}, implemented=True)
+        assert member._clean[1] == '{"j":[1,2],"k":1}'
+
+        for name in ('json', codec.get_codec().name):
+            codec.set_codec(name)
+            assert not member.is_dirty
+
+    def test_set_codec_keeps_var_indexes(self, each_codec):
+        lst = ph.MailingList(address='list@tests.eu', implemented=True)
+        member = ph.Member(address='foo@tests.eu', vars={'tags': {'k': 1}},
+                           mailing_list=lst, implemented=True)
+        object.__setattr__(lst, '_members', [member])
+        lst.index_vars('tags')
+
+        for name in ('json', codec.get_codec().name):
+            codec.set_codec(name)
+            assert list(lst.get_members_by_vars(tags={'k': 1})) == [member]
+
+    def test_models(self, each_codec):
+        member = ph.Member(address='foo@tests.eu', vars={'b': 1, 'a': 2},
+                           implemented=True)
+        assert member._insert_data(upsert=True)['vars'] == \
+            codec.dumps({'b': 1, 'a': 2})
+        assert not member.is_dirty
+
+        mail = ph.Mail(sender='foo@bar.baz', to='bar@baz.foo',
+                       variables={'user': {'id': 1}})
+        assert mail.get_data()['v:user'] == codec.dumps({'id': 1})
+
+    def test_set_codec(self):
+        previous = codec.get_codec()
+
+        class Codec(object):
+            def dumps(self, value, sort_keys=False):
+                return 'dumped'
+
+            def loads(self, data):
+                return 'loaded'
+
+        try:
+            assert codec.set_codec('json').name == 'json'
+            assert isinstance(codec.get_codec(), codec.JSONCodec)
+
+            codec.set_codec(Codec())
+            assert codec.dumps({}) == 'dumped'
+            assert codec.loads('{}') == 'loaded'
+
+            with pytest.raises(ValueError):
+                codec.set_codec('unknown')
+
+            assert codec.set_codec().name == (
+                'orjson' if codec.orjson is not None else 'json')
+        finally:
+            codec.set_codec(previous)
@@ -1,6 +1,10 @@
+import io
+import json
+import pathlib
 import responses
 import pyholster as ph
 import pytest
+from urllib.parse import parse_qs
 
 
 class TestMail:
@@ -50,3 +54,168 @@ class TestMail:
 
     def test_check_attributes(self):
         pass
+
+    def test_get_data_options(self):
+        mail = ph.Mail(sender="foo@bar.baz", to="bar@baz.foo",
+                       options={'tracking': 'yes'},
+                       headers={'X-Test': 'test'},
+                       variables={'user': {'id': 1}})
+
+        data = mail.get_data()
+        assert data['o:tracking'] == 'yes'
+        assert data['h:X-Test'] == 'test'
+        assert data['v:user'] == ph.codec.dumps({'id': 1})
+
+
+class TestBatchSend:
+
+    url = ph.api.baseurl + '/example.com/messages'
+
+    def mail(self):
+        return ph.Mail(sender="foo@example.com",
+                       domain="example.com",
+                       subject="Hello %recipient.name%",
+                       text="Hi %recipient.name%!",
+                       client=ph.Client('key-test'))
+
+    @responses.activate
+    def test_send_batch(self):
+        responses.add(responses.POST, self.url, status=200, body=json.dumps(
+            {'message': "Queued. Thank you.", 'id': "<1@example.com>"}))
+
+        def recipients():
+            yield "a@example.com"
+            yield ("b@example.com", {'name': "B"})
+            yield ph.Member(address="c@example.com", vars={'name': "C"})
+
+        results = self.mail().send_batch(recipients(), batch_size=2)
+
+        assert [result.ok for result in results] == [True, True]
+        assert [result.id for result in results] == ["<1@example.com>"] * 2
+        assert [result.count for result in results] == [2, 1]
+        assert results[0].recipients is None
+
+        body = parse_qs(responses.calls[0].request.body)
+        assert body['to'] == ["a@example.com", "b@example.com"]
+        assert json.loads(body['recipient-variables'][0]) == \
+            {"a@example.com": {}, "b@example.com": {'name': "B"}}
+        assert body['subject'] == ["Hello %recipient.name%"]
+
+    @responses.activate
+    def test_send_batch_failure(self):
+        responses.add(responses.POST, self.url, status=400, body='{}')
+
+        results = self.mail().send_batch(
+            ("{}@example.com".format(i) for i in range(5)), batch_size=2,
+            workers=2)
+
+        assert len(results) == 3
+        assert not any(result.ok for result in results)
+        assert isinstance(results[0].error, ph.api.BadRequest)
+        assert [len(result.recipients) for result in results] == [2, 2, 1]
+
+    @responses.activate
+    def test_send_batch_other_errors(self, tmpdir):
+        responses.add(responses.POST, self.url, status=200, body=json.dumps(
+            {'message': "Queued. Thank you.", 'id': "<1@example.com>"}))
+        path = tmpdir.join('invoice.pdf')
+        path.write_binary(b"PDF")
+
+        def recipients():
+            yield "a@example.com"
+            path.remove()
+            yield "b@example.com"
+            yield "c@example.com"
+
+        mail = self.mail()
+        mail.attachments = [pathlib.Path(str(path))]
+        results = mail.send_batch(recipients(), batch_size=1)
+
+        assert [result.ok for result in results] == [True, False, False]
+        assert all(isinstance(result.error, OSError)
+                   for result in results[1:])
+        assert [result.recipients for result in results[1:]] == [
+            [("b@example.com", {})], [("c@example.com", {})]]
+
+    def test_send_batch_file_objects(self):
+        mail = self.mail()
+        mail.attachments = [('invoice.pdf', io.BytesIO(b"PDF"))]
+
+        with pytest.raises(ValueError):
+            mail.send_batch(["a@example.com"], workers=2)
+
+    def test_send_batch_size(self):
+        with pytest.raises(ValueError):
+            self.mail().send_batch(["a@example.com"], batch_size=1001)
+
+
+class TestPreparedMail:
+
+    url = ph.api.baseurl + '/example.com/messages'
+
+    template = dict(sender="foo@example.com",
+                    domain="example.com",
+                    html="<p>Hello %recipient.name%</p>",
+                    options={'tracking': 'yes'},
+                    headers={'X-Mailer': 'pyholster'})
+
+    def queued(self):
+        responses.add(responses.POST, self.url, status=200, body=json.dumps(
+            {'message': "Queued. Thank you.", 'id': "<1@example.com>"}))
+
+    @responses.activate
+    def test_send(self):
+        self.queued()
+        client = ph.Client('key-test')
+
+        mail = ph.Mail(to="a@example.com", subject="Hi",
+                       variables={'order': 1}, client=client,
+                       **self.template)
+        mail.send()
+
+        prepared = ph.PreparedMail(client=client, **self.template)
+        assert prepared.send(to="a@example.com", subject="Hi",
+                             variables={'order': 1}) == "<1@example.com>"
+
+        plain, prepared = [parse_qs(call.request.body)
+                           for call in responses.calls]
+        assert prepared == plain
+        assert responses.calls[1].request.headers['Content-Type'] == \
+            'application/x-www-form-urlencoded'
+
+    def test_checks(self):
+        prepared = ph.PreparedMail(**self.template)
+
+        with pytest.raises(ValueError):
+            prepared.send(subject="Hi")
+        with pytest.raises(Warning):
+            prepared.send(to="a@example.com")
+        with pytest.raises(ValueError):
+            prepared.send(to="a@example.com", subject="Hi",
+                          headers={'X-Mailer': 'other'})
+        with pytest.raises(AttributeError):
+            prepared.send(to="a@example.com", html="<p>Other</p>")
+        with pytest.raises(ValueError):
+            ph.PreparedMail(sender="foo@example.com", domain="example.com")
+
+    def test_file_objects(self):
+        for attachment in (io.BytesIO(b"PDF"),
+                           ('invoice.pdf', io.BytesIO(b"PDF"))):
+            with pytest.raises(ValueError):
+                ph.PreparedMail(attachments=[attachment],
+                                subject="Invoice", **self.template)
+
+    @responses.activate
+    def test_send_attachments(self):
+        self.queued()
+
+        prepared = ph.PreparedMail(attachments=[b"PDF"],
+                                   client=ph.Client('key-test'),
+                                   subject="Invoice", **self.template)
+        prepared.send(to="a@example.com")
+        prepared.send(to="b@example.com")
+
+        bodies = [call.request.body for call in responses.calls]
+        assert all(b'PDF' in body for body in bodies)
+        assert b'a@example.com' in bodies[0]
+        assert b'b@example.com' in bodies[1]
@@ -1,9 +1,10 @@
 import responses
 import json
 import types
-# import pytest
+import pytest
 import os
 import copy
+from urllib.parse import parse_qs
 
 import pyholster
 
@@ -15,7 +16,7 @@ class TestMailingListDry:
 
     @responses.activate
     def test_load_all(self):
-        responses.add(responses.GET, pyholster.api.baseurl + '/lists',
+        responses.add(responses.GET, pyholster.api.baseurl + '/lists/pages',
                       body=json.dumps(load_fixture('lists.yml')), status=200,
                       content_type='application/json')
 
@@ -24,6 +25,53 @@ class TestMailingListDry:
         assert len(all_lists) is 2
         assert all(isinstance(l, pyholster.MailingList) for l in all_lists)
 
+    @responses.activate
+    def test_load_all_pages(self):
+        url = pyholster.api.baseurl + '/lists/pages'
+        client = pyholster.Client('key-test')
+
+        def mock_pages():
+            responses.reset()
+            for page in range(3):
+                body = {'items': [{'address': 'list{}{}@token.eu'.format(
+                    page, i)} for i in range(2)],
+                        'paging': {'next': url + '?page={}'.format(page + 1)}}
+                responses.add(responses.GET, url, status=200,
+                              body=json.dumps(body))
+            responses.add(responses.GET, url, status=200,
+                          body=json.dumps({'items': []}))
+
+        mock_pages()
+        lists = pyholster.MailingList.load_all(client, page_size=2)
+        assert len(responses.calls) == 0
+        assert next(lists).address == 'list00@token.eu'
+        assert len(responses.calls) == 1
+        assert 'limit=2' in responses.calls[0].request.url
+
+        assert len(list(lists)) == 5
+        assert len(responses.calls) == 4
+
+        mock_pages()
+        lists = list(pyholster.MailingList.load_all(client, page_size=2,
+                                                    limit=3, prefetch=True))
+        assert [lst.address for lst in lists] == [
+            'list00@token.eu', 'list01@token.eu', 'list10@token.eu']
+
+        mock_pages()
+        lists = list(pyholster.MailingList.load_all(client, limit=1))
+        assert len(lists) == 1
+        assert len(responses.calls) == 1
+        assert 'limit=1' in responses.calls[0].request.url
+
+    @responses.activate
+    def test_load_all_error(self):
+        responses.add(responses.GET, pyholster.api.baseurl + '/lists/pages',
+                      status=500, body='{}')
+
+        with pytest.raises(LookupError):
+            list(pyholster.MailingList.load_all(
+                pyholster.Client('key-test', retry_policy=False)))
+
     @responses.activate
     def test_load_one(self):
         lists = load_fixture('lists.yml')['items']
@@ -121,17 +169,18 @@ class TestMailingListDry:
 
         fixt_messages = load_fixture('members.yml')
 
-        responses.add(responses.GET,
-                      pyholster.api.baseurl +
-                      '/lists/{}/members'.format(fixt['address']),
-                      status=200,
-                      body=json.dumps(fixt_messages))
+        for body in (fixt_messages, {'items': []}):
+            responses.add(responses.GET,
+                          pyholster.api.baseurl +
+                          '/lists/{}/members/pages'.format(fixt['address']),
+                          status=200,
+                          body=json.dumps(body))
 
         lst = pyholster.MailingList.load(fixt['address'])
 
         assert object.__getattribute__(lst, 'members') is None
         assert isinstance(lst.members, list)
-        print lst.members
+        print(lst.members)
 
         assert all(isinstance(m, pyholster.Member) for m in lst.members)
         assert len(lst.members) is 2
@@ -148,11 +197,12 @@ class TestMailingListDry:
 
         fixt_messages = load_fixture('members.yml')
 
-        responses.add(responses.GET,
-                      pyholster.api.baseurl +
-                      '/lists/{}/members'.format(fixt['address']),
-                      status=200,
-                      body=json.dumps(fixt_messages))
+        for body in (fixt_messages, {'items': []}):
+            responses.add(responses.GET,
+                          pyholster.api.baseurl +
+                          '/lists/{}/members/pages'.format(fixt['address']),
+                          status=200,
+                          body=json.dumps(body))
 
         lst = pyholster.MailingList.load(fixt['address'])
 
@@ -176,11 +226,12 @@ class TestMailingListDry:
                       status=200,
                       body=json.dumps({'list': fixt}))
 
-        responses.add(responses.GET,
-                      pyholster.api.baseurl +
-                      '/lists/{}/members'.format(fixt['address']),
-                      status=200,
-                      body=json.dumps(fixt_messages))
+        for body in (fixt_messages, {'items': []}):
+            responses.add(responses.GET,
+                          pyholster.api.baseurl +
+                          '/lists/{}/members/pages'.format(fixt['address']),
+                          status=200,
+                          body=json.dumps(body))
 
         lst = pyholster.MailingList.load(fixt['address'])
 
@@ -230,6 +281,376 @@ class TestMailingListDry:
         assert lst.name == fixt['name']
         assert lst.description == fixt['description']
 
+    @responses.activate
+    def test_iter_members(self):
+        fixt = {'address': 'pages@token.eu'}
+        pages = load_fixture('members_pages.json')
+        url = pyholster.api.baseurl + '/lists/pages@token.eu/members/pages'
+
+        for page in pages:
+            responses.add(responses.GET, url, status=200,
+                          body=json.dumps(page))
+
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    **fixt)
+        members = lst.iter_members(page_size=2)
+
+        assert isinstance(members, types.GeneratorType)
+        assert next(members).address == 'one@token.eu'
+        assert len(responses.calls) == 1
+        assert 'limit=2' in responses.calls[0].request.url
+
+        assert [m.address for m in members] == [
+            'two@token.eu', 'three@token.eu']
+        assert len(responses.calls) == 3
+        assert 'page=next' in responses.calls[1].request.url
+
+    @responses.activate
+    def test_iter_members_prefetch(self):
+        fixt = {'address': 'pages@token.eu'}
+        pages = load_fixture('members_pages.json')
+        url = pyholster.api.baseurl + '/lists/pages@token.eu/members/pages'
+
+        for page in pages:
+            responses.add(responses.GET, url, status=200,
+                          body=json.dumps(page))
+
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    **fixt)
+
+        assert [m.address for m in lst.iter_members(prefetch=True)] == [
+            'one@token.eu', 'two@token.eu', 'three@token.eu']
+
+    @responses.activate
+    def test_iter_members_stream(self):
+        fixt = {'address': 'pages@token.eu'}
+        pages = load_fixture('members_pages.json')
+        url = pyholster.api.baseurl + '/lists/pages@token.eu/members/pages'
+
+        for page in pages:
+            responses.add(responses.GET, url, status=200,
+                          body=json.dumps(page))
+
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    **fixt)
+        members = list(lst.iter_members(page_size=2, stream=True))
+
+        assert [m.address for m in members] == [
+            'one@token.eu', 'two@token.eu', 'three@token.eu']
+        assert all(m.mailing_list is lst and not m.is_dirty
+                   for m in members)
+        assert len(responses.calls) == 3
+        assert responses.calls[0].request.req_kwargs['stream']
+
+    @responses.activate
+    def test_bulk_add_members(self):
+        url = pyholster.api.baseurl + '/lists/bulk@token.eu/members.json'
+        bodies = []
+
+        def callback(request):
+            body = parse_qs(request.body)
+            bodies.append(body)
+            if len(bodies) == 2:
+                return (400, {}, json.dumps({'message': 'Bad request'}))
+            return (200, {}, json.dumps({'message': 'Mailing list has '
+                                                    'been updated'}))
+
+        responses.add_callback(responses.POST, url, callback=callback)
+
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    address='bulk@token.eu')
+        object.__setattr__(lst, '_members', [])
+
+        members = ({'address': 'member{}@token.eu'.format(i),
+                    'vars': {'id': i}} for i in range(2500))
+        results = lst.bulk_add_members(members)
+
+        assert len(results) == 3
+        assert [len(r.members) for r in results] == [1000, 1000, 500]
+        assert [r.ok for r in results] == [True, False, True]
+        assert isinstance(results[1].error,
+                          pyholster.api.BadRequest)
+
+        assert all(b['upsert'] == ['yes'] for b in bodies)
+        first = json.loads(bodies[0]['members'][0])
+        assert first[0] == {'address': 'member0@token.eu', 'name': None,
+                            'vars': {'id': 0}, 'subscribed': True}
+
+        assert len(lst.members) == 1500
+        assert all(m.mailing_list is lst for m in lst.members)
+
+    @responses.activate
+    def test_bulk_add_members_concurrent(self):
+        url = pyholster.api.baseurl + '/lists/bulk@token.eu/members.json'
+        responses.add(responses.POST, url, status=200,
+                      body=json.dumps({'message': 'OK'}))
+
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    address='bulk@token.eu')
+        members = [pyholster.Member(address='member{}@token.eu'.format(i))
+                   for i in range(95)]
+        results = lst.bulk_add_members(members, upsert=False, chunk_size=10,
+                                       workers=4)
+
+        assert len(results) == 10
+        assert [r.members for r in results] == [
+            members[i:i + 10] for i in range(0, 95, 10)]
+        assert all(r.ok for r in results)
+        assert all(parse_qs(call.request.body)['upsert'] == ['no']
+                   for call in responses.calls)
+
+    @responses.activate
+    def test_bulk_add_members_chunk_size(self):
+        lst = pyholster.MailingList(client=pyholster.Client('key-test'),
+                                    address='bulk@token.eu')
+
+        for chunk_size in (0, 1001):
+            with pytest.raises(ValueError):
+                lst.bulk_add_members([{'address': 'a@token.eu'}],
+                                     chunk_size=chunk_size)
+        assert len(responses.calls) == 0
+
+    @responses.activate
+    def test_update_without_probe(self):
+        url = pyholster.api.baseurl + '/lists/known@token.eu'
+        responses.add(responses.PUT, url, status=200, body="{}")
+
+        lst = pyholster.MailingList(address='known@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        assert lst.update(name='Known')
+        assert lst.is_implemented()
+        assert [c.request.method for c in responses.calls] == ['PUT']
+
+    @responses.activate
+    def test_update_not_implemented(self):
+        url = pyholster.api.baseurl + '/lists/new@token.eu'
+        responses.add(responses.PUT, url, status=404, body="{}")
+        responses.add(responses.PUT, url, status=200, body="{}")
+        responses.add(responses.POST, pyholster.api.baseurl + '/lists',
+                      status=200, body="{}")
+
+        lst = pyholster.MailingList(address='new@token.eu',
+                                    client=pyholster.Client('key-test'))
+        object.__setattr__(lst, '_members', [])
+        assert lst.update(name='New')
+        assert [c.request.method for c in responses.calls] == [
+            'PUT', 'POST', 'PUT']
+        assert lst.is_implemented()
+
+    @responses.activate
+    def test_flush(self):
+        responses.add(responses.PUT,
+                      pyholster.api.baseurl + '/lists/flush@token.eu',
+                      status=200, body="{}")
+        responses.add(responses.POST,
+                      pyholster.api.baseurl +
+                      '/lists/flush@token.eu/members.json',
+                      status=200, body="{}")
+
+        lst = pyholster.MailingList(address='flush@token.eu', name='Flush',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        members = [pyholster.Member(address='member{}@token.eu'.format(i),
+                                    vars={'id': i}, mailing_list=lst,
+                                    implemented=True)
+                   for i in range(10)]
+        object.__setattr__(lst, '_members', members)
+
+        assert lst.flush() == []
+        assert len(responses.calls) == 0
+
+        lst.name = 'Flushed'
+        members[3].vars['id'] = 'changed'
+        members[7].name = 'Seven'
+        lst._members.append(pyholster.Member(address='new@token.eu'))
+
+        results = lst.flush()
+
+        assert [c.request.method for c in responses.calls] == ['PUT', 'POST']
+        assert parse_qs(responses.calls[0].request.body) == {
+            'name': ['Flushed']}
+        assert [m.address for m in results[0].members] == [
+            'member3@token.eu', 'member7@token.eu', 'new@token.eu']
+        assert not lst.is_dirty
+        assert not any(m.is_dirty for m in lst.members)
+
+        assert lst.flush() == []
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_indexes(self):
+        lst = pyholster.MailingList(address='index@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        members = [pyholster.Member(address='member{}@token.eu'.format(i),
+                                    vars={'group': i % 3, 'tags': [i % 2]},
+                                    mailing_list=lst, implemented=True)
+                   for i in range(30)]
+        object.__setattr__(lst, '_members', members)
+        lst.index_vars('group', 'tags')
+
+        assert lst.get_member_by_address('member7@token.eu') is members[7]
+        assert lst.get_member_by_address('unknown@token.eu') == []
+        assert [m.address for m in lst.get_members_by_vars(group=1)] == [
+            'member{}@token.eu'.format(i) for i in range(1, 30, 3)]
+        assert len(list(lst.get_members_by_vars(group=1, tags=[0]))) == 5
+
+        member_url = pyholster.api.baseurl + \
+            '/lists/index@token.eu/members/{}'
+        responses.add(responses.PUT, member_url.format('member7@token.eu'),
+                      status=200, body="{}")
+        responses.add(responses.DELETE, member_url.format('member8@token.eu'),
+                      status=200, body="{}")
+
+        members[7].update(address='seven@token.eu', vars={'group': 'seven'})
+        assert lst.get_member_by_address('member7@token.eu') == []
+        assert lst.get_member_by_address('seven@token.eu') is members[7]
+        assert lst.get_member_by_var('group', 'seven') is members[7]
+        assert members[7] not in list(lst.get_members_by_vars(group=1))
+
+        member = members[8]
+        member.delete()
+        assert lst.get_member_by_address('member8@token.eu') == []
+        assert member not in list(lst.get_members_by_vars(group=2))
+
+        lst._members.append(pyholster.Member(address='direct@token.eu',
+                                             vars={'group': 1}))
+        assert lst.get_member_by_address('direct@token.eu').address == \
+            'direct@token.eu'
+        assert len(list(lst.get_members_by_vars(group=1))) == 10
+
+    @responses.activate
+    def test_concurrent_bulk_operations(self):
+        lst = pyholster.MailingList(address='many@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        object.__setattr__(lst, '_members', [])
+        url = pyholster.api.baseurl + '/lists/many@token.eu/members'
+
+        def post_callback(request):
+            if 'fail' in request.body:
+                return (400, {}, "{}")
+            return (200, {}, "{}")
+
+        responses.add_callback(responses.POST, url, callback=post_callback)
+
+        members = [{'address': 'member{}@token.eu'.format(i)}
+                   for i in range(20)]
+        members.append({'address': 'fail@token.eu'})
+
+        results = lst.add_members(members, workers=4)
+
+        assert isinstance(results, pyholster.concurrency.Results)
+        assert not results
+        assert len(results) == 21
+        assert [r.item.address for r in results.failed] == ['fail@token.eu']
+        assert len(lst.members) == 20
+
+        for i in range(20):
+            responses.add(responses.DELETE,
+                          url + '/member{}@token.eu'.format(i),
+                          status=404 if i == 3 else 200, body="{}")
+
+        results = lst.delete_all_members(workers=4)
+
+        assert len(results) == 20
+        assert [r.item.address for r in results.failed] == [
+            'member3@token.eu']
+        assert [m.address for m in lst.members] == ['member3@token.eu']
+        assert lst.get_member_by_address('member3@token.eu') is \
+            results.failed[0].item
+
+
+    @responses.activate
+    def test_reconcile(self):
+        url = pyholster.api.baseurl + '/lists/sync@token.eu/members'
+        remote = [{'address': 'member{}@token.eu'.format(i), 'name': '',
+                   'vars': {'id': i}, 'subscribed': True}
+                  for i in range(100)]
+        responses.add(responses.GET, url + '/pages', status=200,
+                      body=json.dumps({'items': remote, 'paging': {
+                          'next': url + '/pages?page=next'}}))
+        responses.add(responses.GET, url + '/pages', status=200,
+                      body=json.dumps({'items': []}))
+        responses.add(responses.POST, url + '.json', status=200,
+                      body=json.dumps({'message': 'updated'}))
+        responses.add(responses.DELETE, url + '/member99@token.eu',
+                      status=200, body=json.dumps({'message': 'deleted'}))
+
+        def desired():
+            for i in range(99):
+                vars_ = {'id': 'changed'} if i == 5 else {'id': i}
+                yield {'address': 'member{}@token.eu'.format(i),
+                       'vars': vars_, 'subscribed': i != 7}
+            yield {'address': 'new@token.eu', 'vars': {}}
+
+        lst = pyholster.MailingList(address='sync@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+
+        plan = lst.reconcile(desired(), dry_run=True)
+
+        assert [m.address for m in plan.add] == ['new@token.eu']
+        assert [m.address for m in plan.update] == [
+            'member5@token.eu', 'member7@token.eu']
+        assert plan.remove == ['member99@token.eu']
+        assert len(plan) == 4
+        assert '- member99@token.eu' in str(plan)
+        assert plan.results is None
+        assert [c.request.method for c in responses.calls] == ['GET', 'GET']
+
+        upserted, removed = plan.apply()
+
+        assert [c.request.method for c in responses.calls[2:]] == [
+            'POST', 'DELETE']
+        sent = json.loads(parse_qs(responses.calls[2].request.body)
+                          ['members'][0])
+        assert [m['address'] for m in sent] == [
+            'new@token.eu', 'member5@token.eu', 'member7@token.eu']
+        assert all(result.ok for result in upserted)
+        assert removed.ok
+
+    def test_plan_loaded_members(self):
+        lst = pyholster.MailingList(address='loaded@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        object.__setattr__(lst, '_members', [
+            pyholster.Member(address='a@token.eu', vars={'id': 1},
+                             mailing_list=lst, implemented=True)])
+
+        plan = lst.plan([pyholster.Member(address='a@token.eu',
+                                          vars={'id': 1})], remove=False)
+        assert len(plan) == 0
+
+        plan = lst.plan([{'address': 'b@token.eu'}])
+        assert [m.address for m in plan.add] == ['b@token.eu']
+        assert plan.remove == ['a@token.eu']
+
+    @responses.activate
+    def test_plan_unflushed_members(self):
+        url = pyholster.api.baseurl + '/lists/loaded@token.eu/members/pages'
+        responses.add(responses.GET, url, status=200, body=json.dumps(
+            {'items': [{'address': 'a@token.eu', 'name': None,
+                        'vars': {'id': 1}, 'subscribed': True}]}))
+
+        lst = pyholster.MailingList(address='loaded@token.eu',
+                                    client=pyholster.Client('key-test'),
+                                    implemented=True)
+        member = pyholster.Member(address='a@token.eu', vars={'id': 1},
+                                  mailing_list=lst, implemented=True)
+        failed = pyholster.Member(address='b@token.eu', mailing_list=lst)
+        object.__setattr__(lst, '_members', [member, failed])
+        member.vars['id'] = 2
+
+        plan = lst.plan([{'address': 'a@token.eu', 'vars': {'id': 2}},
+                         {'address': 'b@token.eu'}], remove=False)
+
+        assert [m.address for m in plan.update] == ['a@token.eu']
+        assert [m.address for m in plan.add] == ['b@token.eu']
+        assert len(responses.calls) == 1
+
+
 class TestMailingListWet:
     def set_apikey(self):
         keypath = os.path.abspath(os.path.dirname(
@@ -3,6 +3,7 @@ import json
 import yaml
 import os
 import pytest
+from urllib.parse import parse_qs
 
 import pyholster as ph
 
@@ -73,7 +74,7 @@ class TestMember:
                       status=200)
 
         def put_callback(request):
-            print request.body
+            print(request.body)
             body = json.loads(request.body)
             assert body['address'] == 'newaddress@tests.eu'
             return (200, {}, "{}")
@@ -131,8 +132,121 @@ class TestMember:
         with pytest.raises(ph.errors.MailgunRequestException):
             member.delete()
 
+    @responses.activate
     def test_implement(self):
-        pass
+        mailing_list = ph.MailingList(address='list@tests.eu',
+                                      client=ph.Client('key-test'))
+        url = ph.api.baseurl + '/lists/list@tests.eu/members'
+
+        responses.add(responses.POST, url, status=200, body="{}")
+
+        member = ph.Member(address='new@tests.eu', mailing_list=mailing_list)
+        assert member.implement()
+        assert len(responses.calls) == 1
+        assert 'upsert=no' in responses.calls[0].request.body
+        assert member.is_implemented()
+        assert len(responses.calls) == 1
+
+        responses.reset()
+        responses.add(responses.POST, url, status=400, body="{}")
+        responses.add(responses.PUT, url + '/old@tests.eu', status=200,
+                      body="{}")
+
+        member = ph.Member(address='old@tests.eu', mailing_list=mailing_list)
+        assert member.implement()
+        assert [c.request.method for c in responses.calls] == ['POST', 'PUT']
+
+    @responses.activate
+    def test_upsert(self):
+        mailing_list = ph.MailingList(address='list@tests.eu',
+                                      client=ph.Client('key-test'))
+        responses.add(responses.POST,
+                      ph.api.baseurl + '/lists/list@tests.eu/members',
+                      status=200, body="{}")
+
+        member = ph.Member(address='new@tests.eu', vars={'age': 3},
+                           mailing_list=mailing_list)
+        assert member.upsert()
+        assert len(responses.calls) == 1
+        assert 'upsert=yes' in responses.calls[0].request.body
+
+    @responses.activate
+    def test_update_not_implemented(self):
+        mailing_list = ph.MailingList(address='list@tests.eu',
+                                      client=ph.Client('key-test'))
+        responses.add(responses.PUT,
+                      ph.api.baseurl + '/lists/list@tests.eu/members/'
+                      'gone@tests.eu', status=404, body="{}")
+
+        member = ph.Member(address='gone@tests.eu', mailing_list=mailing_list)
+        with pytest.raises(ph.Member.MemberNotImplemented):
+            member.update(name='Gone')
+        assert len(responses.calls) == 1
+
+        assert not member.is_implemented()
+        with pytest.raises(ph.Member.MemberNotImplemented):
+            member.update(name='Gone')
+        assert len(responses.calls) == 1
 
+    @responses.activate
     def test_is_implemented(self):
-        pass
+        mailing_list = ph.MailingList(address='list@tests.eu',
+                                      client=ph.Client('key-test'))
+        responses.add(responses.GET,
+                      ph.api.baseurl + '/lists/list@tests.eu/members/'
+                      'foo@tests.eu',
+                      status=200,
+                      body=json.dumps(dict(member={'address': 'foo@tests.eu',
+                                                   'subscribed': True})))
+
+        member = ph.Member(address='foo@tests.eu', mailing_list=mailing_list)
+        assert member.is_implemented()
+        assert member.is_implemented()
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_dirty_tracking(self):
+        mailing_list = ph.MailingList(address='list@tests.eu',
+                                      client=ph.Client('key-test'))
+        bodies = []
+
+        def put_callback(request):
+            bodies.append(parse_qs(request.body))
+            return (200, {}, "{}")
+
+        responses.add_callback(responses.PUT,
+                               ph.api.baseurl + '/lists/list@tests.eu/'
+                               'members/foo@tests.eu',
+                               callback=put_callback)
+
+        member = ph.Member(address='foo@tests.eu', name='Foo',
+                           vars={'tags': ['a']}, mailing_list=mailing_list,
+                           implemented=True)
+
+        assert not member.is_dirty
+        assert member.update()
+        assert member.update(name='Foo')
+        assert member.upsert()
+        assert len(responses.calls) == 0
+
+        member.vars['tags'].append('b')
+        assert member.dirty_fields() == set(['vars'])
+
+        assert member.update(subscribed=False)
+        assert bodies == [{'vars': [ph.codec.dumps({'tags': ['a', 'b']})],
+                           'subscribed': ['False']}]
+        assert not member.is_dirty
+
+    def test_compact(self):
+        member = ph.Member(address='foo@tests.eu', name='Foo',
+                           vars={'b': 1, 'a': [1, 2]}, implemented=True)
+
+        assert not hasattr(member, '__dict__')
+        assert not member.is_dirty
+
+        # The order of the keys of the vars is not a change.
+        object.__setattr__(member, 'vars', {'a': [1, 2], 'b': 1})
+        assert not member.is_dirty
+
+        member.vars['a'].append(3)
+        assert member.dirty_fields() == set(['vars'])
@@ -0,0 +1,161 @@
+import json
+import responses
+import pyholster as ph
+import pytest
+from urllib.parse import parse_qs
+
+from pyholster.mirror import Mirror
+
+
+base = ph.api.baseurl
+lists_url = base + '/lists/pages'
+members_url = base + '/lists/news@example.com/members/pages'
+
+
+def page(items, next_url=None):
+    return dict(status=200, body=json.dumps(
+        {'items': items, 'paging': {'next': next_url}}))
+
+
+def news(count):
+    return {'address': 'news@example.com', 'name': 'News',
+            'description': 'Newsletter', 'access_level': 'readonly',
+            'members_count': count}
+
+
+members = [{'address': 'one@example.com', 'name': 'One',
+            'subscribed': True, 'vars': {'id': 1}},
+           {'address': 'two@example.com', 'name': 'Two',
+            'subscribed': False, 'vars': {'id': 2}}]
+
+
+@pytest.fixture
+def mirror(tmpdir):
+    return Mirror(str(tmpdir.join('mirror.db')), client=ph.Client('key-test'))
+
+
+def mock_sync(mock, count, items):
+    mock.add(responses.GET, lists_url, **page([news(count)], lists_url))
+    mock.add(responses.GET, lists_url, **page([]))
+    mock.add(responses.GET, members_url, **page(items, members_url))
+    mock.add(responses.GET, members_url, **page([]))
+
+
+class TestMirror:
+
+    def test_sync(self, mirror):
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            report = mirror.sync()
+
+        assert report['lists'] == 1
+        assert report['members_changed'] == 2
+
+        with responses.RequestsMock():
+            lst, = mirror.lists()
+            assert lst.name == 'News'
+            assert lst.mirror is mirror
+            assert [m.address for m in lst.members] == \
+                ['one@example.com', 'two@example.com']
+            assert lst.get_member_by_address('two@example.com').vars == \
+                {'id': 2}
+            assert lst.members[1].subscribed is False
+            assert not lst.members[0].is_dirty
+            assert mirror.get_list('other@example.com') is None
+
+    def test_incremental(self, mirror):
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            mirror.sync()
+
+        with responses.RequestsMock(
+                assert_all_requests_are_fired=False) as mock:
+            mock_sync(mock, 2, members)
+            report = mirror.sync()
+            assert report['lists_skipped'] == 1
+            assert not any('/members/' in call.request.url
+                           for call in mock.calls)
+
+        changed = [dict(members[0], vars={'id': 10})]
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 1, changed)
+            report = mirror.sync()
+
+        assert report['members_changed'] == 1
+        assert report['members_removed'] == 1
+        assert [(m.address, m.vars) for m in
+                mirror.iter_members('news@example.com')] == \
+            [('one@example.com', {'id': 10})]
+
+    def test_full(self, mirror):
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            mirror.sync()
+
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            report = mirror.sync(full=True)
+
+        assert report['lists_skipped'] == 0
+        assert report['members_changed'] == 0
+
+    def test_push(self, mirror):
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            mirror.sync()
+
+        mirror.set_member('news@example.com', ph.Member(
+            address='three@example.com', name='Three', vars={'id': 3}))
+        mirror.remove_member('news@example.com', 'two@example.com')
+
+        local = list(mirror.iter_members('news@example.com'))
+        assert [m.address for m in local] == \
+            ['one@example.com', 'three@example.com']
+        assert local[1].is_dirty
+
+        with responses.RequestsMock() as mock:
+            mock.add(responses.POST,
+                     base + '/lists/news@example.com/members.json',
+                     body=json.dumps({'message': 'ok'}))
+            mock.add(responses.DELETE,
+                     base + '/lists/news@example.com/members/two@example.com',
+                     body=json.dumps({'message': 'deleted'}))
+            report = mirror.push()
+
+            sent = json.loads(parse_qs(mock.calls[0].request.body)
+                              ['members'][0])
+            assert [m['address'] for m in sent] == ['three@example.com']
+
+        assert report == {'pushed': 2, 'push_failed': 0}
+        assert not any(m.is_dirty for m in
+                       mirror.iter_members('news@example.com'))
+
+        # The pushed changes do not make the next sync reload the members.
+        with responses.RequestsMock(
+                assert_all_requests_are_fired=False) as mock:
+            mock_sync(mock, 2, [])
+            assert mirror.pull()['lists_skipped'] == 1
+
+    def test_push_failure(self, mirror):
+        mirror.set_member('news@example.com',
+                          ph.Member(address='three@example.com'))
+
+        with responses.RequestsMock() as mock:
+            mock.add(responses.POST,
+                     base + '/lists/news@example.com/members.json',
+                     status=500, body='{}')
+            assert mirror.push() == {'pushed': 0, 'push_failed': 1}
+
+        assert next(mirror.iter_members('news@example.com')).is_dirty
+
+    def test_removed_list(self, mirror):
+        with responses.RequestsMock() as mock:
+            mock_sync(mock, 2, members)
+            mirror.sync()
+
+        with responses.RequestsMock() as mock:
+            mock.add(responses.GET, lists_url, **page([]))
+            mirror.sync()
+
+        assert mirror.lists() == []
+        assert list(mirror.iter_members('news@example.com')) == []
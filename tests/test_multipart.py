@@ -0,0 +1,125 @@
+import io
+import json
+import mmap
+import pathlib
+import responses
+import pyholster as ph
+import pytest
+from requests.packages import urllib3
+from email.parser import BytesParser
+
+from pyholster.multipart import MultipartBody
+
+
+def parse(body):
+    """Return the parts of a multipart body as email messages."""
+
+    content = b''.join(body)
+    header = 'Content-Type: {}\r\n\r\n'.format(body.content_type).encode()
+    return BytesParser().parsebytes(header + content).get_payload()
+
+
+class TestMultipartBody:
+
+    def test_fields(self):
+        data = {'from': 'foo@example.com', 'to': ['a@b.c', 'd@e.f'],
+                'cc': None}
+        body = MultipartBody(data, boundary='boundary')
+
+        expected, _ = urllib3.encode_multipart_formdata(
+            [('from', 'foo@example.com'), ('to', 'a@b.c'), ('to', 'd@e.f')],
+            boundary='boundary')
+
+        assert body.read(len(body) + 1) == expected
+        assert len(body) == len(expected)
+
+    def test_files(self, tmpdir):
+        path = tmpdir.join('report.pdf')
+        path.write_binary(b'%PDF' * 1000)
+
+        with open(str(path), 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                body = MultipartBody(
+                    {'subject': 'Hi'},
+                    [('attachment', pathlib.Path(str(path))),
+                     ('attachment', io.BytesIO(b'file object')),
+                     ('attachment', mm),
+                     ('inline', ('logo.png', b'PNG', 'image/png')),
+                     ('attachment', 'text')])
+
+                parts = parse(body)
+                body.seek(0)
+                assert len(b''.join(body)) == len(body)
+                body.close()
+
+        assert parts[0].get_payload() == 'Hi'
+        assert parts[1].get_filename() == 'report.pdf'
+        assert parts[1].get_payload(decode=True) == b'%PDF' * 1000
+        assert parts[2].get_payload(decode=True) == b'file object'
+        assert parts[3].get_payload(decode=True) == b'%PDF' * 1000
+        assert parts[4].get_filename() == 'logo.png'
+        assert parts[4].get_content_type() == 'image/png'
+        assert parts[5].get_payload(decode=True) == b'text'
+
+    def test_streaming(self):
+        file = io.BytesIO(b'x' * 100000)
+        body = MultipartBody(files={'message': file})
+
+        chunks = list(iter(lambda: body.read(1000), b''))
+        assert max(len(chunk) for chunk in chunks) == 1000
+        assert sum(len(chunk) for chunk in chunks) == len(body)
+
+        assert body.seek(0) == 0
+        assert body.tell() == 0
+        assert b''.join(chunks) == body.read(len(body))
+
+        with pytest.raises(ValueError):
+            body.seek(10)
+
+    def test_text_files(self, tmpdir):
+        path = tmpdir.join('notes.txt')
+        path.write_text('caf\u00e9 ' * 20000, encoding='utf-8')
+
+        with open(str(path), encoding='utf-8') as file:
+            body = MultipartBody(files=[('attachment', file),
+                                        ('attachment', io.StringIO('\u00fc'))])
+
+            chunks = list(iter(lambda: body.read(1000), b''))
+            assert max(len(chunk) for chunk in chunks) == 1000
+            assert sum(len(chunk) for chunk in chunks) == len(body)
+
+            body.seek(0)
+            parts = parse(body)
+
+        assert parts[0].get_filename() == 'notes.txt'
+        assert parts[0].get_payload(decode=True) == \
+            ('caf\u00e9 ' * 20000).encode('utf-8')
+        assert parts[1].get_payload(decode=True) == '\u00fc'.encode('utf-8')
+
+    @responses.activate
+    def test_post_files(self, tmpdir):
+        path = tmpdir.join('message.mime')
+        path.write_binary(b'MIME-Version: 1.0\r\n\r\nHello')
+
+        received = []
+
+        def callback(request):
+            received.append((request.headers['Content-Type'],
+                             request.body))
+            return (200, {}, json.dumps({'message': 'Queued. Thank you.',
+                                         'id': '<1@example.com>'}))
+
+        responses.add_callback(
+            responses.POST, ph.api.baseurl + '/example.com/messages.mime',
+            callback=callback)
+
+        mail = ph.Mail(domain='example.com', to='a@example.com',
+                       message=pathlib.Path(str(path)),
+                       client=ph.Client('key-test'))
+        assert mail.send()
+        assert mail.id == '<1@example.com>'
+
+        content_type, content = received[0]
+        assert content_type.startswith('multipart/form-data; boundary=')
+        assert b'filename="message.mime"' in content
+        assert b'MIME-Version: 1.0\r\n\r\nHello' in content
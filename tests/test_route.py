@@ -4,6 +4,7 @@ import pytest
 from dateutil import parser as dtparser
 import json
 import os
+from urllib.parse import parse_qs
 import pytest
 
 from utils import load_fixture
@@ -168,6 +169,46 @@ class TestRoute:
 
         assert not route.is_implemented()
 
+    @responses.activate
+    def test_update_without_probe(self):
+        responses.add(responses.PUT, ph.api.baseurl + '/routes/abc',
+                      status=200, body="{}")
+        responses.add(responses.PUT, ph.api.baseurl + '/routes/gone',
+                      status=404, body="{}")
+
+        route = ph.Route(id='abc', expression="valid expression",
+                         actions=["valid action"],
+                         client=ph.Client('key-test'))
+        route.update(priority=2)
+        assert route.is_implemented()
+        assert len(responses.calls) == 1
+
+        route = ph.Route(id='gone', expression="valid expression",
+                         actions=["valid action"],
+                         client=ph.Client('key-test'))
+        with pytest.raises(ph.errors.PHException):
+            route.update(priority=2)
+        assert not route.is_implemented()
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_update_changed_only(self):
+        responses.add(responses.PUT, ph.api.baseurl + '/routes/abc',
+                      status=200, body="{}")
+
+        route = ph.Route(id='abc', priority=1, expression="valid expression",
+                         actions=["valid action"], implemented=True,
+                         client=ph.Client('key-test'))
+
+        route.update(priority=1)
+        assert len(responses.calls) == 0
+
+        route.actions.append("other action")
+        route.update(priority=2)
+        assert len(responses.calls) == 1
+        assert parse_qs(responses.calls[0].request.body) == {
+            'priority': ['2'], 'action': ["valid action", "other action"]}
+
 
 class TestRouteWet:
 
@@ -204,3 +245,105 @@ class TestRouteWet:
                     route.delete()
                 except:
                     pass
+
+
+class TestRouteReconcile:
+
+    existing = [{'id': str(i), 'priority': 0,
+                 'description': 'route {}'.format(i) if i % 2 else '',
+                 'expression': 'match_recipient("r{}@example.com")'.format(i),
+                 'actions': ['forward("a{}@example.com")'.format(i)],
+                 'created_at': 'Wed, 15 Feb 2012 13:03:31 GMT'}
+                for i in range(5)]
+
+    def mock_routes(self, mock):
+        def callback(request):
+            query = parse_qs(request.url.split('?', 1)[1])
+            skip, limit = int(query['skip'][0]), int(query['limit'][0])
+            return (200, {}, json.dumps({
+                'total_count': len(self.existing),
+                'items': self.existing[skip:skip + limit]}))
+
+        mock.add_callback(responses.GET, ph.api.baseurl + '/routes',
+                          callback=callback)
+
+    def desired(self):
+        routes = [ph.Route(**dict((key, route[key]) for key in (
+            'priority', 'description', 'expression', 'actions')))
+                  for route in self.existing[:4]]
+        # Matched by description, with a new expression.
+        routes[1] = ph.Route(description='route 1', expression='changed',
+                             actions=self.existing[1]['actions'])
+        # Matched by expression, with a new priority.
+        routes[2] = ph.Route(expression=self.existing[2]['expression'],
+                             actions=self.existing[2]['actions'], priority=1)
+        routes.append(ph.Route(expression='new', actions=['stop()']))
+        return routes
+
+    def test_plan(self):
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            plan = ph.Route.plan(self.desired(), ph.Client('key-test'),
+                                 page_size=2)
+
+            assert len(mock.calls) == 3
+
+        assert [route.expression for route in plan.create] == ['new']
+        assert [(route.id, changes) for route, changes in plan.update] == [
+            ('1', {'expression': 'changed'}), ('2', {'priority': 1})]
+        assert [route.id for route in plan.delete] == ['4']
+        assert len(plan) == 4
+        assert '~ route 1 [1] (expression)' in str(plan)
+
+    def test_load_all(self):
+        client = ph.Client('key-test')
+
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            routes = ph.Route.load_all(client, page_size=2)
+            assert isinstance(routes, types.GeneratorType)
+            assert len(mock.calls) == 0
+
+            assert [route.id for route in routes] == ['0', '1', '2', '3', '4']
+            assert len(mock.calls) == 3
+
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            routes = list(ph.Route.load_all(client, page_size=2, limit=3,
+                                            prefetch=True))
+            assert [route.id for route in routes] == ['0', '1', '2']
+            assert len(mock.calls) <= 3
+
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            routes = list(ph.Route.load_all(client, limit=2))
+            assert [route.id for route in routes] == ['0', '1']
+            assert len(mock.calls) == 1
+
+    def test_reconcile(self):
+        client = ph.Client('key-test')
+
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            plan = ph.Route.reconcile(self.desired(), client, dry_run=True)
+            assert plan.results is None
+            assert [call.request.method for call in mock.calls] == ['GET']
+
+        with responses.RequestsMock() as mock:
+            self.mock_routes(mock)
+            mock.add(responses.POST, ph.api.baseurl + '/routes',
+                     body=json.dumps({'route': {'id': 'new'}}))
+            for i in ('1', '2'):
+                mock.add(responses.PUT, ph.api.baseurl + '/routes/' + i,
+                         body='{}')
+            mock.add(responses.DELETE, ph.api.baseurl + '/routes/4',
+                     body='{}')
+
+            plan = ph.Route.reconcile(self.desired(), client, workers=4)
+
+            assert sorted(call.request.method for call in mock.calls) == [
+                'DELETE', 'GET', 'POST', 'PUT', 'PUT']
+
+        assert plan.results.ok
+        assert plan.create[0].id == 'new'
+        assert plan.update[0][0].expression == 'changed'
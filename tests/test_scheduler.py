@@ -0,0 +1,118 @@
+import json
+import re
+import responses
+import pyholster as ph
+import pytest
+
+from pyholster.scheduler import Scheduler
+
+
+def mail(to, domain='example.com'):
+    return ph.Mail(sender="foo@{}".format(domain), domain=domain, to=to,
+                   subject="Hi", text="Hello")
+
+
+@pytest.fixture
+def sent():
+    """Mock Mailgun and return the list of recipients in sending order."""
+
+    recipients = []
+
+    def callback(request):
+        recipients.append(re.search(r'to=([^&]+)', request.body).group(1))
+        return (200, {}, json.dumps({'message': "Queued. Thank you.",
+                                     'id': '<{}>'.format(len(recipients))}))
+
+    with responses.RequestsMock() as mock:
+        mock.add_callback(responses.POST,
+                          re.compile(ph.api.baseurl + '/.*/messages'),
+                          callback=callback)
+        yield recipients
+
+
+class TestScheduler:
+
+    def test_priority(self, sent):
+        scheduler = Scheduler(client=ph.Client('key-test'), workers=1)
+
+        bulk = [scheduler.submit(mail('bulk{}'.format(i)))
+                for i in range(40)]
+        urgent = [scheduler.submit(mail('urgent{}'.format(i)),
+                                   'transactional') for i in range(4)]
+
+        with scheduler:
+            pass
+
+        assert all(future.result() for future in bulk + urgent)
+        positions = [sent.index('urgent{}'.format(i)) for i in range(4)]
+        assert max(positions) < 6
+
+        metrics = scheduler.metrics()
+        assert metrics['bulk']['sent'] == 40
+        assert metrics['bulk']['queued'] == 0
+        assert metrics['transactional']['sent'] == 4
+        latency = metrics['transactional']['latency']
+        assert latency['p50'] <= latency['p95'] <= latency['max']
+        assert metrics['bulk']['latency']['max'] >= latency['max']
+
+    def test_weights(self, sent):
+        scheduler = Scheduler(client=ph.Client('key-test'), workers=1,
+                              weights={'transactional': 3, 'bulk': 1})
+
+        for i in range(20):
+            scheduler.submit(mail('bulk{}'.format(i)))
+            scheduler.submit(mail('urgent{}'.format(i)), 'transactional')
+
+        with scheduler:
+            pass
+
+        first = sent[:20]
+        assert sum(to.startswith('urgent') for to in first) == 15
+
+    def test_domains(self, sent):
+        scheduler = Scheduler(client=ph.Client('key-test'), workers=1)
+
+        for i in range(10):
+            scheduler.submit(mail('big{}'.format(i), 'big.com'))
+        scheduler.submit(mail('small0', 'small.com'))
+        scheduler.submit(mail('small1', 'small.com'))
+
+        with scheduler:
+            pass
+
+        assert sent.index('small1') < 4
+
+    def test_failure(self):
+        with responses.RequestsMock() as mock:
+            mock.add(responses.POST, ph.api.baseurl + '/example.com/messages',
+                     status=400, body='{}')
+
+            with Scheduler(client=ph.Client('key-test'), workers=2) as \
+                    scheduler:
+                future = scheduler.submit(mail('a'), 'transactional')
+                with pytest.raises(ph.api.BadRequest):
+                    future.result(5)
+
+        assert scheduler.metrics()['transactional']['failed'] == 1
+
+    def test_stop_without_drain(self):
+        scheduler = Scheduler()
+        future = scheduler.submit(mail('a'))
+        scheduler.stop(drain=False)
+
+        assert future.cancelled()
+        with pytest.raises(RuntimeError):
+            scheduler.submit(mail('b'))
+        with pytest.raises(ValueError):
+            Scheduler().submit(mail('c'), 'urgent')
+
+    def test_rate(self, sent):
+        scheduler = Scheduler(client=ph.Client('key-test'), rate=100,
+                              capacity=1, workers=4)
+        with scheduler:
+            futures = [scheduler.submit(mail('a{}'.format(i)))
+                       for i in range(10)]
+            assert all(future.result(5) for future in futures)
+
+        wait = scheduler.metrics()['bulk']['wait']
+        assert wait['max'] >= 0.05
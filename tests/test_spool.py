@@ -0,0 +1,201 @@
+import io
+import json
+import pathlib
+import responses
+import pyholster as ph
+import pytest
+import requests
+import sqlite3
+import time
+
+from pyholster.spool import Spool
+
+
+url = ph.api.baseurl + '/example.com/messages'
+
+
+def queued(id='<1@example.com>'):
+    return dict(status=200, body=json.dumps(
+        {'message': "Queued. Thank you.", 'id': id}))
+
+
+def mail(**kwargs):
+    return ph.Mail(sender="foo@example.com", domain="example.com",
+                   to="a@example.com", subject="Hi", text="Hello",
+                   **kwargs)
+
+
+@pytest.fixture
+def spool(tmpdir):
+    return Spool(str(tmpdir.join('spool.db')), client=ph.Client('key-test'),
+                 workers=2, backoff=0)
+
+
+class TestSpool:
+
+    @responses.activate
+    def test_send(self, spool):
+        responses.add(responses.POST, url, **queued())
+
+        spool_id = spool.enqueue(mail())
+        assert spool.status(spool_id)['status'] == 'queued'
+
+        spool.drain()
+
+        status = spool.status(spool_id)
+        assert status['status'] == 'sent'
+        assert status['attempts'] == 1
+        assert status['message_id'] == '<1@example.com>'
+        assert spool.status('<1@example.com>')['id'] == spool_id
+        assert spool.status('unknown') is None
+        assert spool.counts() == {'sent': 1}
+
+    @responses.activate
+    def test_priority(self, spool):
+        responses.add(responses.POST, url, **queued())
+        spool.batch_size = 1
+        spool.workers = 1
+
+        bulk = spool.enqueue(mail(), priority=0)
+        urgent = spool.enqueue(mail(), priority=10)
+        spool.process()
+
+        assert spool.status(urgent)['status'] == 'sent'
+        assert spool.status(bulk)['status'] == 'queued'
+
+    @responses.activate
+    def test_retry(self, spool):
+        responses.add(responses.POST, url, status=429, body='{}')
+        spool.max_attempts = 2
+
+        spool_id = spool.enqueue(mail())
+        spool.process()
+
+        status = spool.status(spool_id)
+        assert status['status'] == 'queued'
+        assert 'TooManyRequests' in status['error']
+
+        spool.drain()
+        assert spool.status(spool_id)['status'] == 'failed'
+        assert spool.status(spool_id)['attempts'] == 2
+
+    @responses.activate
+    def test_connection_errors(self, spool):
+        responses.add(responses.POST, url,
+                      body=requests.exceptions.ConnectTimeout())
+        spool_id = spool.enqueue(mail())
+        spool.process()
+
+        status = spool.status(spool_id)
+        assert status['status'] == 'queued'
+        assert 'ConnectionError' in status['error']
+
+        # Now the message may have reached Mailgun; it is not sent twice.
+        responses.replace(responses.POST, url,
+                          body=requests.exceptions.ReadTimeout())
+        spool.drain()
+
+        status = spool.status(spool_id)
+        assert status['status'] == 'failed'
+        assert status['attempts'] == 2
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_server_errors(self, spool):
+        # Mailgun may have accepted the message; it is not sent twice.
+        responses.add(responses.POST, url, status=503, body='{}')
+        responses.add(responses.POST, url, status=200, body='<html>')
+        first = spool.enqueue(mail())
+        spool.drain()
+        second = spool.enqueue(mail())
+        spool.drain()
+
+        for spool_id in (first, second):
+            status = spool.status(spool_id)
+            assert status['status'] == 'failed'
+            assert 'ServerError' in status['error']
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_update_errors(self, spool, monkeypatch, caplog):
+        responses.add(responses.POST, url, **queued())
+
+        def update(*args, **kwargs):
+            raise sqlite3.OperationalError("database is locked")
+
+        spool_id = spool.enqueue(mail())
+        monkeypatch.setattr(spool, '_update', update)
+        assert spool.process() == 1
+
+        assert spool_id in caplog.text
+        assert 'database is locked' in caplog.text
+
+    @responses.activate
+    def test_backoff(self, spool):
+        responses.add(responses.POST, url, status=429, body='{}')
+        spool.backoff = 60
+
+        spool_id = spool.enqueue(mail())
+        spool.drain()
+
+        assert spool.status(spool_id)['status'] == 'queued'
+        assert spool.process() == 0
+
+    @responses.activate
+    def test_permanent_failure(self, spool):
+        responses.add(responses.POST, url, status=400, body='{}')
+
+        spool_id = spool.enqueue(mail())
+        spool.drain()
+
+        assert spool.status(spool_id)['status'] == 'failed'
+        assert spool.status(spool_id)['attempts'] == 1
+
+    @responses.activate
+    def test_crash_recovery(self, spool):
+        responses.add(responses.POST, url, **queued())
+        spool.lease = 0
+
+        spool_id = spool.enqueue(mail())
+        # A process claims the message and dies before sending it.
+        assert len(spool._claim()) == 1
+        assert spool.status(spool_id)['status'] == 'sending'
+
+        spool.drain()
+        assert spool.status(spool_id)['status'] == 'sent'
+        assert spool.status(spool_id)['attempts'] == 2
+
+    @responses.activate
+    def test_attachments(self, spool, tmpdir):
+        responses.add(responses.POST, url, **queued())
+        path = tmpdir.join('report.pdf')
+        path.write_binary(b'%PDF')
+
+        spool.enqueue(mail(attachments=[pathlib.Path(str(path)), b'bytes',
+                                        ('a.txt', b'text', 'text/plain'),
+                                        io.StringIO('caf\u00e9')]))
+        spool.drain()
+
+        body = responses.calls[0].request.body
+        assert b'filename="report.pdf"' in body
+        assert b'bytes' in body
+        assert b'filename="a.txt"' in body
+        assert 'caf\u00e9'.encode('utf-8') in body
+
+    @responses.activate
+    def test_background(self, spool):
+        responses.add(responses.POST, url, **queued())
+        spool.poll_interval = 0.01
+
+        with spool:
+            ids = [spool.enqueue(mail()) for _ in range(5)]
+            deadline = time.monotonic() + 5
+            while spool.counts().get('sent') != 5:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+        assert all(spool.status(i)['status'] == 'sent' for i in ids)
+
+    def test_invalid_mail(self, spool):
+        with pytest.raises(ValueError):
+            spool.enqueue(ph.Mail(domain="example.com"))
@@ -0,0 +1,68 @@
+import json
+import pytest
+
+from pyholster.stream import ItemStream
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestItemStream:
+
+    body = {'total_count': 3,
+            'items': [{'address': 'm{}@example.com'.format(i),
+                       'name': 'é' * i, 'vars': {'id': 12345 + i},
+                       'subscribed': i % 2 == 0} for i in range(20)],
+            'paging': {'next': 'https://example.com/next'}}
+
+    @pytest.mark.parametrize('size', [1, 2, 5, 64, 100000])
+    def test_items(self, size):
+        items = ItemStream(chunked(json.dumps(self.body).encode(), size))
+
+        assert list(items) == self.body['items']
+        assert items.fields == {'total_count': 3,
+                                'paging': self.body['paging']}
+
+    def test_lazy(self):
+        received = []
+
+        def chunks():
+            for chunk in chunked(json.dumps(self.body).encode(), 16):
+                received.append(chunk)
+                yield chunk
+
+        items = iter(ItemStream(chunks()))
+        assert next(items) == self.body['items'][0]
+        assert len(received) < 10
+
+    def test_empty(self):
+        assert list(ItemStream([b'{}'])) == []
+        assert list(ItemStream([b' {"items" : [ ] } '])) == []
+        assert list(ItemStream([b'{"items": []}'], key='other')) == []
+
+    def test_close(self):
+        closed = []
+        items = ItemStream([json.dumps(self.body).encode()],
+                           close=lambda: closed.append(True))
+
+        assert next(iter(items)) == self.body['items'][0]
+        assert not closed
+        items.close()
+        assert closed == [True]
+
+        closed[:] = []
+        list(ItemStream([b'{"items": [1]}'],
+                        close=lambda: closed.append(True)))
+        assert closed == [True]
+
+    @pytest.mark.parametrize('body', [
+        b'[1, 2]', b'{"items": [1, 2', b'{"items": [1 2]}',
+        b'{"items": [1,]}', b'{"items": [1]', b'{1: 2}',
+        b'{"items": ["\xff"]}'])
+    def test_malformed(self, body):
+        class Malformed(Exception):
+            pass
+
+        with pytest.raises(Malformed):
+            list(ItemStream([body], error=Malformed))